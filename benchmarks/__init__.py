@@ -0,0 +1 @@
+"""Benchmarks offline do gerador de playlist (sem rede)."""
@@ -0,0 +1,81 @@
+"""
+Benchmark de memoria: registros Channel (__slots__) vs dicts por canal
+
+Parseia o playlist.m3u versionado (replicado N vezes) e compara a memoria
+retida pela tabela de Channel com a da representacao antiga em dicts
+(um dict de atributos + um dict por canal, como antes do Channel).
+
+Uso: python benchmarks/bench_memory.py [--scale 10]
+"""
+
+import os
+import sys
+import argparse
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_playlist import parse_m3u_to_channels  # noqa: E402
+
+PLAYLIST = os.path.join(ROOT, 'playlist.m3u')
+
+
+def read_lines(scale):
+    """Linhas do playlist.m3u replicadas `scale` vezes (URLs distintas por copia)."""
+    with open(PLAYLIST, encoding='utf-8') as f:
+        lines = f.read().split('\n')
+    for i in range(scale):
+        for line in lines:
+            if line.startswith('http'):
+                sep = '&' if '?' in line else '?'
+                yield f'{line}{sep}copy={i}'
+            else:
+                yield line
+
+
+def measure(label, build, scale):
+    tracemalloc.start()
+    table = build(read_lines(scale))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label}: {len(table)} canais, {current / 1e6:.1f} MB retidos "
+          f"({current / len(table):.0f} bytes/canal), pico {peak / 1e6:.1f} MB")
+    return current
+
+
+def build_channels(lines):
+    return list(parse_m3u_to_channels(lines, 'bench', 'BR'))
+
+
+def build_dicts(lines):
+    # Representacao anterior: dict por canal com copias das strings
+    # (source/region/grupo nao internados) e dict de atributos.
+    return [
+        {
+            'name': ch.name,
+            'url': ch.url,
+            'duration': ''.join(ch.duration),
+            'attrs': {''.join(k): ''.join(v) for k, v in ch.attr_dict().items()},
+            'source': ''.join(['ben', 'ch']),
+            'region': ''.join(['B', 'R']),
+            'original_group': ''.join(ch.original_group),
+            'logo': ''.join(ch.logo),
+        }
+        for ch in parse_m3u_to_channels(lines, 'bench', 'BR')
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de memoria da tabela de canais')
+    parser.add_argument('--scale', type=int, default=10,
+                        help='multiplicador do playlist.m3u (padrao: %(default)s)')
+    args = parser.parse_args()
+
+    dicts = measure('dicts  ', build_dicts, args.scale)
+    slots = measure('Channel', build_channels, args.scale)
+    print(f"Reducao: {(1 - slots / dicts) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
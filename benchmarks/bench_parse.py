@@ -0,0 +1,104 @@
+"""
+Benchmark de parse de playlists M3U (sem rede)
+
+Mede parse_m3u_to_channels + serializacao EXTINF sobre o playlist.m3u versionado e
+sobre um arquivo sintetico N vezes maior (padrao: 100x), lido linha a linha.
+Antes confere o round-trip parse_extinf -> format_extinf -> parse_extinf nos
+casos de ROUNDTRIP_CASES e em todas as linhas do playlist.m3u.
+
+Uso: python benchmarks/bench_parse.py [--scale 100]
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from generate_playlist import parse_m3u_to_channels, parse_extinf, format_extinf  # noqa: E402
+
+PLAYLIST = os.path.join(ROOT, 'playlist.m3u')
+
+# Linha EXTINF -> (duracao, atributos, nome) esperados
+ROUNDTRIP_CASES = [
+    ('#EXTINF:-1 tvg-id="x" group-title="News",Name',
+     ('-1', {'tvg-id': 'x', 'group-title': 'News'}, 'Name')),
+    ('#EXTINF:-1 tvg-id="x" catchup-days=7 group-title="News",Name',
+     ('-1', {'tvg-id': 'x', 'catchup-days': '7', 'group-title': 'News'}, 'Name')),
+    ('#EXTINF:0 tvg-logo="" tvg-shift=-3,Canal, com virgula',
+     ('0', {'tvg-logo': '', 'tvg-shift': '-3'}, 'Canal, com virgula')),
+    ('#EXTINF:-1,Nome=Com Igual', ('-1', {}, 'Nome=Com Igual')),
+]
+
+
+def check_roundtrip():
+    """Confere parse_extinf nos casos conhecidos e que format_extinf preserva o que foi lido."""
+    lines = [line for line, _ in ROUNDTRIP_CASES]
+    with open(PLAYLIST, encoding='utf-8') as f:
+        lines += [line.rstrip('\n') for line in f if line.startswith('#EXTINF')]
+    for line, expected in ROUNDTRIP_CASES:
+        if parse_extinf(line) != expected:
+            sys.exit(f'parse_extinf({line!r}) = {parse_extinf(line)!r}, esperado {expected!r}')
+    for line in lines:
+        parsed = parse_extinf(line)
+        again = parse_extinf(format_extinf(*parsed))
+        if again != parsed:
+            sys.exit(f'round-trip diferente para {line!r}: {parsed!r} -> {again!r}')
+    print(f"round-trip: {len(lines)} linhas EXTINF ok")
+
+
+def write_scaled_playlist(path, scale):
+    """Replica as entradas do playlist.m3u `scale` vezes, variando as URLs."""
+    with open(PLAYLIST, encoding='utf-8') as f:
+        entries = []
+        extinf = None
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('#EXTINF'):
+                extinf = line
+            elif line.startswith('http') and extinf:
+                entries.append((extinf, line))
+                extinf = None
+
+    with open(path, 'w', encoding='utf-8') as out:
+        out.write('#EXTM3U\n')
+        for i in range(scale):
+            for extinf, url in entries:
+                sep = '&' if '?' in url else '?'
+                out.write(f'{extinf}\n{url}{sep}copy={i}\n')
+    return len(entries) * scale
+
+
+def bench(path, label):
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    count = 0
+    with open(path, encoding='utf-8') as f:
+        for ch in parse_m3u_to_channels(f, 'bench', 'BR'):
+            ch.extinf('BR')
+            count += 1
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {count} canais em {elapsed:.2f}s "
+          f"({count / elapsed:,.0f} canais/s, {size / elapsed / 1e6:.1f} MB/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de parse M3U')
+    parser.add_argument('--scale', type=int, default=100,
+                        help='multiplicador do arquivo sintetico (padrao: %(default)s)')
+    args = parser.parse_args()
+
+    check_roundtrip()
+    bench(PLAYLIST, 'playlist.m3u')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.m3u')
+        write_scaled_playlist(path, args.scale)
+        bench(path, f'sintetico {args.scale}x')
+
+
+if __name__ == '__main__':
+    main()
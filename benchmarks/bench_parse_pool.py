@@ -0,0 +1,86 @@
+"""
+Benchmark do parse em processos (parse_m3u_parallel) contra o parse na thread
+
+Gera um corpus sintetico (padrao: 1M entradas), parseia-o linha a linha com
+parse_m3u_to_channels e com parse_m3u_parallel para cada numero de processos
+pedido, e confere que os canais saem identicos e na mesma ordem.
+
+Uso:
+  python -m benchmarks.bench_parse_pool
+  python -m benchmarks.bench_parse_pool --entries 200000 --processes 1,2,4,8
+"""
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate_playlist as gp  # noqa: E402
+from benchmarks.corpus import write_corpus  # noqa: E402
+
+
+def digest(channels):
+    """Quantidade e hash dos canais (na ordem em que sairam)."""
+    h = hashlib.blake2b(digest_size=16)
+    count = 0
+    for ch in channels:
+        h.update('\x1f'.join([ch.name, ch.url, ch.duration, *ch.attrs]).encode())
+        count += 1
+    return count, h.hexdigest()
+
+
+def run(path, pool=None, window=4, chunk_lines=gp.PARSE_CHUNK_LINES):
+    start = time.perf_counter()
+    with open(path, encoding='utf-8') as f:
+        lines = (line.rstrip('\n') for line in f)
+        if pool:
+            channels = gp.parse_m3u_parallel(lines, 'bench', 'BR', pool, window, chunk_lines)
+        else:
+            channels = gp.parse_m3u_to_channels(lines, 'bench', 'BR')
+        result = digest(channels)
+    return time.perf_counter() - start, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do parse em processos')
+    parser.add_argument('--entries', type=int, default=1_000_000)
+    parser.add_argument('--processes', default=f'1,2,4,{os.cpu_count()}',
+                        help='lista de numeros de processos (padrao: %(default)s)')
+    parser.add_argument('--chunk-lines', type=int, default=gp.PARSE_CHUNK_LINES)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    counts = sorted({int(n) for n in args.processes.split(',')})
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                          else 'spawn')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.m3u')
+        write_corpus(path, args.entries, args.seed)
+        size = os.path.getsize(path)
+        print(f"{args.entries:,} entradas ({size / 1e6:.0f} MB), {os.cpu_count()} CPUs, "
+              f"trechos de {args.chunk_lines:,} linhas")
+        print(f"\n  {'modo':<14} {'tempo':>8} {'canais/s':>11} {'MB/s':>7} {'ganho':>7}")
+
+        inline, expected = run(path)
+        print(f"  {'thread':<14} {inline:>7.2f}s {expected[0] / inline:>11,.0f} {size / inline / 1e6:>7.1f} {'1.00x':>7}")
+
+        for n in counts:
+            with ProcessPoolExecutor(n, mp_context=context) as pool:
+                # Sobe os processos antes de medir
+                list(pool.map(abs, range(n)))
+                elapsed, result = run(path, pool, window=2 * n, chunk_lines=args.chunk_lines)
+            status = '' if result == expected else '  DIFERENTE DO PARSE NA THREAD'
+            print(f"  {f'{n} processos':<14} {elapsed:>7.2f}s {result[0] / elapsed:>11,.0f} "
+                  f"{size / elapsed / 1e6:>7.1f} {inline / elapsed:>6.2f}x{status}")
+
+
+if __name__ == '__main__':
+    main()
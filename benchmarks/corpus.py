@@ -0,0 +1,149 @@
+"""
+Gerador de corpus M3U sintetico
+
+Produz playlists com a mesma mistura do playlist.m3u versionado: perfis de
+atributos (sem atributos, iptv-org, apps FAST com channel-id/tvg-chno,
+m3u4u com shift/tvg-language...), nomes com numero de canal, tags de
+resolucao/status e sufixo da plataforma, e URLs com query strings longas de
+ads. Uma parte das entradas repete a URL de outra com query diferente, para
+exercitar a deduplicacao. A saida e deterministica para um mesmo `seed`.
+
+Uso: python -m benchmarks.corpus 100000 corpus.m3u [--seed 0]
+"""
+
+import random
+import argparse
+
+WORDS = [
+    'News', 'Sports', 'Movies', 'Classic', 'Kids', 'Music', 'Rock', 'Comedy', 'Drama',
+    'Cinema', 'Nature', 'Travel', 'Food', 'Auto', 'Game', 'Anime', 'Western', 'Crime',
+    'Reality', 'Latino', 'Retro', 'Hits', 'Live', 'World', 'Weather', 'Business',
+    'Novelas', 'Esporte', 'Filmes', 'Infantil', 'Musica', 'Documentarios', 'Culinaria',
+    'TV', 'Channel', 'Plus', 'Max', 'One', 'Brasil', 'America', 'Global',
+]
+NEWS_NAMES = [
+    'CNN Brasil', 'Record News', 'BandNews TV', 'Jovem Pan News', 'SBT News',
+    'Times Brasil', 'Canal Rural', 'TV 247', 'Euronews Português', 'Bloomberg TV+',
+]
+NUMBER_PREFIXES = ['{n} - ', '{n}. ', '{n} | ', '#{n} ', '{n} ']
+TAGS = [' (720p)', ' (1080p)', ' (1080i)', ' (480p)', ' [Geo-blocked]', ' [Not 24/7]', ' [Offline]']
+PLATFORM_SUFFIXES = [' - Pluto TV', ' | Samsung TV Plus', ' (Roku)', ' (Plex)', ' - LG Channels', ' [Tubi]']
+GROUPS = ['News', 'Noticias', 'Entertainment', 'Movies', 'Sports', 'Kids', 'Music', 'Undefined', 'Brasil', '']
+REGIONS = ['BR', 'US', 'CA', 'GB', 'PT', 'AU']
+
+HOSTS = [
+    ('https://jmp2.uk', '/plu-{id}.m3u8', ''),
+    ('https://epg.provider.plex.tv', '/library/parts/{id}-{id2}/', 'X-Plex-Token={token}'),
+    ('https://cdn-uw2-prod.tsv2.amagi.tv', '/linear/amg{num}-{slug}/playlist.m3u8',
+     'ads.deviceid=[DEVICE_ID]&ads.ifa=[IFA]&ads.ifatype=[IFA_TYPE]&ads.lat=[LMT]&ads.gdpr=[GDPR]'
+     '&ads.country=[COUNTRY]&ads.usprivacy=[US_PRIVACY]&ads.appname=[APP_NAME]&ads.devicemake=[DEVICE_MAKE]'),
+    ('http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv', '/stitch/hls/channel/{id}/master.m3u8',
+     'appName=web&appVersion=unknown&deviceDNT=0&deviceId={token}&deviceMake=Chrome&deviceModel=web'
+     '&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false'),
+    ('https://d3is52sgpnlx4c.cloudfront.net', '/{num}/{num2}/hls/master.m3u8',
+     'withResolution=true&ads.xumo_channelId={num2}&ads.csid=viziowatchfree_us_{slug}_ssai&ads._fw_coppa=1'),
+    ('https://lotus.stingray.com', '/manifest/ose-{num}ads-montreal/samsungtvplus/master.m3u8', ''),
+    ('https://live-manifest.production-public.tubi.io', '/live/{id}/playlist.m3u8', 'content_id={num}'),
+    ('https://videos.impresa.pt', '/live/{slug}/index.m3u8', ''),
+    ('https://{slug}.example-cdn.net', '/hls/{slug}/index.m3u8', ''),
+]
+
+LOGO_HOSTS = ['https://i.imgur.com/{token}.png', 'https://images.pluto.tv/channels/{id}/colorLogoPNG.png',
+              'https://upload.wikimedia.org/wikipedia/commons/{num}/{slug}.png', '']
+
+
+def _hex(rng, n=24):
+    return '%0*x' % (n, rng.getrandbits(n * 4))
+
+
+def _token(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789') for _ in range(20))
+
+
+def _fill(template, rng, slug):
+    return template.format(id=_hex(rng), id2=_hex(rng), token=_token(rng), num=rng.randint(1, 99999),
+                           num2=rng.randint(1, 99999999), slug=slug)
+
+
+def _name(rng):
+    if rng.random() < 0.05:
+        base = rng.choice(NEWS_NAMES)
+    else:
+        base = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+    name = base
+    if rng.random() < 0.15:
+        name = rng.choice(NUMBER_PREFIXES).format(n=rng.randint(1, 9999)) + name
+    if rng.random() < 0.30:
+        name += rng.choice(TAGS)
+    if rng.random() < 0.10:
+        name += rng.choice(PLATFORM_SUFFIXES)
+    return base, name
+
+
+def _attrs(rng, base, slug, logo):
+    profile = rng.random()
+    group = rng.choice(GROUPS)
+    if profile < 0.05:
+        return ''
+    if profile < 0.15:
+        return f' group-title="{group}"'
+    if profile < 0.55:
+        # apps FAST (Pluto, Samsung, Plex...)
+        cid = _hex(rng)
+        return (f' channel-id="{cid}" tvg-id="{cid}" tvg-chno="{rng.randint(1, 2000)}" tvg-name="{base}"'
+                f' tvg-logo="{logo}" group-title="{group}"')
+    if profile < 0.90:
+        # iptv-org
+        return f' tvg-id="{slug}.{rng.choice(REGIONS).lower()}@SD" tvg-logo="{logo}" group-title="{group}"'
+    # m3u4u
+    return (f' group-title="{group}" tvg-id="" tvg-name="{base}" tvg-logo="{logo}" url-tvg="" shift="-3"'
+            f' tvg-language="Portuguese" audio-track="por" aspect-ratio="16:9" subtitles="por"'
+            f' tvg-country="BR" size="Medium" background="#000000"')
+
+
+def generate_corpus(count, seed=0, duplicate_ratio=0.1):
+    """Gera as linhas de uma playlist M3U sintetica com `count` entradas."""
+    rng = random.Random(seed)
+    recent_urls = []
+    yield '#EXTM3U'
+    for _ in range(count):
+        base, name = _name(rng)
+        slug = '-'.join(base.lower().split())
+        logo = _fill(rng.choice(LOGO_HOSTS), rng, slug)
+        attrs = _attrs(rng, base, slug, logo)
+        duration = '0' if ' shift=' in attrs else '-1'
+        yield f'#EXTINF:{duration}{attrs},{name}'
+
+        if recent_urls and rng.random() < duplicate_ratio:
+            # Mesmo stream com outra query string (removido pela deduplicacao)
+            url = rng.choice(recent_urls).split('?')[0] + f'?dup={rng.randint(1, 10**6)}'
+        else:
+            host, path, query = rng.choice(HOSTS)
+            url = _fill(host + path, rng, slug)
+            if query:
+                url += '?' + _fill(query, rng, slug)
+            recent_urls.append(url)
+            if len(recent_urls) > 1000:
+                recent_urls.pop(0)
+        yield url
+
+
+def write_corpus(path, count, seed=0):
+    """Grava o corpus em `path` (linha a linha, sem montar o arquivo em memoria)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for line in generate_corpus(count, seed):
+            f.write(line)
+            f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera uma playlist M3U sintetica')
+    parser.add_argument('count', type=int, help='numero de entradas')
+    parser.add_argument('output', help='arquivo de saida')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_corpus(args.output, args.count, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+Servidor local que imita streams HLS para benchmarks de teste de canais
+
+Cada URL descreve o comportamento esperado na query string:
+
+  b=ok         200 com master playlist (Content-Length, keep-alive); as
+               variantes apontam para b=media, que lista um b=segment
+  b=media      media playlist com segmentos b=segment
+  b=segment    bytes de MPEG-TS (responde 206 a pedidos com Range)
+  b=deadvariant master playlist cujas variantes respondem 404
+  b=html       200 com uma pagina HTML (portal de login, pagina de erro)
+  b=slow       cabecalhos na hora, corpo so depois de `body` ms
+  b=stall      cabecalhos e depois nada (conexao fica parada)
+  b=reset      fecha a conexao com RST antes de responder
+  b=status     responde com o codigo `code` (403, 404, 500, 503...)
+  b=redirect   cadeia de `hops` redirecionamentos terminando em b=ok
+  b=empty      200 com corpo vazio
+  lat=<ms>     atraso antes dos cabecalhos (latencia do primeiro byte)
+
+Roda num loop asyncio em thread propria, entao aguenta milhares de
+conexoes simultaneas. Pode escutar em varios enderecos de loopback
+(127.0.0.1, 127.0.0.2, ...) para simular hosts diferentes.
+
+Uso isolado: python -m benchmarks.fake_server [--port 8765]
+"""
+
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+MASTER_PLAYLIST = (
+    b'#EXTM3U\n'
+    b'#EXT-X-STREAM-INF:BANDWIDTH=2560000,RESOLUTION=1280x720,CODECS="avc1.4d401f,mp4a.40.2"\n'
+    b'720p.m3u8?b=media\n'
+    b'#EXT-X-STREAM-INF:BANDWIDTH=5120000,RESOLUTION=1920x1080,CODECS="avc1.640028,mp4a.40.2"\n'
+    b'1080p.m3u8?b=media\n'
+)
+DEAD_MASTER_PLAYLIST = MASTER_PLAYLIST.replace(b'?b=media', b'?b=status&code=404')
+MEDIA_PLAYLIST = (
+    b'#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n#EXT-X-MEDIA-SEQUENCE:1\n'
+    b'#EXTINF:6.0,\nseg1.ts?b=segment\n#EXTINF:6.0,\nseg2.ts?b=segment\n'
+)
+# Pacotes TS de 188 bytes (sync byte 0x47)
+SEGMENT = (b'\x47' + b'\xff' * 187) * 64
+HTML_PAGE = b'<!DOCTYPE html>\n<html><head><title>Login</title></head><body>Acesso restrito</body></html>\n'
+
+REASONS = {200: 'OK', 206: 'Partial Content', 301: 'Moved Permanently', 302: 'Found',
+           403: 'Forbidden', 404: 'Not Found', 500: 'Internal Server Error', 502: 'Bad Gateway',
+           503: 'Service Unavailable'}
+
+
+def _response(status, body=b'', headers=()):
+    lines = [f'HTTP/1.1 {status} {REASONS.get(status, "Unknown")}', f'Content-Length: {len(body)}']
+    lines += [f'{key}: {value}' for key, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def _segment_response(byte_range):
+    if byte_range.startswith('bytes='):
+        first, _, last = byte_range[6:].partition('-')
+        first = int(first or 0)
+        last = min(int(last) if last else len(SEGMENT) - 1, len(SEGMENT) - 1)
+        return _response(206, SEGMENT[first:last + 1], [
+            ('Content-Type', 'video/mp2t'), ('Content-Range', f'bytes {first}-{last}/{len(SEGMENT)}')])
+    return _response(200, SEGMENT, [('Content-Type', 'video/mp2t')])
+
+
+class FakeStreamServer:
+    """Servidor HTTP/1.1 com comportamentos configuraveis por URL."""
+
+    def __init__(self, hosts=('127.0.0.1',), port=0):
+        self.hosts = list(hosts)
+        self.port = port
+        self.loop = None
+        self.servers = []
+        self.handlers = set()  # tarefas das conexoes abertas
+        self.requests = 0
+        self.connections = 0
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='fake-stream-server', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._listen())
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _listen(self):
+        usable = []
+        for host in self.hosts:
+            try:
+                server = await asyncio.start_server(self._handle, host, self.port, backlog=4096)
+            except OSError:
+                continue  # endereco de loopback indisponivel neste sistema
+            if not self.port:
+                self.port = server.sockets[0].getsockname()[1]
+            self.servers.append(server)
+            usable.append(host)
+        self.hosts = usable
+
+    def stop(self):
+        """Fecha os servidores, cancela as conexoes em andamento (b=stall dorme 1h) e encerra o loop."""
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def _shutdown(self):
+        for server in self.servers:
+            server.close()
+        for task in self.handlers:
+            task.cancel()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        for server in self.servers:
+            await server.wait_closed()
+
+    def url(self, host, path='/live', **params):
+        query = '&'.join(f'{key}={value}' for key, value in params.items())
+        return f'http://{host}:{self.port}{path}?{query}'
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                self.requests += 1
+                target = request_line.decode('latin-1').split()[1]
+                if not await self._respond(target, headers, writer):
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass  # stop(): termina a conexao normalmente (uma tarefa cancelada vira erro no asyncio.streams)
+        finally:
+            self.handlers.discard(task)
+            if not writer.is_closing():
+                writer.close()
+
+    async def _respond(self, target, headers, writer):
+        """Envia a resposta; retorna False se a conexao deve ser encerrada."""
+        parts = urlsplit(target)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        behaviour = params.get('b', 'ok')
+
+        if params.get('lat'):
+            await asyncio.sleep(int(params['lat']) / 1000)
+
+        if behaviour == 'reset':
+            sock = writer.get_extra_info('socket')
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            writer.transport.abort()
+            return False
+
+        if behaviour == 'status':
+            writer.write(_response(int(params.get('code', 500)), b'<html>error</html>'))
+        elif behaviour == 'media':
+            writer.write(_response(200, MEDIA_PLAYLIST, [('Content-Type', 'application/vnd.apple.mpegurl')]))
+        elif behaviour == 'segment':
+            writer.write(_segment_response(headers.get('range', '')))
+        elif behaviour == 'deadvariant':
+            writer.write(_response(200, DEAD_MASTER_PLAYLIST, [('Content-Type', 'application/vnd.apple.mpegurl')]))
+        elif behaviour == 'html':
+            writer.write(_response(200, HTML_PAGE, [('Content-Type', 'text/html')]))
+        elif behaviour == 'empty':
+            writer.write(_response(200))
+        elif behaviour == 'redirect':
+            hops = int(params.get('hops', 1))
+            following = dict(params, hops=hops - 1) if hops > 1 else {'b': 'ok'}
+            location = parts.path + '?' + '&'.join(f'{k}={v}' for k, v in following.items())
+            writer.write(_response(302, headers=[('Location', location)]))
+        elif behaviour in ('slow', 'stall'):
+            head = _response(200, MASTER_PLAYLIST)
+            writer.write(head[:-len(MASTER_PLAYLIST)])
+            await writer.drain()
+            if behaviour == 'stall':
+                await asyncio.sleep(3600)
+                return False
+            await asyncio.sleep(int(params.get('body', 1000)) / 1000)
+            writer.write(MASTER_PLAYLIST)
+        else:
+            writer.write(_response(200, MASTER_PLAYLIST, [('Content-Type', 'application/vnd.apple.mpegurl')]))
+        await writer.drain()
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local de streams falsos')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--hosts', type=int, default=1, help='enderecos 127.0.0.x para escutar')
+    args = parser.parse_args()
+    server = FakeStreamServer([f'127.0.0.{i}' for i in range(1, args.hosts + 1)], args.port).start()
+    print(f"Escutando em {', '.join(server.hosts)} porta {server.port} (Ctrl+C para sair)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
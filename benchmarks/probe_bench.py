@@ -0,0 +1,170 @@
+"""
+Benchmark de teste de canais contra o servidor local (benchmarks.fake_server)
+
+Gera uma lista de canais com uma mistura de comportamentos (streams OK,
+lentos, parados apos os cabecalhos, resets, 403/404/5xx, redirecionamentos,
+200 vazio, paginas HTML, master playlists com variantes mortas, latencia
+acima do timeout, hosts sem DNS e um host inteiro parado) espalhados por
+varios hosts de
+loopback, cada um com sua distribuicao de latencia. Para cada motor e
+configuracao reporta testes/s, p50/p99 do tempo por teste, bytes baixados,
+timeouts repetidos com o prazo maior (e quantos canais isso salvou) e
+quantos canais foram classificados diferente do esperado. Um sufixo
+`:simple` na configuracao desliga o teste em camadas (html e variantes
+mortas passam a ser esperadas como OK).
+
+Uso:
+  python -m benchmarks.probe_bench
+  python -m benchmarks.probe_bench --channels 5000 --settings async:200,async:1000,threads:8
+  python -m benchmarks.probe_bench --settings async:500,async:500:simple
+"""
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import contextlib
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate_playlist as gp  # noqa: E402
+from benchmarks.fake_server import FakeStreamServer  # noqa: E402
+
+# (comportamento, peso)
+BEHAVIOURS = [
+    ('ok', 55), ('redirect', 7), ('slow', 5), ('stall', 3), ('reset', 3),
+    ('403', 4), ('404', 4), ('500', 2), ('503', 2), ('empty', 5), ('timeout', 10),
+    ('html', 3), ('deadvariant', 3), ('nodns', 2), ('downhost', 4),
+]
+# Status esperado no modo simples quando difere do modo em camadas
+SIMPLE_EXPECTED = {'html': 'OK', 'deadvariant': 'OK'}
+# Mediana de latencia (ms) de cada perfil de host
+HOST_PROFILES = [20, 50, 150, 400, 1200]
+
+
+def build_plan(server, count, timeout, seed):
+    """Lista de (url, comportamento, status esperado)."""
+    rng = random.Random(seed)
+    names, weights = zip(*BEHAVIOURS)
+    timeout_ms = int(timeout * 1000)
+    plan = []
+    for i in range(count):
+        host = server.hosts[i % len(server.hosts)]
+        median = HOST_PROFILES[i % len(server.hosts) % len(HOST_PROFILES)]
+        # Latencia lognormal por URL, limitada a 1/3 do timeout
+        lat = min(int(rng.lognormvariate(0, 0.6) * median), timeout_ms // 3)
+        behaviour = rng.choices(names, weights)[0]
+        path = f'/live/{i}.m3u8'
+
+        if behaviour == 'ok':
+            url, expected = server.url(host, path, b='ok', lat=lat), 'OK'
+        elif behaviour == 'redirect':
+            url, expected = server.url(host, path, b='redirect', hops=rng.randint(1, 3)), 'OK'
+        elif behaviour == 'slow':
+            url, expected = server.url(host, path, b='slow', lat=lat, body=timeout_ms // 3), 'OK'
+        elif behaviour == 'stall':
+            url, expected = server.url(host, path, b='stall', lat=lat), 'ERROR'
+        elif behaviour == 'reset':
+            url, expected = server.url(host, path, b='reset'), 'ERROR'
+        elif behaviour == 'empty':
+            url, expected = server.url(host, path, b='empty', lat=lat), 'HTTP_200'
+        elif behaviour == 'html':
+            url, expected = server.url(host, path, b='html', lat=lat), 'INVALID'
+        elif behaviour == 'deadvariant':
+            url, expected = server.url(host, path, b='deadvariant', lat=lat), 'DEAD_VARIANT'
+        elif behaviour == 'nodns':
+            url, expected = f'http://cdn{i % 3}.invalid:{server.port}{path}', 'ERROR'
+        elif behaviour == 'downhost':
+            # Outro nome para o mesmo servidor: um host em que tudo trava
+            url, expected = server.url('localhost', path, b='stall'), 'ERROR'
+        elif behaviour == 'timeout':
+            url, expected = server.url(host, path, b='ok', lat=timeout_ms * 2), 'ERROR'
+        else:
+            url, expected = server.url(host, path, b='status', code=behaviour, lat=lat), f'HTTP_{behaviour}'
+        plan.append((url, behaviour, expected))
+    return plan
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0
+
+
+def run_setting(plan, engine, concurrency, per_host, timeout, tiered=True):
+    channels = [gp.Channel(f'canal {i}', url) for i, (url, _, _) in enumerate(plan)]
+    gp._HTTP_CLIENT = gp.HttpClient()
+    gp.PROBE_TIERED = tiered
+    gp.PROBE_TIMEOUT_MAX = timeout  # latencia acima do timeout continua sendo ERROR
+    gp.PROBE_STATS.reset()
+    gp.HOST_LATENCY.reset()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'threads':
+            gp.test_channels_parallel(channels, max_workers=concurrency, timeout=timeout)
+        else:
+            gp.test_channels_async(channels, concurrency=concurrency, per_host=per_host, timeout=timeout)
+    wall = time.perf_counter() - start
+
+    wrong = Counter()
+    for ch, (_, behaviour, expected) in zip(channels, plan):
+        if not tiered:
+            expected = SIMPLE_EXPECTED.get(behaviour, expected)
+        if ch.status != expected:
+            wrong[f'{behaviour}->{ch.status}'] += 1
+    latencies = [ch.latency for ch in channels]
+    requests_done, connections = gp.get_http_client().connection_stats()
+    return {
+        'wall': wall,
+        'rate': len(channels) / wall,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'wrong': wrong,
+        'reuse': 1 - connections / requests_done if requests_done else 0,
+        'tier1': gp.PROBE_STATS.tiers[1][1],
+        'tier2': gp.PROBE_STATS.tiers[2][1],
+        'tier2_requests': gp.PROBE_STATS.tiers[2][0],
+        'retries': gp.HOST_LATENCY.counts['retries'],
+        'recovered': gp.HOST_LATENCY.counts['recovered'],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark de teste de canais com servidor local')
+    parser.add_argument('--channels', type=int, default=2000)
+    parser.add_argument('--hosts', type=int, default=8, help='enderecos 127.0.0.x simulando hosts')
+    parser.add_argument('--timeout', type=float, default=3.0, help='timeout por teste (s)')
+    parser.add_argument('--per-host', type=int, default=gp.PROBE_PER_HOST)
+    parser.add_argument('--settings', default='threads:4,threads:32,async:100,async:500',
+                        help='lista motor:concorrencia[:simple] (padrao: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = FakeStreamServer([f'127.0.0.{i}' for i in range(1, args.hosts + 1)]).start()
+    plan = build_plan(server, args.channels, args.timeout, args.seed)
+    mix = Counter(behaviour for _, behaviour, _ in plan)
+    print(f"{len(plan)} canais em {len(server.hosts)} hosts, timeout {args.timeout}s")
+    print("Mistura: " + ', '.join(f'{k}={v}' for k, v in sorted(mix.items())))
+    print(f"\n  {'motor':<20} {'tempo':>8} {'testes/s':>9} {'p50':>7} {'p99':>7} {'reuso':>6} "
+          f"{'KB c1':>7} {'KB c2':>7} {'req c2':>6} {'repet':>6} {'salvos':>6} {'erros':>6}")
+
+    for setting in args.settings.split(','):
+        engine, concurrency, *mode = setting.split(':')
+        tiered = mode != ['simple']
+        r = run_setting(plan, engine, int(concurrency), args.per_host, args.timeout, tiered)
+        print(f"  {setting:<20} {r['wall']:>7.1f}s {r['rate']:>9.0f} {r['p50'] * 1000:>5.0f}ms "
+              f"{r['p99'] * 1000:>5.0f}ms {r['reuse'] * 100:>5.0f}% {r['tier1'] / 1024:>7.0f} "
+              f"{r['tier2'] / 1024:>7.0f} {r['tier2_requests']:>6} {r['retries']:>6} {r['recovered']:>6} "
+              f"{sum(r['wrong'].values()):>6}")
+        for key, value in r['wrong'].most_common(5):
+            print(f"      {key}: {value}")
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
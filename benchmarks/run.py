@@ -0,0 +1,186 @@
+"""
+Suite de benchmarks por etapa do pipeline (sem rede)
+
+Gera corpora sinteticos (benchmarks.corpus) e mede, para cada tamanho,
+tempo e pico de memoria de cada etapa:
+
+  parse     parse_m3u_to_channels (arquivo lido linha a linha)
+  clean     clean_channel_name nos nomes crus
+  classify  classify_name (sem memoizacao)
+  dedup     deduplicate_channels
+  render    generate_m3u_content
+
+Os resultados podem ser gravados como baseline local; execucoes seguintes
+comparam com ela e apontam regressoes acima da tolerancia (codigo de saida 1).
+
+Uso:
+  python -m benchmarks.run                      # 10k e 100k entradas
+  python -m benchmarks.run --full               # inclui 1M
+  python -m benchmarks.run --save-baseline      # grava a baseline local
+"""
+
+import gc
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import generate_playlist as gp  # noqa: E402
+from benchmarks.corpus import write_corpus  # noqa: E402
+
+DEFAULT_SIZES = [10_000, 100_000]
+FULL_SIZES = DEFAULT_SIZES + [1_000_000]
+BASELINE_FILE = os.path.join(ROOT, gp.CACHE_DIR, 'benchmarks', 'baseline.json')
+
+
+def read_raw_names(path):
+    with open(path, encoding='utf-8') as f:
+        return [gp.parse_extinf(line.strip())[2] for line in f if line.startswith('#EXTINF')]
+
+
+def stage_functions(path):
+    """Etapas na ordem do pipeline; cada uma recebe a saida da anterior."""
+    state = {}
+
+    def parse():
+        with open(path, encoding='utf-8') as f:
+            state['channels'] = list(gp.parse_m3u_to_channels(f, 'bench', 'BR'))
+        return len(state['channels'])
+
+    def clean():
+        names = state['raw_names']
+        for name in names:
+            gp.clean_channel_name(name)
+        return len(names)
+
+    def classify():
+        gp.classify_name.cache_clear()
+        for ch in state['channels']:
+            gp.CHANNEL_CLASSIFIER.match(ch.name.lower())
+        return len(state['channels'])
+
+    def dedup():
+        with contextlib.redirect_stdout(io.StringIO()):
+            state['unique'] = gp.deduplicate_channels(state['channels'])
+        return len(state['channels'])
+
+    def render():
+        state['output'] = gp.generate_m3u_content(state['unique'])
+        return len(state['unique'])
+
+    state['raw_names'] = read_raw_names(path)
+    return [('parse', parse), ('clean', clean), ('classify', classify), ('dedup', dedup), ('render', render)]
+
+
+def run_size(size, seed, memory, repeat):
+    """Mede todas as etapas para um corpus de `size` entradas (melhor de `repeat`)."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'corpus.m3u')
+        write_corpus(path, size, seed)
+
+        for _ in range(repeat):
+            for stage, func in stage_functions(path):
+                gc.collect()
+                start = time.perf_counter()
+                items = func()
+                elapsed = time.perf_counter() - start
+                if stage not in results or elapsed < results[stage]['seconds']:
+                    results[stage] = {'seconds': elapsed, 'items': items}
+
+        if memory:
+            # Segunda passada com tracemalloc (que deixa tudo mais lento)
+            tracemalloc.start()
+            for stage, func in stage_functions(path):
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+                func()
+                results[stage]['peak_mb'] = (tracemalloc.get_traced_memory()[1] - base) / 1e6
+            tracemalloc.stop()
+    return results
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def report(size, results, baseline, tolerance):
+    """Imprime a tabela de um tamanho e retorna as regressoes encontradas."""
+    regressions = []
+    print(f"\n{size:,} entradas")
+    print(f"  {'etapa':<9} {'tempo':>9} {'itens/s':>12} {'pico MB':>9}  baseline")
+    for stage, r in results.items():
+        rate = r['items'] / r['seconds'] if r['seconds'] else 0
+        peak = f"{r['peak_mb']:.1f}" if 'peak_mb' in r else '-'
+        line = f"  {stage:<9} {r['seconds']:>8.3f}s {rate:>12,.0f} {peak:>9}"
+        base = baseline.get(str(size), {}).get(stage)
+        if base:
+            ratio = r['seconds'] / base['seconds'] if base['seconds'] else 1
+            line += f"  {ratio:.2f}x tempo"
+            if ratio > 1 + tolerance:
+                regressions.append(f"{size}/{stage} tempo {ratio:.2f}x")
+                line += ' REGRESSAO'
+            if 'peak_mb' in r and base.get('peak_mb'):
+                mem_ratio = r['peak_mb'] / base['peak_mb']
+                line += f", {mem_ratio:.2f}x memoria"
+                if mem_ratio > 1 + tolerance:
+                    regressions.append(f"{size}/{stage} memoria {mem_ratio:.2f}x")
+                    line += ' REGRESSAO'
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks por etapa do pipeline')
+    parser.add_argument('--sizes', type=lambda v: [int(x) for x in v.split(',')],
+                        help='tamanhos separados por virgula (padrao: 10000,100000)')
+    parser.add_argument('--full', action='store_true', help='inclui o corpus de 1M entradas')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='repeticoes de cada etapa; vale o melhor tempo (padrao: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true', help='nao mede memoria (mais rapido)')
+    parser.add_argument('--baseline', default=BASELINE_FILE,
+                        help='arquivo de baseline local (padrao: %(default)s)')
+    parser.add_argument('--save-baseline', action='store_true', help='grava os resultados como baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='piora aceita antes de apontar regressao (padrao: %(default)s)')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (FULL_SIZES if args.full else DEFAULT_SIZES)
+    baseline = load_baseline(args.baseline)
+    all_results = {}
+    regressions = []
+
+    for size in sizes:
+        results = run_size(size, args.seed, memory=not args.no_memory, repeat=args.repeat)
+        all_results[str(size)] = results
+        regressions += report(size, results, {} if args.save_baseline else baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update(all_results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline gravada: {args.baseline}")
+    elif regressions:
+        print("\nRegressoes:")
+        for item in regressions:
+            print(f"  {item}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,449 +5,271 @@ Executa automaticamente via GitHub Actions
 URL fixa: https://raw.githubusercontent.com/tenorioabsgit/iptv/main/playlist.m3u
 """
 
+import os
 import re
+import json
+import math
+import ssl
+import gzip
+import io
+import calendar
+import hashlib
+import time
+import queue
+import random
+import socket
+import sys
+import threading
+import tempfile
+import sqlite3
+import asyncio
+import argparse
+import functools
+import contextlib
+import operator
+import bisect
+import collections
+import unicodedata
+import zlib
+from array import array
 import requests
+import http.server
+import email.utils
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urljoin, parse_qs
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import multiprocessing
+import xml.etree.ElementTree as ET
+
+# Compressores opcionais para as copias da playlist (.zst e .br)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # ============================================================
 # CONFIGURACAO
 # ============================================================
 
-SOURCES = {
-    # ============================================================
-    # BRASIL
-    # ============================================================
-
-    # Brasil (apsattv.com)
-    'samsung_br': {
-        'name': 'Samsung TV Plus Brasil',
-        'url': 'https://www.apsattv.com/ssungbra.m3u',
-        'region': 'BR',
-    },
-    'lg_br': {
-        'name': 'LG Channels Brasil',
-        'url': 'https://www.apsattv.com/brlg.m3u',
-        'region': 'BR',
-    },
-    'tcl_br': {
-        'name': 'TCL Brasil',
-        'url': 'https://www.apsattv.com/tclbr.m3u',
-        'region': 'BR',
-    },
-    'soultv_br': {
-        'name': 'Soul TV Brasil',
-        'url': 'https://www.apsattv.com/soultv.m3u',
-        'region': 'BR',
-    },
-    'redeitv_br': {
-        'name': 'Rede iTV Brasil',
-        'url': 'https://www.apsattv.com/redeitv.m3u',
-        'region': 'BR',
-    },
-    'movieark_br': {
-        'name': 'Movieark Brasil',
-        'url': 'https://www.apsattv.com/moviearkbr.m3u',
-        'region': 'BR',
-    },
-    'vidaa_br': {
-        'name': 'Vidaa TV',
-        'url': 'https://www.apsattv.com/vidaa.m3u',
-        'region': 'BR',
-    },
-
-    # Brasil (GitHub agregadores)
-    'iptv_org_br': {
-        'name': 'IPTV-Org Brasil',
-        'url': 'https://iptv-org.github.io/iptv/countries/br.m3u',
-        'region': 'BR',
-    },
-    'freetv_br': {
-        'name': 'Free-TV Brasil',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_brazil.m3u8',
-        'region': 'BR',
-    },
-    'fta_br': {
-        'name': 'FTA-IPTV Brasil',
-        'url': 'https://raw.githubusercontent.com/joaoguidugli/FTA-IPTV-Brasil/master/playlist.m3u8',
-        'region': 'BR',
-    },
-
-    # Brasil (BuddyChewChew)
-    'plutotv_br': {
-        'name': 'Pluto TV Brasil',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plutotv_br.m3u',
-        'region': 'BR',
-    },
-
-    # Lingua Portuguesa - todos os paises (GitHub)
-    'iptv_org_por': {
-        'name': 'IPTV-Org Português',
-        'url': 'https://iptv-org.github.io/iptv/languages/por.m3u',
-        'region': 'BR',
-    },
-
-    # ============================================================
-    # EUA
-    # ============================================================
-
-    # EUA (apsattv.com)
-    'localnow_us': {
-        'name': 'Local Now',
-        'url': 'https://www.apsattv.com/localnow.m3u',
-        'region': 'US',
-    },
-    'distrotv': {
-        'name': 'DistroTV',
-        'url': 'https://www.apsattv.com/distro.m3u',
-        'region': 'US',
-    },
-    'vizio_us': {
-        'name': 'Vizio TV',
-        'url': 'https://www.apsattv.com/vizio.m3u',
-        'region': 'US',
-    },
-    'firetv_us': {
-        'name': 'Amazon Fire TV',
-        'url': 'https://www.apsattv.com/firetv.m3u',
-        'region': 'US',
-    },
-    'lg_us': {
-        'name': 'LG Channels US',
-        'url': 'https://www.apsattv.com/uslg.m3u',
-        'region': 'US',
-    },
-    'metax_us': {
-        'name': 'Metax',
-        'url': 'https://www.apsattv.com/metax.m3u',
-        'region': 'US',
-    },
-    'hp_us': {
-        'name': 'HP Fast Channels',
-        'url': 'https://www.apsattv.com/hp.m3u',
-        'region': 'US',
-    },
-    'tablo_us': {
-        'name': 'Tablo',
-        'url': 'https://www.apsattv.com/tablo.m3u',
-        'region': 'US',
-    },
-
-    # EUA (BuddyChewChew)
-    'samsung_us': {
-        'name': 'Samsung TV Plus US',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/samsungtvplus_us.m3u',
-        'region': 'US',
-    },
-    'roku_us': {
-        'name': 'Roku Channel',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/roku_all.m3u',
-        'region': 'US',
-    },
-    'plex_us': {
-        'name': 'Plex TV US',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_us.m3u',
-        'region': 'US',
-    },
-    'tubi_us': {
-        'name': 'Tubi TV',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/tubi_all.m3u',
-        'region': 'US',
-    },
-    'plutotv_us': {
-        'name': 'Pluto TV US',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plutotv_us.m3u',
-        'region': 'US',
-    },
-
-    # EUA (GitHub agregadores)
-    'iptv_org_us': {
-        'name': 'IPTV-Org US',
-        'url': 'https://iptv-org.github.io/iptv/countries/us.m3u',
-        'region': 'US',
-    },
-    'freetv_us': {
-        'name': 'Free-TV USA',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_usa.m3u8',
-        'region': 'US',
-    },
-
-    # ============================================================
-    # CANADA
-    # ============================================================
-
-    'lg_ca': {
-        'name': 'LG Channels CA',
-        'url': 'https://www.apsattv.com/calg.m3u',
-        'region': 'CA',
-    },
-    'samsung_ca': {
-        'name': 'Samsung TV Plus CA',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/samsungtvplus_ca.m3u',
-        'region': 'CA',
-    },
-    'plex_ca': {
-        'name': 'Plex TV CA',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_ca.m3u',
-        'region': 'CA',
-    },
-    'plutotv_ca': {
-        'name': 'Pluto TV CA',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plutotv_ca.m3u',
-        'region': 'CA',
-    },
-    'iptv_org_ca': {
-        'name': 'IPTV-Org CA',
-        'url': 'https://iptv-org.github.io/iptv/countries/ca.m3u',
-        'region': 'CA',
-    },
-    'freetv_ca': {
-        'name': 'Free-TV Canada',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_canada.m3u8',
-        'region': 'CA',
-    },
-
-    # ============================================================
-    # UK
-    # ============================================================
-
-    'lg_gb': {
-        'name': 'LG Channels UK',
-        'url': 'https://www.apsattv.com/gblg.m3u',
-        'region': 'GB',
-    },
-    'samsung_gb': {
-        'name': 'Samsung TV Plus UK',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/samsungtvplus_gb.m3u',
-        'region': 'GB',
-    },
-    'plex_gb': {
-        'name': 'Plex TV UK',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_gb.m3u',
-        'region': 'GB',
-    },
-    'plutotv_gb': {
-        'name': 'Pluto TV UK',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plutotv_gb.m3u',
-        'region': 'GB',
-    },
-    'iptv_org_gb': {
-        'name': 'IPTV-Org UK',
-        'url': 'https://iptv-org.github.io/iptv/countries/uk.m3u',
-        'region': 'GB',
-    },
-    'freetv_gb': {
-        'name': 'Free-TV UK',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_uk.m3u8',
-        'region': 'GB',
-    },
-
-    # ============================================================
-    # AUSTRALIA
-    # ============================================================
-
-    'samsung_au': {
-        'name': 'Samsung TV Plus AU',
-        'url': 'https://www.apsattv.com/ssungaus.m3u',
-        'region': 'AU',
-    },
-    'lg_au': {
-        'name': 'LG Channels AU',
-        'url': 'https://www.apsattv.com/aulg.m3u',
-        'region': 'AU',
-    },
-    '9fast_au': {
-        'name': '9Fast AU',
-        'url': 'https://www.apsattv.com/9fast.m3u',
-        'region': 'AU',
-    },
-    'kogantvplus_au': {
-        'name': 'Kogantvplus AU',
-        'url': 'https://www.apsattv.com/kogantvplus.m3u',
-        'region': 'AU',
-    },
-    'plex_au': {
-        'name': 'Plex TV AU',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_au.m3u',
-        'region': 'AU',
-    },
-    'iptv_org_au': {
-        'name': 'IPTV-Org AU',
-        'url': 'https://iptv-org.github.io/iptv/countries/au.m3u',
-        'region': 'AU',
-    },
-    'freetv_au': {
-        'name': 'Free-TV Australia',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_australia.m3u8',
-        'region': 'AU',
-    },
-
-    # ============================================================
-    # NOVA ZELANDIA
-    # ============================================================
-
-    'samsung_nz': {
-        'name': 'Samsung TV Plus NZ',
-        'url': 'https://www.apsattv.com/ssungnz.m3u',
-        'region': 'NZ',
-    },
-    'lg_nz': {
-        'name': 'LG Channels NZ',
-        'url': 'https://www.apsattv.com/nzlg.m3u',
-        'region': 'NZ',
-    },
-    'plex_nz': {
-        'name': 'Plex TV NZ',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_nz.m3u',
-        'region': 'NZ',
-    },
-    'iptv_org_nz': {
-        'name': 'IPTV-Org NZ',
-        'url': 'https://iptv-org.github.io/iptv/countries/nz.m3u',
-        'region': 'NZ',
-    },
-
-    # ============================================================
-    # PORTUGAL
-    # ============================================================
-
-    'samsung_pt': {
-        'name': 'Samsung TV Plus PT',
-        'url': 'https://www.apsattv.com/ssungpor.m3u',
-        'region': 'PT',
-    },
-    'lg_pt': {
-        'name': 'LG Channels PT',
-        'url': 'https://www.apsattv.com/ptlg.m3u',
-        'region': 'PT',
-    },
-    'm3upt': {
-        'name': 'M3UPT Portugal',
-        'url': 'https://raw.githubusercontent.com/LITUATUI/M3UPT/main/M3U/M3UPT.m3u',
-        'region': 'PT',
-    },
-    'iptv_org_pt': {
-        'name': 'IPTV-Org PT',
-        'url': 'https://iptv-org.github.io/iptv/countries/pt.m3u',
-        'region': 'PT',
-    },
-    'freetv_pt': {
-        'name': 'Free-TV Portugal',
-        'url': 'https://raw.githubusercontent.com/Free-TV/IPTV/master/playlists/playlist_portugal.m3u8',
-        'region': 'PT',
-    },
-
-    # ============================================================
-    # LUSOFONIA AFRICANA
-    # ============================================================
-
-    'iptv_org_ao': {
-        'name': 'IPTV-Org Angola',
-        'url': 'https://iptv-org.github.io/iptv/countries/ao.m3u',
-        'region': 'AO',
-    },
-    'iptv_org_mz': {
-        'name': 'IPTV-Org Moçambique',
-        'url': 'https://iptv-org.github.io/iptv/countries/mz.m3u',
-        'region': 'MZ',
-    },
-    'iptv_org_cv': {
-        'name': 'IPTV-Org Cabo Verde',
-        'url': 'https://iptv-org.github.io/iptv/countries/cv.m3u',
-        'region': 'CV',
-    },
-
-    # ============================================================
-    # MULTI-REGIAO / GLOBAL
-    # ============================================================
-
-    'whaletvplus': {
-        'name': 'Whale TV Plus',
-        'url': 'https://www.apsattv.com/whaletvplus_all.m3u',
-        'region': 'US',
-    },
-    'tclplus': {
-        'name': 'TCL TV Plus Global',
-        'url': 'https://www.apsattv.com/tclplus.m3u',
-        'region': 'US',
-    },
-    'freelivesports': {
-        'name': 'Free Live Sports',
-        'url': 'https://www.apsattv.com/freelivesports.m3u',
-        'region': 'US',
-    },
-    'samsungtvplus_all': {
-        'name': 'Samsung TV Plus All',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/samsungtvplus_all.m3u',
-        'region': 'US',
-    },
-    'plex_all': {
-        'name': 'Plex TV All',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plex_all.m3u',
-        'region': 'US',
-    },
-    'plutotv_all': {
-        'name': 'Pluto TV All',
-        'url': 'https://raw.githubusercontent.com/BuddyChewChew/app-m3u-generator/refs/heads/main/playlists/plutotv_all.m3u',
-        'region': 'US',
-    },
-}
-
 TARGET_REGIONS = ['BR', 'US', 'GB', 'CA', 'AU', 'NZ', 'PT', 'AO', 'MZ', 'CV']
 OUTPUT_FILE = 'playlist.m3u'
 
-# Canais extras (VH1 e MTV) adicionados manualmente
-EXTRA_CHANNELS = [
-    # VH1 - Pluto TV US
-    {'name': 'VH1 Classics', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/6076cd1df8576d0007c82193/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'VH1 I Love Reality', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/5d7154fa8326b6ce4ec31f2e/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'VH1 Hip Hop Family', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/5d71561df6f2e6d0b6493bf5/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'VH1 Queens of Reality', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/66abefe5d2d50d00082c7d12/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'US', 'source': 'Pluto TV US'},
-    # VH1 - Pluto TV Italia
-    {'name': 'VH1+ Music Legends', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/62e8cc10ca869f00078efca8/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'IT', 'source': 'Pluto TV IT'},
-    {'name': "VH1+ Back to 90's", 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/6552085aab05240008b05f6c/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'IT', 'source': 'Pluto TV IT'},
-    {'name': 'VH1+ Rock!', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/636a4173e34fd50007534542/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'IT', 'source': 'Pluto TV IT'},
-    {'name': 'VH1+ Dance', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/65e5d9d2ec9fda0008c35f91/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'IT', 'source': 'Pluto TV IT'},
-    {'name': 'VH1+ Classici', 'url': 'https://service-stitcher.clusters.pluto.tv/v1/stitch/embed/hls/channel/6690f892d51259000880d1c4/master.m3u8?deviceId=channel&deviceModel=web&deviceVersion=1.0&appVersion=1.0&deviceType=web&deviceMake=web&deviceDNT=1', 'region': 'IT', 'source': 'Pluto TV IT'},
-    # VH1 - Outros
-    {'name': 'VH1 Italia', 'url': 'https://content.uplynk.com/channel/36953f5b6546464590d2fcd954bc89cf.m3u8', 'region': 'IT', 'source': 'iptv-org'},
-    # MTV - MoveOnJoy (alta confiabilidade)
-    {'name': 'MTV East', 'url': 'https://fl1.moveonjoy.com/MTV/index.m3u8', 'region': 'US', 'source': 'MoveOnJoy'},
-    {'name': 'MTV2', 'url': 'https://fl1.moveonjoy.com/MTV_2/index.m3u8', 'region': 'US', 'source': 'MoveOnJoy'},
-    {'name': 'MTV Live', 'url': 'https://fl1.moveonjoy.com/MTV_LIVE/index.m3u8', 'region': 'US', 'source': 'MoveOnJoy'},
-    {'name': 'mtvU', 'url': 'https://fl1.moveonjoy.com/MTV_U/index.m3u8', 'region': 'US', 'source': 'MoveOnJoy'},
-    # MTV - Pluto TV US
-    {'name': "MTV Spankin' New", 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/5d14fdb8ca91eedee1633117/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=mtv-spankin&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'MTV en Español', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/5cf96d351652631e36d4331f/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=mtv-espanol&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'MTV Flow Latino', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/5d3609cd6a6c78d7672f2a81/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=mtv-flow&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    # MTV - Pluto TV Europa
-    {'name': 'MTV Music', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/6245d15062cd1f00070a2338/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=mtv-music&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'DE', 'source': 'Pluto TV DE'},
-    {'name': 'MTV Classics FR', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/5f92b56a367e170007cd43f4/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=mtv-classics-fr&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'FR', 'source': 'Pluto TV FR'},
-    {'name': 'MTV Originals ES', 'url': 'https://service-stitcher.clusters.pluto.tv/stitch/hls/channel/5f1aadf373bed3000794d1d7/master.m3u8?advertisingId=&appName=web&appVersion=DNT&deviceDNT=0&deviceId=mtv-originals&deviceMake=web&deviceModel=web&deviceType=web&deviceVersion=DNT&includeExtendedEvents=false&serverSideAds=false', 'region': 'ES', 'source': 'Pluto TV ES'},
-    # MTV - Streams adicionais
-    {'name': 'MTV 00s', 'url': 'http://myott.top/stream/DT6QU63K5VX/165.m3u8', 'region': 'INT', 'source': 'myott'},
-    {'name': 'MTV 80s', 'url': 'http://myott.top/stream/DT6QU63K5VX/87.m3u8', 'region': 'INT', 'source': 'myott'},
-    {'name': 'MTV 90s', 'url': 'http://myott.top/stream/DT6QU63K5VX/88.m3u8', 'region': 'INT', 'source': 'myott'},
-    {'name': 'MTV Hits', 'url': 'http://myott.top/stream/DT6QU63K5VX/302.m3u8', 'region': 'INT', 'source': 'myott'},
-    # Notícias BR - canais extras
-    {'name': 'BandNews TV', 'url': 'https://evpp.mm.uol.com.br/geob_band/bandnewstv/playlist.m3u8', 'region': 'BR', 'source': 'Band'},
-    # Rock/Metal - Pluto TV US
-    {'name': 'XITE Rock x Metal', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/623a1b5188ecdc0007c9ef5a/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=rock&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'Vevo Rock', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/61d4b38226b8a50007fe03a6/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=rock&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    {'name': 'Live Music', 'url': 'http://cfd-v4-service-channel-stitcher-use1-1.prd.pluto.tv/stitch/hls/channel/5873fc21cad696fb37aa9054/master.m3u8?appName=web&appVersion=unknown&deviceDNT=0&deviceId=rock&deviceMake=Chrome&deviceModel=web&deviceType=web&deviceVersion=unknown&includeExtendedEvents=false&serverSideAds=false', 'region': 'US', 'source': 'Pluto TV US'},
-    # Rock/Metal - Stingray (Stirr OTT)
-    {'name': 'Stingray Classic Rock', 'url': 'https://stirr.ott-channels.stingray.com/101/master.m3u8', 'region': 'US', 'source': 'Stirr/Stingray'},
-    {'name': 'Stingray Rock Alternative', 'url': 'https://stirr.ott-channels.stingray.com/102/master.m3u8', 'region': 'US', 'source': 'Stirr/Stingray'},
-    # Rock/Metal - Stingray (Lotus/Samsung)
-    {'name': 'Stingray Classic Rock INT', 'url': 'https://lotus.stingray.com/manifest/ose-101ads-montreal/samsungtvplus/master.m3u8', 'region': 'INT', 'source': 'Stingray/Samsung'},
-    {'name': 'Stingray Rock Alternative INT', 'url': 'https://lotus.stingray.com/manifest/ose-102ads-montreal/samsungtvplus/master.m3u8', 'region': 'INT', 'source': 'Stingray/Samsung'},
-    # Rock/Metal - Canais independentes
-    {'name': 'Rock TV Romania', 'url': 'https://tv.broadcasting.ro/rocktv/85c83a80-4f71-4f2d-a8d6-43f676896bcb.m3u8', 'region': 'RO', 'source': 'broadcasting.ro'},
-    {'name': 'Rock TV Macedonia', 'url': 'https://stream.nasatv.com.mk/rocktv/hls/rocktv_live.m3u8', 'region': 'MK', 'source': 'nasatv.com.mk'},
-    {'name': 'DJING Electro Rock', 'url': 'https://www.djing.com/tv/s-28676-05-electro-rock.m3u8', 'region': 'FR', 'source': 'DJing.com'},
-    {'name': 'Now Rock AU', 'url': 'https://lightningnow90-samsungau.amagi.tv/playlist.m3u8', 'region': 'AU', 'source': 'Now Music/Amagi'},
-]
+# Teste de canais
+# async   - asyncio, centenas de testes simultaneos (padrao)
+# threads - ThreadPoolExecutor com requests (motor antigo)
+PROBE_ENGINE = 'async'
+PROBE_TIMEOUT = 8
+PROBE_CONCURRENCY = 500     # testes simultaneos no motor async
+PROBE_PER_HOST = 32         # limite de testes simultaneos por host
+PROBE_MAX_REDIRECTS = 5
+
+# Teste em camadas: a camada 1 baixa so o inicio do stream (Range); a camada 2
+# so roda para master playlists (resultado ambiguo) e segue uma variante ate
+# o primeiro segmento, com orcamento de bytes e de tempo por canal.
+PROBE_TIERED = True
+PROBE_TIER1_BYTES = 1024
+PROBE_TIER2_BYTES = 48 * 1024        # orcamento total da camada 2 por canal
+PROBE_TIER2_PLAYLIST_BYTES = 32 * 1024
+PROBE_TIER2_SEGMENT_BYTES = 2048
+PROBE_TIER2_TIMEOUT = 6
+# A resposta da camada 1 de um stream HLS ja traz as variantes (#EXT-X-STREAM-INF):
+# a maior BANDWIDTH/RESOLUTION e os CODECS sao guardados no canal, escolhem a
+# melhor URL entre quase duplicados e viram atributos x-quality, x-resolution,
+# x-bandwidth e x-codecs na linha EXTINF (PROBE_QUALITY_TAGS).
+PROBE_QUALITY_TAGS = True
+# Inicio do stream: cada teste OK guarda (conexao, primeiro byte, bytes/s do
+# trecho lido) da resposta da camada 1 e o ProbeStore mantem as ultimas
+# PROBE_HISTORY_MAX medicoes. O score do canal e o inicio estimado em
+# segundos (mediana do primeiro byte + PROBE_SCORE_CHUNK bytes na mediana da
+# taxa; menor e melhor). A taxa vem de um trecho de ~1 KB e e dominada pela
+# latencia, por isso o trecho do score e pequeno. Com PROBE_SCORE_ORDER
+# (--score-order) cada grupo segue o score em faixas de PROBE_SCORE_STEP
+# segundos (relevancia e nome desempatam); fica desligado por padrao porque
+# canais perto do limite de uma faixa trocam de lugar a cada reteste e a
+# playlist muda sem nenhum canal novo. Com PROBE_MAX_STARTUP > 0
+# (--max-latency) canais mais lentos saem da playlist.
+PROBE_HISTORY_MAX = 8
+PROBE_SCORE_CHUNK = 4 * 1024
+PROBE_SCORE_STEP = 0.5
+PROBE_SCORE_ORDER = False
+PROBE_MAX_STARTUP = 0
+# Disjuntor por host: apos N falhas de conexao seguidas, os demais canais do
+# host falham na hora; 1 em cada PROBE_BREAKER_SAMPLE ainda e testado e um
+# sucesso fecha o disjuntor. 0 desliga.
+# Timeout adaptativo: apos PROBE_ADAPTIVE_MIN_SAMPLES respostas de um host, o
+# timeout dele passa a ser o percentil do tempo ate o primeiro byte vezes
+# PROBE_TIMEOUT_FACTOR mais PROBE_TIMEOUT_PAD, entre MIN e MAX. Um timeout num
+# host lento (percentil >= PROBE_SLOW_HOST_TTFB) e repetido uma vez com
+# PROBE_TIMEOUT_MAX; em hosts rapidos o canal e dado como morto na hora.
+PROBE_ADAPTIVE_MIN_SAMPLES = 3
+PROBE_TIMEOUT_PERCENTILE = 95
+PROBE_TIMEOUT_FACTOR = 2.0
+PROBE_TIMEOUT_PAD = 0.5
+PROBE_TIMEOUT_MIN = 1.5
+PROBE_TIMEOUT_MAX = 15
+PROBE_SLOW_HOST_TTFB = 1.0
+PROBE_BREAKER_THRESHOLD = 5
+PROBE_BREAKER_SAMPLE = 10
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# Cache de resultados de testes (persistido entre execucoes)
+CACHE_DIR = '.cache'
+PROBE_STORE_FILE = os.path.join(CACHE_DIR, 'probes.sqlite')
+PROBE_TTL_OK = 2 * 86400             # canal OK e retestado depois de ~2 dias
+PROBE_RETRY_BASE = 1 * 86400         # 1a falha: retesta na execucao seguinte
+PROBE_RETRY_MAX = 7 * 86400          # backoff exponencial ate 7 dias
+PROBE_TTL_JITTER = 0.2               # espalha os vencimentos entre execucoes
+PROBE_STORE_MAX_AGE = 30 * 86400     # entradas sem uso ha 30 dias sao removidas
+
+# Cache das fontes (GET condicional com ETag/Last-Modified)
+SOURCE_CACHE_DIR = os.path.join(CACHE_DIR, 'sources')
+SOURCE_MAX_STALE = 3 * 86400         # fonte fora do ar: usa a ultima copia boa por ate 3 dias
+PARSE_VERSION = 4                    # incrementar ao mudar parse_m3u_to_channels
+
+# Pipeline download -> parse -> teste
+PIPELINE_QUEUE_SIZE = 5000           # canais unicos aguardando teste (limita a memoria)
+
+# Quase duplicados: o mesmo canal em fontes diferentes, com URLs diferentes,
+# vira um canal logico com URLs alternativas (na ordem de SOURCES). So a
+# primeira e testada; a seguinte so e testada se a anterior falhar.
+# Mesma regiao e (mesmo tvg-id, ou mesmo nome normalizado, ou nomes com
+# similaridade de trigramas >= NEAR_DUP_THRESHOLD e mesmo logo ou host).
+NEAR_DUP_ENABLED = True
+NEAR_DUP_THRESHOLD = 0.8
+NEAR_DUP_BUCKET_MAX = 32             # canais por balde (host ou logo + trigrama) no indice
+NEAR_DUP_STOPWORDS = frozenset({'tv', 'hd', 'fhd', 'uhd', 'sd', '4k', 'hq'})
+
+# Validacao dos logos (opcional, --check-logos). Cada URL de logo e testada
+# uma vez por TTL, nao importa quantos canais a usem; logos quebrados sao
+# trocados pelo logo valido de outro canal com o mesmo tvg-id ou nome
+# ('rewrite') ou removidos ('drop').
+LOGO_STORE_FILE = os.path.join(CACHE_DIR, 'logos.sqlite')
+LOGO_TTL_OK = 7 * 86400              # logo OK: retestado com If-None-Match (304 nao baixa a imagem)
+LOGO_TTL_BROKEN = 1 * 86400          # logo quebrado ou host fora do ar: tenta de novo no dia seguinte
+LOGO_STORE_MAX_AGE = 30 * 86400
+LOGO_WORKERS = 32
+LOGO_TIMEOUT = 5
+LOGO_ACTION = 'rewrite'
+
+# Parse em processos separados (fora do GIL das threads de download). 0 = parse
+# na propria thread da fonte; as fontes sao cortadas em trechos de
+# PARSE_CHUNK_LINES linhas (sempre antes de um #EXTINF).
+PARSE_PROCESSES = 0
+PARSE_CHUNK_LINES = 20_000
+
+# Metricas de cada execucao (JSON; textfile do Prometheus opcional via --metrics-prom)
+METRICS_FILE = os.path.join(CACHE_DIR, 'metrics.json')
+METRICS_HISTORY_MAX = 90             # execucoes mantidas em <metrics>-history.jsonl
+METRICS_PROM_HOSTS = 50              # hosts com mais testes exportados ao Prometheus
+
+# Modo servidor (`serve`): canais em memoria, retestados em lotes a uma taxa fixa
+SERVE_HOST = '127.0.0.1'
+SERVE_PORT = 8080
+SERVE_PROBE_RATE = 5                 # testes por segundo (10k canais: cada um a cada ~33 min)
+SERVE_BATCH = 50                     # canais por lote de retestes
+SERVE_SOURCE_INTERVAL = 6 * 3600     # intervalo padrao entre coletas de uma fonte ('refresh' na fonte)
+SERVE_RENDER_DELAY = 5               # agrupa mudancas antes de regerar a playlist
+
+# Indice da playlist gerada (grupo, regiao, fonte, nome -> faixa de bytes no
+# arquivo), usado para servir recortes sem regerar nada
+PLAYLIST_INDEX_FILE = os.path.join(CACHE_DIR, 'playlist-index.json')
+
+# Copias comprimidas gravadas junto com a playlist (<arquivo>.gz, .zst, .br) e
+# o hash do conteudo (<arquivo>.sha256). Formatos sem o modulo instalado
+# (zstandard, brotli) sao ignorados.
+PLAYLIST_COMPRESS = ('gz', 'zst', 'br')
+PLAYLIST_GZIP_LEVEL = 9
+PLAYLIST_ZSTD_LEVEL = 19
+PLAYLIST_BROTLI_QUALITY = 9
+PLAYLIST_WRITE_BUFFER = 256 * 1024
+
+# Mudancas em relacao a playlist anterior (entradas novas, removidas e alteradas)
+PLAYLIST_DIFF_FILE = os.path.join(CACHE_DIR, 'playlist-diff.json')
+
+# Guia de programacao (XMLTV): as fontes "epg" do registro sao lidas em
+# stream e so ficam os canais cujo tvg-id esta na playlist, com os programas
+# dentro da janela [agora - EPG_PAST, agora + EPG_FUTURE]. EPG_URL (se
+# definida) vai no cabecalho da playlist como url-tvg.
+EPG_FILE = 'epg.xml.gz'
+EPG_URL = ''
+EPG_PAST = 6 * 3600
+EPG_FUTURE = 3 * 86400
+EPG_TIMEOUT = 60
+EPG_GZIP_LEVEL = 6
+
+# Cliente HTTP (pool de conexoes keep-alive e cache de DNS)
+HTTP_POOL_SIZE = 16                  # conexoes ociosas mantidas por host
+HTTP_POOL_HOSTS = 256                # hosts com pool ativo (LRU)
+DNS_CACHE_TTL = 300
+DNS_NEGATIVE_TTL = 60                # nome inexistente (falha permanente)
+DNS_TEMPORARY_TTL = 5                # EAI_AGAIN e outras falhas temporarias do resolvedor
+DNS_RESOLVE_WORKERS = 32             # resolucoes simultaneas no estagio de DNS
+DNS_PREFETCH_WINDOW = 2000           # canais resolvidos antes de chegarem ao teste
+
+# Fontes e canais extras ficam no registro (sources.json, ao lado deste
+# arquivo). Cada fonte tem name, url e region e, opcionalmente:
+#   refresh   - intervalo minimo entre downloads ("90m", "6h", "7d" ou segundos);
+#               fora dele a fonte usa os canais guardados em SOURCE_CACHE_DIR
+#   priority  - menor vem primeiro (ordem de coleta e das URLs alternativas)
+#   max_stale - por quanto tempo a ultima copia boa substitui a fonte fora do ar
+# "defaults" vale para as fontes que nao definem o campo. Os guias XMLTV
+# ficam em "epg" (name e url, na ordem de preferencia).
+SOURCES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sources.json')
+SOURCE_REFRESH = 20 * 3600           # refresh padrao (a execucao diaria baixa quase tudo)
+SOURCE_HISTORY_MAX = 30              # downloads lembrados por fonte (frequencia de mudanca)
+
+_DURATION_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$')
+_DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_duration(value):
+    """Segundos de um intervalo do registro: numero (segundos) ou texto como "30m", "6h", "7d"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _DURATION_RE.match(str(value))
+    if not match:
+        raise ValueError(f"intervalo invalido: {value!r}")
+    return float(match.group(1)) * _DURATION_UNITS[match.group(2)]
+
+
+def load_source_registry(path=None):
+    """Le o registro de fontes; retorna (SOURCES, EXTRA_CHANNELS, EPG_SOURCES).
+
+    As fontes saem ordenadas por prioridade (na mesma prioridade, na ordem
+    do arquivo), com refresh e max_stale ja em segundos.
+    """
+    path = path or SOURCES_FILE
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    defaults = data.get('defaults', {})
+    sources = []
+    for position, (key, entry) in enumerate(data.get('sources', {}).items()):
+        source = {**defaults, **entry}
+        missing = [field for field in ('name', 'url', 'region') if not source.get(field)]
+        if missing:
+            raise ValueError(f"{path}: fonte {key} sem {', '.join(missing)}")
+        try:
+            if 'refresh' in source:
+                source['refresh'] = parse_duration(source['refresh'])
+            source['max_stale'] = parse_duration(source.get('max_stale', SOURCE_MAX_STALE))
+            source['priority'] = int(source.get('priority', 100))
+        except ValueError as e:
+            raise ValueError(f"{path}: fonte {key}: {e}") from None
+        sources.append((source['priority'], position, key, source))
+    sources.sort(key=operator.itemgetter(0, 1))
+    epg = data.get('epg', {})
+    for key, entry in epg.items():
+        if not entry.get('url'):
+            raise ValueError(f"{path}: guia {key} sem url")
+    return {key: source for _, _, key, source in sources}, data.get('extra_channels', []), epg
+
+
+# Canais extras (VH1 e MTV) adicionados manualmente: "extra_channels" no registro
+SOURCES, EXTRA_CHANNELS, EPG_SOURCES = load_source_registry()
 
 # ============================================================
 # CLASSIFICACAO DE CANAIS - 5 grupos simplificados
@@ -490,50 +312,363 @@ NEWS_RELEVANCE = [
     'norte news',
 ]
 
+# Tabelas de palavras-chave compiladas num unico automato (KeywordMatcher).
+# Para criar uma nova classe basta adicionar uma entrada aqui; o custo por
+# canal nao cresce com o numero de palavras-chave.
+KEYWORD_GROUPS = {
+    'br_news': BR_NEWS_KEYWORDS,
+}
+
+
+# ============================================================
+# CLIENTE HTTP COMPARTILHADO
+# ============================================================
+# Todas as chamadas de rede (fontes e testes) passam por aqui:
+# - conexoes keep-alive reaproveitadas por host (o handshake TLS so
+#   acontece na primeira conexao com cada host)
+# - cache de DNS em processo (vale para requests e asyncio)
+# - contadores de reaproveitamento de conexoes e de DNS
+
+_SYSTEM_GETADDRINFO = socket.getaddrinfo
+
+
+# Erros de getaddrinfo que nao mudam numa nova tentativa (os demais, como
+# EAI_AGAIN, sao falhas temporarias do resolvedor)
+_DNS_PERMANENT_ERRORS = frozenset(
+    getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA', 'EAI_ADDRFAMILY', 'EAI_FAIL',
+                                       'EAI_FAMILY', 'EAI_SERVICE', 'EAI_SOCKTYPE', 'EAI_BADFLAGS')
+    if hasattr(socket, name))
+
+
+class DnsCache:
+    """Cache de socket.getaddrinfo com TTL.
+
+    Falhas permanentes (nome inexistente) ficam `negative_ttl` segundos;
+    falhas temporarias (EAI_AGAIN) so `temporary_ttl`, para que um soluco do
+    resolvedor nao derrube o host pelo resto da execucao.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL, negative_ttl=DNS_NEGATIVE_TTL, temporary_ttl=DNS_TEMPORARY_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.temporary_ttl = temporary_ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self._getaddrinfo = _SYSTEM_GETADDRINFO
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        key = (host, port, family, type, proto, flags)
+        now = time.monotonic()
+        with self.lock:
+            self.lookups += 1
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                if isinstance(entry[1], Exception):
+                    # excecao nova a cada vez: relancar o mesmo objeto acumula o traceback
+                    raise socket.gaierror(*entry[1].args)
+                return entry[1]
+        try:
+            result = self._getaddrinfo(host, port, family, type, proto, flags)
+        except socket.gaierror as e:
+            ttl = self.negative_ttl if e.errno in _DNS_PERMANENT_ERRORS else self.temporary_ttl
+            with self.lock:
+                self.entries[key] = (now + ttl, e)
+            raise
+        with self.lock:
+            self.entries[key] = (now + self.ttl, result)
+        return result
+
+    def install(self):
+        """Substitui socket.getaddrinfo (usado por urllib3 e pelo loop asyncio)."""
+        socket.getaddrinfo = self.getaddrinfo
+
+
+class AsyncConnectionPool:
+    """Conexoes asyncio ociosas por (esquema, host, porta) para keep-alive."""
+
+    def __init__(self, client, pool_size):
+        self.client = client
+        self.pool_size = pool_size
+        self.idle = {}
+
+    async def acquire(self, scheme, host, port):
+        """Retorna (reader, writer, reaproveitada)."""
+        idle = self.idle.get((scheme, host, port))
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.client.count_async(reused=True, host=host)
+                return reader, writer, True
+            writer.close()
+        return await self.acquire_new(scheme, host, port)
+
+    async def acquire_new(self, scheme, host, port):
+        """Abre uma conexao nova (sem passar pelas ociosas)."""
+        https = scheme == 'https'
+        reader, writer = await asyncio.open_connection(
+            host, port,
+            ssl=self.client.ssl_context if https else None,
+            server_hostname=host if https else None,
+        )
+        self.client.count_async(reused=False, host=host)
+        return reader, writer, False
+
+    def release(self, scheme, host, port, reader, writer):
+        idle = self.idle.setdefault((scheme, host, port), [])
+        if len(idle) < self.pool_size:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class HttpClient:
+    """Cliente HTTP unico: Session com pool por host, DNS em cache e estatisticas."""
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, pool_hosts=HTTP_POOL_HOSTS):
+        self.pool_size = pool_size
+        self.dns = DnsCache()
+        self.dns.install()
+        self.ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+        self.lock = threading.Lock()
+        self.stats = {'sync_requests': 0, 'sync_connections': 0,
+                      'async_requests': 0, 'async_connections': 0}
+        self.host_stats = collections.defaultdict(lambda: [0, 0])  # host -> [requisicoes, conexoes]
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.adapter = adapter
+
+        # Pools descartados pelo LRU do urllib3 levam seus contadores junto:
+        # acumula antes de fechar.
+        pools = adapter.poolmanager.pools
+        dispose = pools.dispose_func
+
+        def dispose_and_count(pool):
+            self._count_sync_pool(pool)
+            dispose(pool)
+
+        pools.dispose_func = dispose_and_count
+
+    def _count_sync_pool(self, pool):
+        with self.lock:
+            self.stats['sync_requests'] += pool.num_requests
+            self.stats['sync_connections'] += pool.num_connections
+            host = self.host_stats[pool.host]
+            host[0] += pool.num_requests
+            host[1] += pool.num_connections
+
+    def count_async(self, reused, host=''):
+        with self.lock:
+            self.stats['async_requests'] += 1
+            self.host_stats[host][0] += 1
+            if not reused:
+                self.stats['async_connections'] += 1
+                self.host_stats[host][1] += 1
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def new_async_pool(self):
+        """Pool de conexoes para um loop asyncio (nao pode ser compartilhado entre loops)."""
+        return AsyncConnectionPool(self, self.pool_size)
+
+    def connection_stats(self):
+        """Requisicoes e conexoes novas (sync + async) ate agora."""
+        pools = self.adapter.poolmanager.pools
+        requests_done = self.stats['sync_requests'] + self.stats['async_requests']
+        connections = self.stats['sync_connections'] + self.stats['async_connections']
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_done += pool.num_requests
+                connections += pool.num_connections
+        return requests_done, connections
+
+    def host_connection_stats(self):
+        """{host: (requisicoes, conexoes novas)} ate agora."""
+        with self.lock:
+            totals = {host: list(counts) for host, counts in self.host_stats.items()}
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                counts = totals.setdefault(pool.host, [0, 0])
+                counts[0] += pool.num_requests
+                counts[1] += pool.num_connections
+        return {host: tuple(counts) for host, counts in totals.items()}
+
+    def report(self):
+        requests_done, connections = self.connection_stats()
+        reused = requests_done - connections
+        ratio = reused * 100 // requests_done if requests_done else 0
+        print(f"\nConexoes: {requests_done} requisicoes, {connections} novas, "
+              f"{reused} reaproveitadas ({ratio}%)")
+        print(f"DNS: {self.dns.lookups} consultas, {self.dns.hits} do cache")
+
+
+_HTTP_CLIENT = None
+
+
+def get_http_client():
+    """Cliente HTTP compartilhado (criado na primeira chamada)."""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = HttpClient()
+    return _HTTP_CLIENT
+
+
+def read_probe_body(response, max_bytes):
+    """Inicio do corpo de uma resposta em stream, devolvendo a conexao ao pool se possivel.
+
+    Nunca le mais que `max_bytes`: corpos com Content-Length dentro do limite
+    sao lidos inteiros e a conexao volta ao pool; os maiores (e streams sem
+    tamanho) sao cortados em `max_bytes` e a conexao e fechada.
+    """
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) <= max_bytes:
+        return response.content
+    first_bytes = next(response.iter_content(max_bytes), b'') if max_bytes else b''
+    response.close()
+    return first_bytes
+
 
 # ============================================================
 # FUNCOES
 # ============================================================
 
+# Padrões pré-compilados de clean_channel_name
+# Números de canal: "123 Canal", "123. Canal", "123 - Canal", "123 | Canal", "#123 Canal"
+_CHANNEL_NUMBER_RE = re.compile(r'^[#]?\d{1,5}[\s.\-|:]+\s*')
+# Nomes de fontes/plataformas no fim do nome (aplicados nesta ordem)
+_SOURCE_SUFFIX_RES = [
+    re.compile(
+        r'\s*[\-|]\s*(?:Pluto\s*TV|Samsung(?:\s*TV\s*Plus)?|Roku|Plex|Tubi|Stirr|DistroTV|Vizio|LG\s*Channels?|XUMO|Fire\s*TV)\s*$',
+        re.IGNORECASE),
+    re.compile(r'\s*[(\[]\s*(?:Pluto\s*TV|Samsung|Roku|Plex|Tubi|DistroTV|Vizio)\s*[)\]]\s*$', re.IGNORECASE),
+]
+# Tags de resolução e status: (720p), (1080p), (1080i), [Geo-blocked], [Not 24/7]
+_NAME_TAGS_RE = re.compile(r'\s*(?:\(\d{3,4}[pi]\)|(?i:\[(?:Geo-blocked|Not 24/7|Offline|Downscaled)\]))')
+
+
 def clean_channel_name(name):
     """Remove números de canal, nomes de fontes, tags de resolução/status do nome."""
     if not name:
         return name
 
     # 1) Remove números de canal do início
-    # Padrões: "123 Canal", "123. Canal", "123 - Canal", "123 | Canal", "#123 Canal"
-    cleaned = re.sub(r'^[#]?\d{1,5}[\s.\-|:]+\s*', '', name).strip()
+    cleaned = _CHANNEL_NUMBER_RE.sub('', name).strip()
     if not cleaned:
         return name
 
     # 2) Remove nomes de fontes/plataformas
-    source_patterns = [
-        r'\s*[\-|]\s*(?:Pluto\s*TV|Samsung(?:\s*TV\s*Plus)?|Roku|Plex|Tubi|Stirr|DistroTV|Vizio|LG\s*Channels?|XUMO|Fire\s*TV)\s*$',
-        r'\s*[(\[]\s*(?:Pluto\s*TV|Samsung|Roku|Plex|Tubi|DistroTV|Vizio)\s*[)\]]\s*$',
-    ]
-    for pattern in source_patterns:
-        cleaned = re.sub(pattern, '', cleaned, flags=re.IGNORECASE).strip()
+    for pattern in _SOURCE_SUFFIX_RES:
+        cleaned = pattern.sub('', cleaned).strip()
 
-    # 3) Remove tags de resolução e status: (720p), (1080p), (1080i), [Geo-blocked], [Not 24/7]
-    cleaned = re.sub(r'\s*\(\d{3,4}[pi]\)', '', cleaned).strip()
-    cleaned = re.sub(r'\s*\[(?:Geo-blocked|Not 24/7|Offline|Downscaled)\]', '', cleaned, flags=re.IGNORECASE).strip()
+    # 3) Remove tags de resolução e status
+    cleaned = _NAME_TAGS_RE.sub('', cleaned).strip()
 
     return cleaned if cleaned else name
 
 
+NO_RANK = 999
+
+
+class KeywordMatcher:
+    """Automato Aho-Corasick com todas as tabelas de palavras-chave.
+
+    Uma unica passada sobre o nome retorna todas as classes encontradas
+    (chaves de `groups`) e o melhor rank (menor indice em `ranking`).
+    """
+
+    def __init__(self, groups, ranking=()):
+        self.goto = [{}]
+        self.fail = [0]
+        self.labels = [frozenset()]
+        self.rank = [NO_RANK]
+        for label, keywords in groups.items():
+            for keyword in keywords:
+                node = self._insert(keyword.lower())
+                self.labels[node] = self.labels[node] | {label}
+        for rank, keyword in enumerate(ranking):
+            node = self._insert(keyword.lower())
+            self.rank[node] = min(self.rank[node], rank)
+        self._build()
+
+    def _insert(self, keyword):
+        node = 0
+        for char in keyword:
+            nxt = self.goto[node].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][char] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.labels.append(frozenset())
+                self.rank.append(NO_RANK)
+            node = nxt
+        return node
+
+    def _build(self):
+        # BFS: links de falha e saidas herdadas do sufixo mais longo
+        queue_ = list(self.goto[0].values())
+        for node in queue_:
+            for char, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.labels[child] = self.labels[child] | self.labels[self.fail[child]]
+                self.rank[child] = min(self.rank[child], self.rank[self.fail[child]])
+                queue_.append(child)
+
+    def match(self, text):
+        """Retorna (classes encontradas, melhor rank) para `text` (ja em minusculas)."""
+        goto, fail, labels, ranks = self.goto, self.fail, self.labels, self.rank
+        found = frozenset()
+        best = NO_RANK
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if labels[node]:
+                found = found | labels[node]
+            if ranks[node] < best:
+                best = ranks[node]
+        return found, best
+
+
+CHANNEL_CLASSIFIER = KeywordMatcher(KEYWORD_GROUPS, NEWS_RELEVANCE)
+
+
+@functools.lru_cache(maxsize=65536)
+def classify_name(channel_name):
+    """Classes e rank de relevância de um nome (memorizado: nomes se repetem entre fontes)."""
+    return CHANNEL_CLASSIFIER.match(channel_name.lower() if channel_name else '')
+
+
 def get_news_relevance(channel_name):
     """Retorna prioridade de relevância para canais de notícias."""
-    name_lower = channel_name.lower()
-    for i, keyword in enumerate(NEWS_RELEVANCE):
-        if keyword in name_lower:
-            return i
-    return 999
+    return classify_name(channel_name)[1]
 
 
 def is_br_news(channel_name):
     """Verifica se um canal brasileiro é de notícias."""
-    name_lower = channel_name.lower() if channel_name else ''
-    return any(kw in name_lower for kw in BR_NEWS_KEYWORDS)
+    return 'br_news' in classify_name(channel_name)[0]
 
 
 def get_final_group(original_group, region, channel_name=''):
@@ -552,59 +687,316 @@ def get_final_group(original_group, region, channel_name=''):
     return 'Others'
 
 
-def extract_group_from_extinf(extinf_line):
-    """Extrai o group-title de uma linha EXTINF."""
-    match = re.search(r'group-title="([^"]*)"', extinf_line)
-    return match.group(1) if match else ''
+# Ordem dos grupos na playlist (grupos fora da lista vao para o fim)
+GROUP_ORDER = ('BR Noticias', 'BR', 'US', 'CA', 'Others')
+_GROUP_POSITION = {group: i for i, group in enumerate(GROUP_ORDER)}
 
 
-def extract_logo_from_extinf(extinf_line):
-    """Extrai o tvg-logo de uma linha EXTINF."""
-    match = re.search(r'tvg-logo="([^"]*)"', extinf_line)
-    return match.group(1) if match else ''
+_EXTINF_HEAD_RE = re.compile(r'#EXTINF:\s*([^\s,]*)')
+_EXTINF_ATTR_RE = re.compile(r'\s*([\w-]+)=(?:"([^"]*)"|([^\s",]*))')
 
 
-def update_extinf_group(extinf_line, new_group):
-    """Atualiza o group-title em uma linha EXTINF."""
-    if 'group-title="' in extinf_line:
-        return re.sub(r'group-title="[^"]*"', f'group-title="{new_group}"', extinf_line)
-    elif '#EXTINF:-1,' in extinf_line and '#EXTINF:-1 ' not in extinf_line:
-        # Sem atributos: #EXTINF:-1,Name → adiciona group-title antes da vírgula
-        return extinf_line.replace('#EXTINF:-1,', f'#EXTINF:-1 group-title="{new_group}",', 1)
-    else:
-        # Tem atributos mas sem group-title: #EXTINF:-1 tvg-id="...",Name
-        return extinf_line.replace('#EXTINF:-1 ', f'#EXTINF:-1 group-title="{new_group}" ', 1)
-
+def parse_extinf(extinf_line):
+    """Tokeniza uma linha EXTINF numa unica passada: (duracao, atributos, nome).
 
-def download_m3u(url, name):
-    """Baixa uma playlist M3U."""
+    Os atributos key="value" (ou key=value sem aspas, que termina no espaco
+    ou na virgula, ex.: catchup-days=7) sao lidos em ordem ate a virgula que
+    separa o nome; o nome e todo o resto da linha (pode conter virgulas).
+    """
+    head = _EXTINF_HEAD_RE.match(extinf_line)
+    if head:
+        duration, pos = head.group(1) or '-1', head.end()
+    else:
+        duration, pos = '-1', 0
+    attrs = {}
+    match = _EXTINF_ATTR_RE.match(extinf_line, pos)
+    while match:
+        attrs[match.group(1)] = match.group(match.lastindex)
+        pos = match.end()
+        match = _EXTINF_ATTR_RE.match(extinf_line, pos)
+    comma_idx = extinf_line.find(',', pos)
+    name = extinf_line[comma_idx + 1:].strip() if comma_idx >= 0 else 'Unknown'
+    return duration, attrs, name
+
+
+def format_extinf(duration, attrs, name, group=None):
+    """Serializa um canal como linha EXTINF; `group` substitui (ou insere) o group-title."""
+    if group is not None:
+        if 'group-title' in attrs:
+            attrs = {**attrs, 'group-title': group}
+        else:
+            attrs = {'group-title': group, **attrs}
+    attributes = ''.join(f' {key}="{value}"' for key, value in attrs.items())
+    return f'#EXTINF:{duration}{attributes},{name}'
+
+
+NOT_MODIFIED = object()
+
+
+def download_m3u(url, name, validators=None, stats=None):
+    """Abre uma playlist M3U em stream (GET condicional quando ha ETag/Last-Modified).
+
+    Retorna (linhas, validadores). `linhas` e um gerador sobre as linhas do
+    corpo, NOT_MODIFIED em resposta 304 e None em caso de erro. Com `stats`
+    (dict), grava ali os bytes recebidos ao fim do corpo.
+    """
     print(f"  Baixando {name}...")
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
 
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = get_http_client().get(url, headers=headers, timeout=30, stream=True)
+        if response.status_code == 304:
+            response.close()
+            print(f"    {name}: sem alteracoes (304)")
+            return NOT_MODIFIED, validators
         response.raise_for_status()
-        content = response.text
-        channel_count = content.count('#EXTINF')
-        print(f"    OK! ({channel_count} canais)")
-        return content, channel_count
     except Exception as e:
         print(f"    ERRO: {e}")
-        return None, 0
+        return None, None
 
+    # Sem charset declarado o requests assumiria ISO-8859-1 para text/*
+    if 'charset' not in response.headers.get('Content-Type', ''):
+        response.encoding = 'utf-8'
+    new_validators = {
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+    }
+    return iter_response_lines(response, name, stats), new_validators
 
-def update_extinf_name(extinf_line, new_name):
-    """Atualiza o nome do canal na linha EXTINF (após a última vírgula)."""
-    comma_idx = extinf_line.rfind(',')
-    if comma_idx >= 0:
-        return extinf_line[:comma_idx + 1] + new_name
-    return extinf_line
+
+def iter_response_lines(response, name, stats=None):
+    """Linhas de uma resposta em stream, sem manter o corpo inteiro em memoria."""
+    channel_count = 0
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('#EXTINF'):
+                channel_count += 1
+            yield line
+    finally:
+        if stats is not None:
+            stats['bytes'] = response.raw.tell()  # bytes como vieram da rede (comprimidos)
+        response.close()
+    print(f"    {name}: OK! ({channel_count} canais)")
+
+
+class SourceCache:
+    """Copia local de cada fonte: corpo, ETag/Last-Modified, canais ja parseados
+    e o historico de downloads (quando o conteudo mudou) para calibrar o refresh.
+
+    Com `schedule`, fontes baixadas ha menos de `refresh` nao vao a rede.
+    """
+
+    def __init__(self, directory=SOURCE_CACHE_DIR, conditional=True, schedule=True):
+        self.directory = directory
+        self.conditional = conditional
+        self.schedule = schedule
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, f'{key}.{ext}')
+
+    def load(self, key):
+        """Le a entrada da fonte (ou None se nao houver)."""
+        try:
+            with open(self._path(key, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def due(self, entry, refresh, now=None):
+        """A fonte precisa ser baixada (sem copia, agenda desligada ou refresh vencido)?"""
+        if not entry or not self.schedule:
+            return True
+        return (now or time.time()) - entry.get('fetched_at', 0) >= refresh
+
+    def validators(self, entry):
+        """Cabecalhos para GET condicional."""
+        if not entry or not self.conditional:
+            return None
+        return {'etag': entry.get('etag', ''), 'last_modified': entry.get('last_modified', '')}
+
+    def channels(self, key, entry, source_name, region):
+        """Canais da copia local, reparseando o corpo so se o parser mudou."""
+        if (entry.get('parse_version') == PARSE_VERSION
+                and entry.get('source') == source_name and entry.get('region') == region):
+            return [Channel.from_row(row) for row in entry['channels']]
+        try:
+            with open(self._path(key, 'm3u'), encoding='utf-8') as f:
+                channels = list(parse_m3u_to_channels(f, source_name, region))
+        except OSError:
+            return []
+        self.save(key, entry, channels, source_name, region, fetched_at=entry.get('fetched_at'), previous=entry)
+        return channels
+
+    def write_body(self, key, lines, digest=None):
+        """Repassa as linhas gravando o corpo; o arquivo so e substituido no fim do stream.
+
+        Com `digest` (hashlib), o hash do corpo e atualizado linha a linha.
+        """
+        path = self._path(key, 'm3u')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                f.write('\n')
+                if digest is not None:
+                    digest.update(line.encode('utf-8'))
+                yield line
+        os.replace(tmp, path)
+
+    def save(self, key, validators, channels, source_name, region, fetched_at=None, previous=None,
+             content_hash=None):
+        """Grava a entrada (validadores e canais parseados) de forma atomica; retorna a entrada.
+
+        Sem `fetched_at` a gravacao e de um download (ou 304) agora: entra no
+        historico, como mudanca se `content_hash` difere do anterior.
+        """
+        previous = previous or {}
+        history = previous.get('history', [])
+        old_hash = previous.get('content_hash', '')
+        if fetched_at is None and previous:
+            changed = bool(content_hash) and content_hash != old_hash
+            history = (history + [[round(time.time()), int(changed)]])[-SOURCE_HISTORY_MAX:]
+        entry = {
+            'etag': (validators or {}).get('etag', ''),
+            'last_modified': (validators or {}).get('last_modified', ''),
+            'fetched_at': fetched_at or time.time(),
+            'parse_version': PARSE_VERSION,
+            'source': source_name,
+            'region': region,
+            'content_hash': content_hash or old_hash,
+            'history': history,
+            'channels': [ch.to_row() for ch in channels],
+        }
+        self._write(self._path(key, 'json'), json.dumps(entry, ensure_ascii=False))
+        return entry
+
+    @staticmethod
+    def change_stats(entry):
+        """(downloads, mudancas, intervalo medio entre mudancas em s ou None) do historico da fonte."""
+        history = (entry or {}).get('history', [])
+        changes = sum(changed for _, changed in history)
+        span = history[-1][0] - history[0][0] if len(history) > 1 else 0
+        return len(history), changes, (span / changes if changes and span else None)
+
+    def _write(self, path, text):
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+class Channel:
+    """Registro compacto de um canal.
+
+    Usa __slots__ (sem __dict__ por instancia), guarda os atributos EXTINF
+    numa tupla plana (chave, valor, chave, valor, ...) e interna as strings
+    que se repetem entre canais (fonte, regiao, chaves e valores de
+    atributos). O resultado do teste e gravado no proprio registro.
+    """
+
+    __slots__ = ('name', 'url', 'duration', 'attrs', 'source', 'region', 'group', 'rank', 'status', 'latency',
+                 'quality', 'timing', 'score')
+
+    def __init__(self, name, url, duration='-1', attrs=(), source='', region='', status=None, latency=None):
+        self.name = name
+        self.url = url
+        self.duration = sys.intern(duration)
+        self.attrs = attrs
+        self.source = sys.intern(source)
+        self.region = sys.intern(region)
+        self.group = None
+        self.rank = NO_RANK
+        self.status = status
+        self.latency = latency
+        self.quality = None
+        self.timing = None      # (conexao, primeiro byte, bytes/s) do ultimo teste
+        self.score = None       # inicio estimado em segundos (historico no ProbeStore)
+
+    @staticmethod
+    def pack_attrs(attrs):
+        """Converte um dict de atributos na tupla plana interna."""
+        packed = []
+        for key, value in attrs.items():
+            packed.append(sys.intern(key))
+            packed.append(sys.intern(value))
+        return tuple(packed)
+
+    def attr(self, key, default=''):
+        attrs = self.attrs
+        for i in range(0, len(attrs), 2):
+            if attrs[i] == key:
+                return attrs[i + 1]
+        return default
+
+    def attr_dict(self):
+        return dict(zip(self.attrs[::2], self.attrs[1::2]))
+
+    @property
+    def original_group(self):
+        return self.attr('group-title')
+
+    @property
+    def logo(self):
+        return self.attr('tvg-logo')
+
+    def with_attr(self, key, value):
+        """Copia do canal com o atributo `key` trocado (removido se `value` e None)."""
+        attrs = self.attr_dict()
+        if value is None:
+            attrs.pop(key, None)
+        else:
+            attrs[key] = value
+        copy = Channel(self.name, self.url, self.duration, Channel.pack_attrs(attrs),
+                       self.source, self.region, self.status, self.latency)
+        copy.group, copy.rank, copy.quality = self.group, self.rank, self.quality
+        copy.timing, copy.score = self.timing, self.score
+        return copy
+
+    def copy_result(self, other):
+        """Copia o resultado do teste de `other` (outra copia da mesma URL)."""
+        self.status, self.latency, self.quality = other.status, other.latency, other.quality
+        self.timing, self.score = other.timing, other.score
+
+    def extinf(self, group=None):
+        """Linha EXTINF do canal (serializada so na hora de gerar a playlist)."""
+        attrs = self.attr_dict()
+        if self.quality and PROBE_QUALITY_TAGS:
+            attrs.update(quality_attrs(self.quality))
+        return format_extinf(self.duration, attrs, self.name, group)
+
+    def to_row(self):
+        """Forma compacta para JSON (cache de fontes)."""
+        return [self.name, self.url, self.duration, list(self.attrs), self.source, self.region]
+
+    @classmethod
+    def from_row(cls, row):
+        name, url, duration, attrs, source, region = row
+        return cls(name, url, duration, tuple(sys.intern(v) for v in attrs), source, region)
+
+    def as_dict(self):
+        """Representacao em dict (formato antigo), para comparacoes e depuracao."""
+        return {
+            'name': self.name,
+            'url': self.url,
+            'duration': self.duration,
+            'attrs': self.attr_dict(),
+            'source': self.source,
+            'region': self.region,
+            'original_group': self.original_group,
+            'logo': self.logo,
+            'status': self.status,
+        }
 
 
 def parse_m3u_to_channels(content, source_name, region):
-    """Converte conteudo M3U em lista de canais."""
-    lines = content.split('\n')
-    channels = []
+    """Gera os canais de um conteudo M3U (texto completo ou iteravel de linhas)."""
+    lines = content.split('\n') if isinstance(content, str) else content
     current_extinf = None
 
     for line in lines:
@@ -612,24 +1004,314 @@ def parse_m3u_to_channels(content, source_name, region):
         if line.startswith('#EXTINF'):
             current_extinf = line
         elif line.startswith('http') and current_extinf:
-            raw_name = current_extinf.split(',')[-1].strip() if ',' in current_extinf else 'Unknown'
-            name = clean_channel_name(raw_name)
-            original_group = extract_group_from_extinf(current_extinf)
-            logo = extract_logo_from_extinf(current_extinf)
-            # Atualizar extinf com nome limpo
-            extinf = update_extinf_name(current_extinf, name)
-            channels.append({
-                'name': name,
-                'url': line,
-                'extinf': extinf,
-                'source': source_name,
-                'region': region,
-                'original_group': original_group,
-                'logo': logo
-            })
+            duration, attrs, raw_name = parse_extinf(current_extinf)
+            yield Channel(clean_channel_name(raw_name), line, duration,
+                          Channel.pack_attrs(attrs), source_name, region)
             current_extinf = None
 
-    return channels
+
+def _parse_chunk(text):
+    """Trabalho de um processo do pool: parseia um trecho em tuplas (nome, url, duracao, attrs).
+
+    As strings ja vem internadas do parse e o pickle envia cada objeto
+    repetido uma vez so, entao o processo principal nao precisa internar de novo.
+    """
+    return [(ch.name, ch.url, ch.duration, ch.attrs) for ch in parse_m3u_to_channels(text, '', '')]
+
+
+def iter_line_chunks(lines, chunk_lines=PARSE_CHUNK_LINES):
+    """Agrupa linhas em trechos de ~`chunk_lines`, cortando so antes de um #EXTINF."""
+    chunk = []
+    for line in lines:
+        if len(chunk) >= chunk_lines and line.lstrip().startswith('#EXTINF'):
+            yield '\n'.join(chunk)
+            chunk = []
+        chunk.append(line)
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+def parse_m3u_parallel(lines, source_name, region, pool, window=4, chunk_lines=PARSE_CHUNK_LINES):
+    """Mesmo resultado de parse_m3u_to_channels, com os trechos parseados no `pool`.
+
+    Os trechos seguem para o pool enquanto o download continua (no maximo
+    `window` em voo) e os canais saem na ordem da fonte.
+    """
+    def channels(future):
+        for name, url, duration, attrs in future.result():
+            yield Channel(name, url, duration, attrs, source_name, region)
+
+    pending = collections.deque()
+    for chunk in iter_line_chunks(lines, chunk_lines):
+        pending.append(pool.submit(_parse_chunk, chunk))
+        # Entrega o que ja ficou pronto sem esperar a fonte terminar
+        while len(pending) >= window or (pending and pending[0].done()):
+            yield from channels(pending.popleft())
+    while pending:
+        yield from channels(pending.popleft())
+
+
+_PARSE_POOL = None
+
+
+def get_parse_pool():
+    """Pool de processos de parse (None quando PARSE_PROCESSES e 0)."""
+    global _PARSE_POOL
+    if _PARSE_POOL is None and PARSE_PROCESSES > 0:
+        # forkserver: o processo principal ja tem threads de download rodando
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        _PARSE_POOL = ProcessPoolExecutor(PARSE_PROCESSES, mp_context=context)
+    return _PARSE_POOL
+
+
+def shutdown_parse_pool():
+    global _PARSE_POOL
+    if _PARSE_POOL is not None:
+        _PARSE_POOL.shutdown()
+        _PARSE_POOL = None
+
+
+def normalize_url(url):
+    """URL sem query string e sem barra final (chave de deduplicacao e de cache)."""
+    return url.split('?')[0].rstrip('/')
+
+
+_NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+@functools.lru_cache(maxsize=65536)
+def near_name_key(name):
+    """Nome para comparar canais: sem tags, acentos, pontuacao e palavras como 'TV' e 'HD' (memorizado)."""
+    text = unicodedata.normalize('NFKD', clean_channel_name(name).casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(t for t in _NON_ALNUM_RE.split(text) if t and t not in NEAR_DUP_STOPWORDS)
+
+
+@functools.lru_cache(maxsize=65536)
+def _trigrams(key):
+    padded = f' {key} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _trigram_order(trigram):
+    # Ordem global fixa (e igual entre execucoes) para o filtro de prefixo
+    return zlib.crc32(trigram.encode('utf-8')), trigram
+
+
+def source_order():
+    """Posicao de cada fonte (pelo nome) na ordem de SOURCES, ja ordenado por prioridade."""
+    return {src['name']: i for i, src in enumerate(SOURCES.values())}
+
+
+def channel_preference(channel, order):
+    """Chave de escolha entre copias do mesmo canal: fonte mais acima em SOURCES, depois URL e conteudo.
+
+    So depende do conteudo, nunca da ordem de chegada das fontes.
+    """
+    return order.get(channel.source, len(order)), channel.url, channel.name, channel.attrs
+
+
+class NearDuplicateIndex:
+    """Agrupa canais quase duplicados sem comparar todos com todos.
+
+    Tres indices por regiao: tvg-id, nome normalizado (exato) e trigramas
+    do nome dentro do mesmo host e do mesmo logo (a similaridade so vale
+    com um dos dois em comum). No indice de trigramas cada canal entra so
+    pelo prefixo do seu conjunto (na ordem de _trigram_order): dois nomes
+    com Jaccard >= t sempre dividem um trigrama do prefixo, entao os
+    candidatos saem de poucos baldes pequenos e a similaridade exata so e
+    calculada para eles.
+
+    O primeiro canal adicionado a um grupo e o principal. Um canal so entra
+    num grupo se o seu tvg-id e compativel com o do grupo (o primeiro
+    tvg-id preenchido entre os membros), ou seja, com todos os membros.
+    Durante a coleta os grupos dependem da ordem de chegada das fontes e so
+    servem para adiar o teste das alternativas; `regroup` refaz os grupos
+    depois da coleta em ordem de channel_preference, e sao esses que
+    decidem o que e testado e o que vai para a playlist.
+    """
+
+    def __init__(self, threshold=NEAR_DUP_THRESHOLD, bucket_max=NEAR_DUP_BUCKET_MAX):
+        self.threshold = threshold
+        self.bucket_max = bucket_max
+        self.source_order = source_order()
+        self._reset()
+
+    def _reset(self):
+        self.by_id = {}
+        self.by_name = {}
+        self.buckets = {}
+        # principal -> (ordem de chegada, nome normalizado, numeros do nome, tvg-id do grupo, qtd. de trigramas)
+        self.info = {}
+        self.members = {}       # principal -> [principal, alternativas...] (so grupos com 2+)
+        self.alternates = set()
+
+    @staticmethod
+    def _tvg_id(channel):
+        return channel.attr('tvg-id').split('@')[0].strip().casefold()
+
+    def add(self, channel):
+        """Registra o canal; retorna o principal do grupo se ele e quase duplicado, senao None."""
+        region = channel.region
+        key = near_name_key(channel.name)
+        tvg_id = self._tvg_id(channel)
+        primary = self._exact(region, key, tvg_id)
+        if primary is not None:
+            self._attach(primary, channel, tvg_id)
+            return primary
+
+        info = (len(self.info), key, tuple(_DIGITS_RE.findall(key)), tvg_id, 0)
+        blocks = prefix = ()
+        if key:
+            trigrams = _trigrams(key)
+            info = info[:4] + (len(trigrams),)
+            ordered = sorted(trigrams, key=_trigram_order)
+            prefix = ordered[:len(ordered) - math.ceil(self.threshold * len(ordered)) + 1]
+            blocks = [block for block in ((region, 'host', urlsplit(channel.url).hostname),
+                                          (region, 'logo', channel.logo.strip())) if block[2]]
+            primary = self._similar(info, trigrams, [(block, trigram) for block in blocks for trigram in prefix])
+            if primary is not None:
+                self._attach(primary, channel, tvg_id)
+                return primary
+
+        self.info[channel] = info
+        if tvg_id:
+            self.by_id.setdefault((region, tvg_id), channel)
+        if key:
+            self.by_name.setdefault((region, key), channel)
+            for block in blocks:
+                for trigram in prefix:
+                    bucket = self.buckets.setdefault((block, trigram), [])
+                    if len(bucket) < self.bucket_max:
+                        bucket.append(channel)
+        return None
+
+    def _exact(self, region, key, tvg_id):
+        """Principal com o mesmo tvg-id ou (sem tvg-id conflitante) o mesmo nome normalizado."""
+        if tvg_id:
+            primary = self.by_id.get((region, tvg_id))
+            if primary is not None:
+                return primary
+        if key:
+            primary = self.by_name.get((region, key))
+            if primary is not None and self._compatible(tvg_id, self.info[primary][3]):
+                return primary
+        return None
+
+    def _similar(self, info, trigrams, bucket_keys):
+        """Principal mais parecido (Jaccard >= threshold) entre os dos baldes; empate: o mais antigo."""
+        candidates = set()
+        for bucket_key in bucket_keys:
+            bucket = self.buckets.get(bucket_key)
+            if bucket:
+                candidates.update(bucket)
+        _, _, digits, tvg_id, size = info
+        # Jaccard >= t exige tamanhos proximos: |B| entre t*|A| e |A|/t
+        low, high = self.threshold * size, size / self.threshold
+        best, best_score = None, None
+        for candidate in candidates:
+            seq, c_key, c_digits, c_tvg_id, c_size = self.info[candidate]
+            if not low <= c_size <= high or c_digits != digits or not self._compatible(tvg_id, c_tvg_id):
+                continue
+            other = _trigrams(c_key)
+            similarity = len(trigrams & other) / len(trigrams | other)
+            if similarity >= self.threshold and (best is None or (similarity, -seq) > best_score):
+                best, best_score = candidate, (similarity, -seq)
+        return best
+
+    @staticmethod
+    def _compatible(tvg_id, other):
+        """tvg-ids diferentes (os dois preenchidos) indicam canais diferentes, mesmo com nomes parecidos."""
+        return not tvg_id or not other or tvg_id == other
+
+    def _attach(self, primary, channel, tvg_id):
+        self.members.setdefault(primary, [primary]).append(channel)
+        self.alternates.add(channel)
+        info = self.info[primary]
+        if tvg_id and not info[3]:
+            # o grupo passa a ter tvg-id: canais com outro tvg-id nao entram mais
+            self.info[primary] = info[:3] + (tvg_id,) + info[4:]
+            self.by_id.setdefault((channel.region, tvg_id), primary)
+
+    def regroup(self, channels):
+        """Refaz os grupos so com `channels`, adicionados em ordem de channel_preference.
+
+        O resultado nao depende da ordem de chegada: o principal de cada
+        grupo e o canal preferido e as alternativas seguem a mesma ordem.
+        """
+        self._reset()
+        order = self.source_order
+        for ch in sorted(channels, key=lambda ch: channel_preference(ch, order)):
+            self.add(ch)
+
+    def next_candidates(self):
+        """Proxima URL a testar de cada grupo sem nenhuma URL OK (a primeira ainda nao testada)."""
+        candidates = []
+        for primary in self.info:
+            group = self.members.get(primary, (primary,))
+            if any(ch.status == 'OK' for ch in group):
+                continue
+            nxt = next((ch for ch in group if ch.status is None), None)
+            if nxt is not None:
+                candidates.append(nxt)
+        return candidates
+
+    def report(self):
+        grouped = sum(len(group) - 1 for group in self.members.values())
+        if grouped:
+            print(f"  Quase duplicados: {grouped} URLs alternativas em {len(self.members)} canais")
+
+
+def collapse_near_duplicates(channels, keep=()):
+    """Um canal por grupo de quase duplicados: o de melhor qualidade HLS e, no
+    empate, o de fonte mais acima em SOURCES.
+
+    `keep` sao URLs normalizadas que ficam sempre (canais extras).
+    """
+    index = NearDuplicateIndex()
+    order = index.source_order
+
+    def preference(ch):
+        height, bandwidth, master = quality_rank(ch)
+        return (-height, -bandwidth, not master) + channel_preference(ch, order)
+
+    kept = []
+    for ch in sorted(channels, key=preference):
+        if normalize_url(ch.url) in keep or index.add(ch) is None:
+            kept.append(ch)
+    return kept
+
+
+def pick_best_duplicates(channels, near, store=None):
+    """Troca cada canal agrupado em `near` pela URL OK de melhor qualidade HLS do grupo.
+
+    Alternativas nao testadas nesta execucao contam pelo resultado ainda
+    valido em `store` (nenhuma requisicao a mais). No empate fica a fonte
+    mais acima em SOURCES e depois a menor URL (channel_preference).
+    """
+    order = near.source_order
+    best = {}
+    for group in near.members.values():
+        if store is not None:
+            for ch in group:
+                if ch.status is None:
+                    store.lookup(ch)
+        working = [ch for ch in group if ch.status == 'OK']
+        if len(working) > 1:
+            choice = min(working, key=lambda ch: (tuple(-v for v in quality_rank(ch)),
+                                                  channel_preference(ch, order)))
+            best.update((id(ch), choice) for ch in working)
+    if not best:
+        return channels
+    picked, seen = [], set()
+    for ch in channels:
+        ch = best.get(id(ch), ch)
+        if id(ch) not in seen:
+            seen.add(id(ch))
+            picked.append(ch)
+    return picked
 
 
 def deduplicate_channels(channels):
@@ -637,7 +1319,7 @@ def deduplicate_channels(channels):
     seen_urls = set()
     unique = []
     for ch in channels:
-        url = ch['url'].split('?')[0].rstrip('/')
+        url = normalize_url(ch.url)
         if url not in seen_urls:
             seen_urls.add(url)
             unique.append(ch)
@@ -648,167 +1330,2626 @@ def deduplicate_channels(channels):
     return unique
 
 
-def test_channel(channel, timeout=8):
-    """Testa se um canal esta funcionando."""
-    url = channel['url']
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-
+class ChannelStream:
+    """Canais unicos vindos das threads de download, entregues por uma fila limitada.
+
+    A deduplicacao e feita na entrada (mesmo criterio de deduplicate_channels),
+    entao cada canal unico fica disponivel para teste assim que e parseado.
+    Com um NearDuplicateIndex em `near`, quase duplicados de um canal ja
+    visto nao entram na fila (o teste deles fica para depois da coleta).
+
+    A primeira copia de uma URL e a testada, mas a que vai para a playlist
+    e a preferida (channel_preference) entre todas as copias: `preferred`
+    troca uma pela outra depois do teste e `regroup` refaz os grupos de
+    quase duplicados com as copias preferidas, para que a saida nao dependa
+    de qual fonte terminou primeiro.
+    """
+
+    _END = object()
+
+    def __init__(self, maxsize=PIPELINE_QUEUE_SIZE, near=None):
+        self.queue = queue.Queue(maxsize)
+        self.kept = {}                      # url normalizada -> copia preferida
+        self.near_urls = []                 # urls que passaram pelo indice de quase duplicados
+        self.order = source_order()
+        self.lock = threading.Lock()
+        self.near = near
+        self.total = 0
+        self.unique = 0
+        self.near_duplicates = 0
+        self.with_logo = 0
+        self.dedup_seconds = 0.0
+
+    def put(self, channel, near=True):
+        """Enfileira o canal se a URL e inedita (e nao e quase duplicado); retorna se foi enfileirado."""
+        start = time.perf_counter()
+        url = normalize_url(channel.url)
+        with self.lock:
+            self.total += 1
+            kept = self.kept.get(url)
+            new = kept is None
+            if kept is not None:
+                if channel_preference(channel, self.order) < channel_preference(kept, self.order):
+                    self.kept[url] = channel
+            else:
+                self.kept[url] = channel
+                if near and self.near is not None:
+                    self.near_urls.append(url)
+                if near and self.near is not None and self.near.add(channel) is not None:
+                    self.near_duplicates += 1
+                    new = False
+                else:
+                    self.unique += 1
+                    if channel.logo.strip():
+                        self.with_logo += 1
+            self.dedup_seconds += time.perf_counter() - start
+        if new:
+            self.queue.put(channel)
+        return new
+
+    def close(self):
+        self.queue.put(self._END)
+
+    def preferred(self, channels):
+        """Troca cada canal testado pela copia preferida da mesma URL, com o resultado do teste."""
+        result = []
+        for ch in channels:
+            best = self.kept.get(normalize_url(ch.url), ch)
+            if best is not ch:
+                best.copy_result(ch)
+            result.append(best)
+        return result
+
+    def regroup(self):
+        """Refaz os grupos de `near` com as copias preferidas e recalcula as contagens (apos a coleta)."""
+        self.near.regroup([self.kept[url] for url in self.near_urls])
+        self.near_duplicates = len(self.near.alternates)
+        self.unique = len(self.kept) - self.near_duplicates
+        self.with_logo = sum(1 for ch in self.kept.values()
+                             if ch not in self.near.alternates and ch.logo.strip())
+
+    def __iter__(self):
+        while True:
+            channel = self.queue.get()
+            if channel is self._END:
+                return
+            yield channel
+
+    def summary(self):
+        print(f"\nTotal coletados: {self.total}")
+        removed = self.total - self.unique - self.near_duplicates
+        if removed:
+            print(f"  Duplicados removidos: {removed}")
+        if self.near is not None:
+            self.near.report()
+        print(f"  Canais unicos: {self.unique}")
+        print(f"  Canais com logo: {self.with_logo}")
+        print(f"  Canais sem logo: {self.unique - self.with_logo}")
+
+
+# Resposta de um GET de teste: `received` sao os bytes de corpo lidos, `url`
+# e a URL final (apos redirecionamentos), base para URIs relativas; `ttfb` e
+# o tempo ate os cabecalhos da resposta final e `connect` o tempo gasto
+# abrindo conexoes novas (None quando o motor nao mede).
+ProbeResponse = collections.namedtuple('ProbeResponse', 'status body received url ttfb connect elapsed')
+
+
+class ProbeStats:
+    """Requisicoes, bytes e tempo gastos em cada camada do teste."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.tiers = {1: [0, 0, 0.0], 2: [0, 0, 0.0]}
+        self.outcomes = collections.Counter()
+
+    def add(self, tier, received, seconds):
+        with self.lock:
+            stats = self.tiers[tier]
+            stats[0] += 1
+            stats[1] += received
+            stats[2] += seconds
+
+    def outcome(self, tier, status):
+        with self.lock:
+            self.outcomes[(tier, status)] += 1
+
+    def report(self):
+        for tier, (count, received, seconds) in self.tiers.items():
+            if count:
+                print(f"Camada {tier}: {count} requisicoes, {received / 1e6:.1f} MB, {seconds:.0f}s somados")
+        tier2 = {status: n for (tier, status), n in self.outcomes.items() if tier == 2}
+        if tier2:
+            print("  Camada 2: " + ', '.join(f'{status}={n}' for status, n in sorted(tier2.items())))
+
+
+PROBE_STATS = ProbeStats()
+
+
+class LatencyHistogram:
+    """Histograma de latencias em faixas logaritmicas (50 ms a ~60 s, passo de 25%)."""
+
+    BOUNDS = [0.05 * 1.25 ** i for i in range(33)]
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+
+    def add(self, seconds):
+        self.buckets[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+
+    def percentile(self, pct):
+        """Limite superior da faixa que contem o percentil."""
+        rank = max(1, self.count * pct / 100)
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return 0.0
+
+
+class HostLatency:
+    """Latencias observadas por host e timeouts aprendidos a partir delas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hosts = {}                      # host -> (connect, ttfb)
+        self.counts = collections.Counter()
+
+    def observe(self, host, response):
+        with self.lock:
+            connect, ttfb = self.hosts.get(host) or self.hosts.setdefault(
+                host, (LatencyHistogram(), LatencyHistogram()))
+            ttfb.add(response.ttfb)
+            if response.connect:
+                connect.add(response.connect)
+
+    def alive(self, host):
+        """O host ja respondeu o bastante para ter timeout proprio."""
+        entry = self.hosts.get(host)
+        return entry is not None and entry[1].count >= PROBE_ADAPTIVE_MIN_SAMPLES
+
+    def slow(self, host):
+        with self.lock:
+            return self.alive(host) and \
+                self.hosts[host][1].percentile(PROBE_TIMEOUT_PERCENTILE) >= PROBE_SLOW_HOST_TTFB
+
+    def _learned(self, host):
+        learned = self.hosts[host][1].percentile(PROBE_TIMEOUT_PERCENTILE)
+        return min(PROBE_TIMEOUT_MAX, max(PROBE_TIMEOUT_MIN, learned * PROBE_TIMEOUT_FACTOR + PROBE_TIMEOUT_PAD))
+
+    def timeout_for(self, host, default=PROBE_TIMEOUT):
+        with self.lock:
+            if not self.alive(host):
+                return default
+            self.counts['adaptive'] += 1
+            return self._learned(host)
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def report(self, limit=5):
+        counts = self.counts
+        if not self.hosts:
+            return
+        print(f"\nTimeouts adaptativos: {counts['adaptive']} testes com timeout aprendido, "
+              f"{counts['timeouts']} timeouts")
+        print(f"  Hosts lentos: {counts['retries']} repetidos com {PROBE_TIMEOUT_MAX}s, "
+              f"{counts['recovered']} mantidos; hosts rapidos ou mortos: {counts['dead']} falhas sem repeticao")
+        ranked = sorted(self.hosts.items(), key=lambda item: -item[1][1].percentile(50))
+        for host, (connect, ttfb) in ranked[:limit]:
+            line = (f"  {host}: {ttfb.count} respostas, primeiro byte p50 {ttfb.percentile(50):.2f}s "
+                    f"p{PROBE_TIMEOUT_PERCENTILE} {ttfb.percentile(PROBE_TIMEOUT_PERCENTILE):.2f}s")
+            if connect.count:
+                line += f", conexao p{PROBE_TIMEOUT_PERCENTILE} {connect.percentile(PROBE_TIMEOUT_PERCENTILE):.2f}s"
+            if self.alive(host):
+                line += f", timeout {self._learned(host):.1f}s"
+            print(line)
+
+
+HOST_LATENCY = HostLatency()
+
+
+def playlist_kind(body):
+    """Classifica o inicio de um corpo: 'master', 'media', 'html' ou 'other'."""
+    head = body.lstrip(b'\xef\xbb\xbf \t\r\n')
+    if head.startswith(b'#EXTM3U'):
+        return 'master' if b'#EXT-X-STREAM-INF' in body else 'media'
+    lowered = head[:512].lower()
+    if lowered.startswith(b'<!doctype html') or b'<html' in lowered:
+        return 'html'
+    return 'other'
+
+
+def _playlist_lines(body):
+    lines = body.decode('utf-8', 'replace').splitlines()
+    if lines and not body.endswith(b'\n'):
+        lines.pop()  # ultima linha pode ter sido cortada pelo limite de bytes
+    return [line.strip() for line in lines if line.strip()]
+
+
+def pick_variant(body, base_url):
+    """URI absoluta da variante de menor BANDWIDTH de uma master playlist."""
+    best = None
+    lines = _playlist_lines(body)
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-STREAM-INF') and i + 1 < len(lines) and not lines[i + 1].startswith('#'):
+            match = re.search(r'BANDWIDTH=(\d+)', line)
+            bandwidth = int(match.group(1)) if match else 0
+            if best is None or bandwidth < best[0]:
+                best = (bandwidth, lines[i + 1])
+    return urljoin(base_url, best[1]) if best else None
+
+
+# Qualidade anunciada por um stream HLS: kind e 'master' ou 'media' (sem variantes)
+StreamQuality = collections.namedtuple('StreamQuality', 'kind bandwidth width height codecs')
+
+_HLS_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^",]*)')
+
+
+def stream_quality(body):
+    """Qualidade de uma playlist HLS pelo inicio do corpo (o da camada 1); None se nao e HLS.
+
+    Guarda a maior BANDWIDTH (com os CODECS dessa variante) e a maior
+    RESOLUTION entre as variantes completas no trecho lido.
+    """
+    kind = playlist_kind(body)
+    if kind not in ('master', 'media'):
+        return None
+    best_bandwidth, codecs, width, height = 0, '', 0, 0
+    if kind == 'master':
+        for line in _playlist_lines(body):
+            if not line.startswith('#EXT-X-STREAM-INF:'):
+                continue
+            attrs = {key: value.strip('"') for key, value in _HLS_ATTR_RE.findall(line, 18)}
+            bandwidth = attrs.get('BANDWIDTH', '')
+            if bandwidth.isdigit() and int(bandwidth) > best_bandwidth:
+                best_bandwidth, codecs = int(bandwidth), attrs.get('CODECS', '')
+            w, _, h = attrs.get('RESOLUTION', '').partition('x')
+            if w.isdigit() and h.isdigit() and int(h) > height:
+                width, height = int(w), int(h)
+    return StreamQuality(kind, best_bandwidth, width, height, sys.intern(codecs))
+
+
+def quality_rank(channel):
+    """Preferencia entre URLs do mesmo canal: maior resolucao, maior BANDWIDTH, master antes de media."""
+    quality = channel.quality
+    if quality is None:
+        return (0, 0, False)
+    return (quality.height, quality.bandwidth, quality.kind == 'master')
+
+
+def quality_attrs(quality):
+    """Atributos EXTINF com a qualidade conhecida do stream."""
+    attrs = {}
+    if quality.height:
+        height = quality.height
+        attrs['x-quality'] = 'UHD' if height >= 2160 else 'FHD' if height >= 1080 else 'HD' if height >= 720 else 'SD'
+        attrs['x-resolution'] = f'{quality.width}x{height}'
+    if quality.bandwidth:
+        attrs['x-bandwidth'] = str(quality.bandwidth)
+    if quality.codecs:
+        attrs['x-codecs'] = quality.codecs
+    return attrs
+
+
+def first_segment(body, base_url):
+    """URI absoluta do primeiro segmento de uma media playlist."""
+    for line in _playlist_lines(body):
+        if not line.startswith('#'):
+            return urljoin(base_url, line)
+    return None
+
+
+def probe_steps(url, tiered=True):
+    """Logica do teste em camadas, independente do motor (sync ou async).
+
+    Gerador: produz pedidos (camada, url, max_bytes, usar_range), recebe a
+    ProbeResponse (ou None em caso de erro/timeout) e termina retornando o
+    status final do canal.
+    """
+    response = yield (1, url, PROBE_TIER1_BYTES, tiered)
+    if response is not None and response.status == 416:
+        response = yield (1, url, PROBE_TIER1_BYTES, False)
+    if response is None:
+        return 'ERROR'
+    if response.status not in (200, 206):
+        return f'HTTP_{response.status}'
+    if not response.body:
+        return 'HTTP_200'
+    if not tiered:
+        return 'OK'
+
+    kind = playlist_kind(response.body)
+    if kind == 'html':
+        return 'INVALID'
+    if kind != 'master':
+        return 'OK'
+
+    # Camada 2: master playlist -> variante -> primeiro segmento
+    budget = PROBE_TIER2_BYTES
+    playlist = response
+    for _ in range(2):  # admite uma master aninhada
+        variant = pick_variant(playlist.body, playlist.url)
+        if not variant:
+            return 'OK'  # inconclusivo: mantem o resultado da camada 1
+        playlist = yield (2, variant, min(PROBE_TIER2_PLAYLIST_BYTES, budget), False)
+        if playlist is None or playlist.status not in (200, 206):
+            return 'DEAD_VARIANT'
+        budget -= playlist.received
+        if playlist_kind(playlist.body) != 'master':
+            break
+
+    if playlist_kind(playlist.body) != 'media':
+        return 'DEAD_VARIANT'
+    segment = first_segment(playlist.body, playlist.url)
+    if not segment:
+        return 'DEAD_VARIANT'
+    if budget <= 0:
+        return 'OK'  # orcamento esgotado: inconclusivo
+    response = yield (2, segment, min(PROBE_TIER2_SEGMENT_BYTES, budget), True)
+    if response is None or response.status not in (200, 206) or not response.body:
+        return 'DEAD_VARIANT'
+    return 'OK'
+
+
+def fetch_probe(url, max_bytes, timeout, byte_range=False):
+    """GET de teste (sync) limitado a `max_bytes`."""
+    headers = {'Range': f'bytes=0-{max_bytes - 1}'} if byte_range else None
+    start = time.monotonic()
+    response = get_http_client().get(url, headers=headers, timeout=timeout, stream=True)
+    ttfb = time.monotonic() - start
+    body = read_probe_body(response, max_bytes) if response.status_code in (200, 206) else b''
+    if response.status_code not in (200, 206):
+        read_probe_body(response, 0)
+    return ProbeResponse(response.status_code, body, len(body), response.url, ttfb, None,
+                         time.monotonic() - start)
+
+
+def run_probe(url, timeout=PROBE_TIMEOUT, tiered=None):
+    """Executa probe_steps com requests.
+
+    Retorna (status final, camada 1 estourou o timeout, resposta da camada 1
+    ou None), a resposta para ler a qualidade HLS e os tempos sem nova requisicao.
+    """
+    tiered = PROBE_TIERED if tiered is None else tiered
+    steps = probe_steps(url, tiered)
+    request = next(steps)
+    deadline = None
+    timed_out = False
+    first = None
     try:
-        response = requests.get(url, headers=headers, timeout=timeout, stream=True)
-
-        if response.status_code == 200:
-            first_bytes = next(response.iter_content(1024), b'')
-            response.close()
+        while True:
+            tier, fetch_url, max_bytes, byte_range = request
+            limit = timeout
+            if tier == 2:
+                deadline = deadline or time.monotonic() + PROBE_TIER2_TIMEOUT
+                limit = min(timeout, deadline - time.monotonic())
+            start = time.monotonic()
+            try:
+                response = fetch_probe(fetch_url, max_bytes, limit, byte_range) if limit > 0 else None
+            except requests.exceptions.Timeout:
+                response, timed_out = None, tier == 1
+            except Exception:
+                response = None
+            if tier == 1 and response is not None:
+                HOST_LATENCY.observe(urlsplit(url).hostname or '', response)
+                first = response
+            PROBE_STATS.add(tier, response.received if response else 0, time.monotonic() - start)
+            request = steps.send(response)
+    except StopIteration as done:
+        PROBE_STATS.outcome(2 if deadline else 1, done.value)
+        return done.value, timed_out, first
+
+
+def adaptive_probe(url, timeout):
+    """Escolhe o timeout do teste pelo host, repetindo uma vez os timeouts de hosts lentos.
+
+    Gerador usado pelos dois motores: produz o limite de cada tentativa,
+    recebe (status, estourou o timeout) e termina retornando o status final.
+    """
+    host = urlsplit(url).hostname or ''
+    limit = HOST_LATENCY.timeout_for(host, timeout)
+    status, timed_out = yield limit
+    if not timed_out:
+        return status
+    HOST_LATENCY.count('timeouts')
+    if not HOST_LATENCY.slow(host) or limit >= PROBE_TIMEOUT_MAX:
+        HOST_LATENCY.count('dead')
+        return status
+    # Host lento mas vivo: uma segunda chance com o prazo maior
+    HOST_LATENCY.count('retries')
+    status, _ = yield PROBE_TIMEOUT_MAX
+    if status != 'ERROR':
+        HOST_LATENCY.count('recovered')
+    return status
+
+
+def probe_timing(response):
+    """(conexao, primeiro byte, bytes/s do trecho lido) de uma resposta de teste."""
+    transfer = response.elapsed - response.ttfb
+    rate = round(response.received / transfer) if response.received and transfer > 0.001 else None
+    connect = round(response.connect, 4) if response.connect else None
+    return connect, round(response.ttfb, 4), rate
+
+
+def startup_score(history):
+    """Inicio estimado em segundos pelas medicoes [conexao, primeiro byte, bytes/s]; None sem medicoes."""
+    if not history:
+        return None
+    score = _percentiles([ttfb for _, ttfb, _ in history], (50,))['p50']
+    rates = [rate for _, _, rate in history if rate]
+    if rates:
+        score += PROBE_SCORE_CHUNK / _percentiles(rates, (50,))['p50']
+    return round(score, 3)
+
+
+def describe_channel(channel, first):
+    """Qualidade HLS e tempos do canal OK pela resposta da camada 1 (sem nova requisicao)."""
+    if channel.status == 'OK' and first is not None:
+        channel.quality, channel.timing = stream_quality(first.body), probe_timing(first)
+    else:
+        channel.quality = channel.timing = None
 
-            if first_bytes:
-                return {**channel, 'status': 'OK'}
 
-        return {**channel, 'status': f'HTTP_{response.status_code}'}
+def test_channel(channel, timeout=PROBE_TIMEOUT):
+    """Testa se um canal esta funcionando (grava status e latencia no proprio canal)."""
+    start = time.monotonic()
+    first = None
 
+    try:
+        steps = adaptive_probe(channel.url, timeout)
+        limit = next(steps)
+        while True:
+            status, timed_out, first = run_probe(channel.url, limit)
+            limit = steps.send((status, timed_out))
+    except StopIteration as done:
+        channel.status = done.value
     except:
-        return {**channel, 'status': 'ERROR'}
-
-
-def test_channels_parallel(channels):
-    """Testa canais em paralelo."""
+        channel.status = 'ERROR'
+    describe_channel(channel, first)
+
+    channel.latency = time.monotonic() - start
+    return channel
+
+
+class HostGuard:
+    """Estagio de DNS e disjuntor por host, compartilhado pelos dois motores.
+
+    Os hosts sao resolvidos em paralelo antes dos canais chegarem ao teste
+    (as respostas ficam no DnsCache); canais de hosts sem DNS ou com o
+    disjuntor aberto falham sem gastar um timeout.
+
+    As falhas seguidas sao contadas na ordem de inicio dos testes: uma
+    rajada de timeouts de testes iniciados antes de um sucesso no mesmo
+    host nao abre o disjuntor.
+    """
+
+    def __init__(self, timeout=PROBE_TIMEOUT, threshold=PROBE_BREAKER_THRESHOLD, sample=PROBE_BREAKER_SAMPLE):
+        self.timeout = timeout
+        self.threshold = threshold
+        self.sample = sample
+        self.lock = threading.Lock()
+        self.resolver = ThreadPoolExecutor(max_workers=DNS_RESOLVE_WORKERS, thread_name_prefix='dns')
+        self.resolved = {}                          # host -> Future[bool]
+        self.started = collections.Counter()        # testes iniciados por host
+        self.last_ok = {}                           # host -> ordem do ultimo teste OK
+        self.failures = collections.defaultdict(list)  # host -> ordem das falhas apos last_ok
+        self.skipped = collections.Counter()        # (host, motivo) -> canais nao testados
+        self.blocked = collections.Counter()        # canais que chegaram com o disjuntor aberto
+
+    @staticmethod
+    def _resolve(host, port):
+        try:
+            socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror:
+            return False
+        except OSError:
+            pass  # erro que nao e de DNS: deixa o teste decidir
+        return True
+
+    def prefetch(self, url):
+        """Agenda a resolucao do host da URL (uma vez por host)."""
+        parts = urlsplit(url)
+        host = parts.hostname or ''
+        with self.lock:
+            future = self.resolved.get(host)
+            if future is None:
+                port = parts.port or (443 if parts.scheme == 'https' else 80)
+                future = self.resolved[host] = self.resolver.submit(self._resolve, host, port)
+        return host, future
+
+    def resolve_ahead(self, channels, window=DNS_PREFETCH_WINDOW):
+        """Repassa os canais, resolvendo os hosts ate `window` canais a frente."""
+        buffer = collections.deque()
+        for channel in channels:
+            self.prefetch(channel.url)
+            buffer.append(channel)
+            if len(buffer) > window:
+                yield buffer.popleft()
+        yield from buffer
+
+    def _verdict(self, host, resolves):
+        with self.lock:
+            if not resolves:
+                self.skipped[(host, 'dns')] += 1
+                return 'ERROR', None
+            if self.threshold and len(self.failures.get(host, ())) >= self.threshold:
+                self.blocked[host] += 1
+                if not self.sample or self.blocked[host] % self.sample:
+                    self.skipped[(host, 'breaker')] += 1
+                    return 'ERROR', None
+                # amostra: testa de verdade para ver se o host voltou
+            self.started[host] += 1
+            return None, self.started[host]
+
+    def admit(self, channel):
+        """(status, None) para nao testar o canal, ou (None, ordem) para testar."""
+        host, future = self.prefetch(channel.url)
+        return self._verdict(host, future.result())
+
+    async def admit_async(self, channel):
+        host, future = self.prefetch(channel.url)
+        return self._verdict(host, await asyncio.wrap_future(future))
+
+    def record(self, channel, order):
+        """Atualiza o disjuntor com o resultado de um teste real."""
+        host = urlsplit(channel.url).hostname or ''
+        with self.lock:
+            if channel.status == 'ERROR':
+                if order > self.last_ok.get(host, 0):
+                    self.failures[host].append(order)
+            elif order > self.last_ok.get(host, 0):
+                self.last_ok[host] = order
+                failures = [o for o in self.failures.pop(host, ()) if o > order]
+                if failures:
+                    self.failures[host] = failures
+
+    def close(self):
+        self.resolver.shutdown(wait=False, cancel_futures=True)
+
+    def report(self, limit=10):
+        by_host = collections.defaultdict(lambda: [0, 0])
+        for (host, reason), count in self.skipped.items():
+            by_host[host][reason == 'breaker'] += count
+        if not by_host:
+            return
+        total = sum(dns + breaker for dns, breaker in by_host.values())
+        print(f"\nHosts ignorados: {len(by_host)} hosts, {total} canais sem teste "
+              f"(ate {total * self.timeout / 60:.1f} min de timeout poupados)")
+        ranked = sorted(by_host.items(), key=lambda item: -sum(item[1]))
+        for host, (dns, breaker) in ranked[:limit]:
+            reason = 'sem DNS' if dns else 'disjuntor'
+            print(f"  {host}: {dns + breaker} canais ({reason}), ~{(dns + breaker) * self.timeout:.0f}s poupados")
+
+
+def test_channels_parallel(channels, max_workers=None, timeout=PROBE_TIMEOUT, verbose=True):
+    """Testa canais em paralelo (aceita lista ou iteravel, p.ex. um ChannelStream)."""
     cpu_count = multiprocessing.cpu_count()
-    max_workers = max(4, cpu_count - 1)
+    max_workers = max_workers or max(4, cpu_count - 1)
+    total = len(channels) if hasattr(channels, '__len__') else None
 
-    print(f"\nTestando {len(channels)} canais com {max_workers} workers...")
+    if verbose:
+        print(f"\nTestando {total or 'os'} canais com {max_workers} workers...")
 
     results = []
     working = 0
+    guard = HostGuard(timeout)
+    pending = guard.resolve_ahead(channels)
+    lock = threading.Lock()
+
+    def worker():
+        nonlocal working
+        while True:
+            with lock:
+                channel = next(pending, None)
+            if channel is None:
+                return
+            status, order = guard.admit(channel)
+            if status is None:
+                result = test_channel(channel, timeout)
+                guard.record(result, order)
+            else:
+                channel.status, channel.latency = status, 0.0
+                result = channel
+            with lock:
+                results.append(result)
+                if result.status == 'OK':
+                    working += 1
+                i = len(results)
+                if verbose and (i % 100 == 0 or i == total):
+                    print(f"  Progresso: {i}/{total or '?'} ({working} OK)")
 
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_channel = {executor.submit(test_channel, ch): ch for ch in channels}
+        for _ in range(max_workers):
+            executor.submit(worker)
 
-        for i, future in enumerate(as_completed(future_to_channel), 1):
-            result = future.result()
-            results.append(result)
+    guard.close()
+    if verbose:
+        guard.report()
+    return results, working
 
-            if result['status'] == 'OK':
-                working += 1
 
-            if i % 100 == 0 or i == len(channels):
-                print(f"  Progresso: {i}/{len(channels)} ({working} OK)")
+async def async_http_get(url, max_bytes=1024, max_redirects=PROBE_MAX_REDIRECTS, pool=None, headers=None):
+    """GET HTTP/1.1 minimo via asyncio. Retorna uma ProbeResponse.
 
-    return results, working
+    Com `pool`, usa conexoes keep-alive; a conexao so volta ao pool quando o
+    corpo inteiro (com Content-Length ate `max_bytes`) foi lido.
+    """
+    own_pool = pool is None
+    if own_pool:
+        pool = get_http_client().new_async_pool()
+    try:
+        return await _async_http_get(url, max_bytes, max_redirects, pool, headers or {})
+    finally:
+        if own_pool:
+            pool.close()
+
+
+async def _async_http_get(url, max_bytes, max_redirects, pool, extra_headers):
+    extra = ''.join(f'{key}: {value}\r\n' for key, value in extra_headers.items())
+    start = time.monotonic()
+    connect = 0.0
+    for _ in range(max_redirects + 1):
+        parts = urlsplit(url)
+        scheme = parts.scheme
+        host = parts.hostname
+        port = parts.port or (443 if scheme == 'https' else 80)
+        path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        request = (
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\n'
+            f'User-Agent: {USER_AGENT}\r\n'
+            'Accept: */*\r\n'
+            f'{extra}\r\n'
+        ).encode('latin-1')
+
+        opening = time.monotonic()
+        reader, writer, reused = await pool.acquire(scheme, host, port)
+        if not reused:
+            connect += time.monotonic() - opening
+        keep = False
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line and reused:
+                # Conexao ociosa fechada pelo servidor: tenta de novo numa nova
+                writer.close()
+                opening = time.monotonic()
+                reader, writer, reused = await pool.acquire_new(scheme, host, port)
+                connect += time.monotonic() - opening
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+
+            status = int(status_line.split(None, 2)[1])
+            ttfb = time.monotonic() - start
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+
+            length = headers.get('content-length', '')
+            reusable = ('close' not in headers.get('connection', '').lower()
+                        and length.isdigit() and int(length) <= max_bytes)
+            if reusable:
+                body = await reader.readexactly(int(length))
+                keep = True
+            elif status not in (200, 206):
+                body = b''
+            elif 'chunked' in headers.get('transfer-encoding', '').lower():
+                size = int(((await reader.readline()).split(b';')[0].strip() or b'0'), 16)
+                body = await reader.read(min(size, max_bytes)) if size else b''
+            else:
+                body = await reader.read(max_bytes)
+
+            if status in (301, 302, 303, 307, 308) and headers.get('location'):
+                url = urljoin(url, headers['location'])
+                continue
+            return ProbeResponse(status, body, len(body), url, ttfb, connect, time.monotonic() - start)
+        finally:
+            if keep:
+                pool.release(scheme, host, port, reader, writer)
+            else:
+                writer.close()
+
+    raise ConnectionError(f'Redirecionamentos demais: {url}')
+
+
+async def run_probe_async(url, timeout=PROBE_TIMEOUT, tiered=None, pool=None):
+    """Executa probe_steps com o cliente asyncio; mesmo retorno de run_probe."""
+    tiered = PROBE_TIERED if tiered is None else tiered
+    steps = probe_steps(url, tiered)
+    request = next(steps)
+    deadline = None
+    timed_out = False
+    first = None
+    try:
+        while True:
+            tier, fetch_url, max_bytes, byte_range = request
+            limit = timeout
+            if tier == 2:
+                deadline = deadline or time.monotonic() + PROBE_TIER2_TIMEOUT
+                limit = min(timeout, deadline - time.monotonic())
+            headers = {'Range': f'bytes=0-{max_bytes - 1}'} if byte_range else None
+            start = time.monotonic()
+            try:
+                response = await asyncio.wait_for(
+                    async_http_get(fetch_url, max_bytes, pool=pool, headers=headers), limit)
+            except TimeoutError:
+                response, timed_out = None, tier == 1
+            except Exception:
+                response = None
+            if tier == 1 and response is not None:
+                HOST_LATENCY.observe(urlsplit(url).hostname or '', response)
+                first = response
+            PROBE_STATS.add(tier, response.received if response else 0, time.monotonic() - start)
+            request = steps.send(response)
+    except StopIteration as done:
+        PROBE_STATS.outcome(2 if deadline else 1, done.value)
+        return done.value, timed_out, first
+
+
+async def test_channel_async(channel, timeout=PROBE_TIMEOUT, pool=None):
+    """Versao asyncio de test_channel (mesmo contrato de retorno)."""
+    start = time.monotonic()
+    first = None
+    try:
+        steps = adaptive_probe(channel.url, timeout)
+        limit = next(steps)
+        while True:
+            status, timed_out, first = await run_probe_async(channel.url, limit, pool=pool)
+            limit = steps.send((status, timed_out))
+    except StopIteration as done:
+        channel.status = done.value
+    except Exception:
+        channel.status = 'ERROR'
+    describe_channel(channel, first)
+    channel.latency = time.monotonic() - start
+    return channel
+
+
+def test_channels_async(channels, concurrency=PROBE_CONCURRENCY, per_host=PROBE_PER_HOST, timeout=PROBE_TIMEOUT,
+                        verbose=True):
+    """Testa canais com asyncio: `concurrency` testes em voo, no maximo `per_host` por host.
+
+    Aceita lista ou iteravel bloqueante (p.ex. um ChannelStream); neste caso os
+    canais sao puxados por uma thread auxiliar para nao travar o loop.
+    Um canal cujo host ja tem `per_host` testes em voo espera na fila desse
+    host, sem ocupar um worker: uma sequencia longa de URLs do mesmo host nao
+    reduz a concorrencia dos demais.
+    """
+    total = len(channels) if hasattr(channels, '__len__') else None
+    if verbose:
+        print(f"\nTestando {total or 'os'} canais (async, {concurrency} simultaneos, {per_host}/host)...")
+
+    async def run():
+        results = []
+        working = 0
+        in_flight = collections.Counter()   # host -> testes em voo
+        waiting = {}                        # host -> canais a espera de vaga no host
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Queue(concurrency)
+        pool = get_http_client().new_async_pool()
+        workers = max(1, min(concurrency, total if total is not None else concurrency))
+        guard = HostGuard(timeout)
+
+        async def feed():
+            it = guard.resolve_ahead(channels)
+            while True:
+                if total is None:
+                    channel = await loop.run_in_executor(None, next, it, None)
+                else:
+                    channel = next(it, None)
+                if channel is None:
+                    break
+                await pending.put(channel)
+            for _ in range(workers):
+                await pending.put(None)
+
+        async def probe(channel):
+            nonlocal working
+            # Decide ja com a vaga do host para ver as falhas dos testes em voo
+            status, order = await guard.admit_async(channel)
+            if status is None:
+                result = await test_channel_async(channel, timeout, pool=pool)
+                guard.record(result, order)
+            else:
+                channel.status, channel.latency = status, 0.0
+                result = channel
+            results.append(result)
+            if result.status == 'OK':
+                working += 1
+            done = len(results)
+            if verbose and (done % 100 == 0 or done == total):
+                print(f"  Progresso: {done}/{total or '?'} ({working} OK)")
+
+        async def worker():
+            # Cada worker puxa o proximo canal: no maximo `concurrency` testes
+            # (e corrotinas) existem ao mesmo tempo, independente do total.
+            while True:
+                channel = await pending.get()
+                if channel is None:
+                    return
+                host = urlsplit(channel.url).hostname or ''
+                if in_flight[host] >= per_host:
+                    # Host cheio: o canal espera a vaga e o worker segue com outro.
+                    # Quem esta testando esse host pega a fila ao terminar.
+                    waiting.setdefault(host, collections.deque()).append(channel)
+                    continue
+                in_flight[host] += 1
+                while channel is not None:
+                    await probe(channel)
+                    queued = waiting.get(host)
+                    channel = queued.popleft() if queued else None
+                    if queued is not None and not queued:
+                        del waiting[host]
+                in_flight[host] -= 1
+                if not in_flight[host]:
+                    del in_flight[host]
+
+        await asyncio.gather(feed(), *(worker() for _ in range(workers)))
+        pool.close()
+        guard.close()
+        if verbose:
+            guard.report()
+        return results, working
+
+    return asyncio.run(run())
+
+
+def probe_channels(channels, engine=PROBE_ENGINE, concurrency=PROBE_CONCURRENCY, per_host=PROBE_PER_HOST,
+                   timeout=PROBE_TIMEOUT, verbose=True):
+    """Testa canais com o motor escolhido ('async' ou 'threads')."""
+    if engine == 'threads':
+        return test_channels_parallel(channels, timeout=timeout, verbose=verbose)
+    return test_channels_async(channels, concurrency=concurrency, per_host=per_host, timeout=timeout,
+                               verbose=verbose)
+
+
+class ProbeStore:
+    """Resultados de testes anteriores em SQLite, chaveados pela URL normalizada.
+
+    Canais OK sao retestados depois de PROBE_TTL_OK; canais com falha seguem
+    backoff exponencial (PROBE_RETRY_BASE * 2^(falhas-1), ate PROBE_RETRY_MAX).
+    A qualidade HLS dos canais OK vai junto (JSON de StreamQuality), assim
+    como as ultimas medicoes de inicio (history) e o score calculado delas.
+    O historico fica so no banco: e lido por lote ao gravar uma rodada.
+    """
+
+    def __init__(self, path=PROBE_STORE_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)  # modo serve usa varias threads
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS probes ('
+            ' url TEXT PRIMARY KEY,'
+            ' status TEXT NOT NULL,'
+            ' latency REAL,'
+            ' checked_at REAL NOT NULL,'
+            ' failures INTEGER NOT NULL DEFAULT 0,'
+            ' next_check REAL NOT NULL,'
+            ' quality TEXT,'
+            ' history TEXT,'
+            ' score REAL)'
+        )
+        # Bancos de versoes anteriores ganham as colunas novas
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(probes)')}
+        for column, kind in (('quality', 'TEXT'), ('history', 'TEXT'), ('score', 'REAL')):
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE probes ADD COLUMN {column} {kind}')
+        self.rows = {
+            url: (status, latency, failures, next_check, quality, score)
+            for url, status, latency, failures, next_check, quality, score in self.conn.execute(
+                'SELECT url, status, latency, failures, next_check, quality, score FROM probes')
+        }
 
+    def lookup(self, channel, now=None):
+        """Resultado ainda valido para o canal, ou None se precisa ser testado."""
+        row = self.rows.get(normalize_url(channel.url))
+        if row and row[3] > (now or time.time()):
+            channel.status, channel.latency = row[0], row[1]
+            channel.quality = StreamQuality(*json.loads(row[4])) if row[4] else None
+            channel.score = row[5]
+            return channel
+        return None
+
+    def split(self, channels, now=None):
+        """Separa canais com resultado ainda valido dos que precisam ser testados."""
+        now = now or time.time()
+        cached, to_probe = [], []
+        for ch in channels:
+            hit = self.lookup(ch, now)
+            if hit:
+                cached.append(hit)
+            else:
+                to_probe.append(ch)
+        return cached, to_probe
+
+    def next_interval(self, status, failures):
+        """Intervalo ate o proximo teste, com jitter para espalhar a carga."""
+        if status == 'OK':
+            interval = PROBE_TTL_OK
+        else:
+            interval = min(PROBE_RETRY_BASE * 2 ** (failures - 1), PROBE_RETRY_MAX)
+        return interval * random.uniform(1 - PROBE_TTL_JITTER, 1)
+
+    def histories(self, keys, batch=500):
+        """{url normalizada: historico de medicoes} das URLs que ja tem historico."""
+        histories = {}
+        for i in range(0, len(keys), batch):
+            chunk = keys[i:i + batch]
+            histories.update(
+                (url, json.loads(history)) for url, history in self.conn.execute(
+                    f'SELECT url, history FROM probes WHERE history IS NOT NULL AND url IN '
+                    f'({", ".join("?" * len(chunk))})', chunk))
+        return histories
+
+    def record(self, results, now=None):
+        """Grava os resultados de uma rodada de testes (e o score dos canais com medicao)."""
+        now = now or time.time()
+        results = list(results)
+        histories = self.histories([normalize_url(r.url) for r in results])
+        rows = []
+        for r in results:
+            key = normalize_url(r.url)
+            previous = self.rows.get(key)
+            failures = 0 if r.status == 'OK' else (previous[2] if previous else 0) + 1
+            next_check = now + self.next_interval(r.status, failures)
+            quality = json.dumps(r.quality) if r.quality else None
+            history = histories.get(key, [])
+            if r.timing:
+                history = (history + [list(r.timing)])[-PROBE_HISTORY_MAX:]
+            r.score = startup_score(history)
+            self.rows[key] = (r.status, r.latency, failures, next_check, quality, r.score)
+            rows.append((key, r.status, r.latency, now, failures, next_check, quality,
+                         json.dumps(history) if history else None, r.score))
+        self.conn.executemany('INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.conn.execute('DELETE FROM probes WHERE checked_at < ?', (now - PROBE_STORE_MAX_AGE,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# Assinaturas dos formatos de imagem usados em logos (quando o Content-Type nao ajuda)
+_IMAGE_MAGIC = (b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'\x00\x00\x01\x00', b'<svg', b'<?xml', b'BM')
+
+
+def check_logo(url, etag='', timeout=LOGO_TIMEOUT):
+    """Testa a URL de um logo: (ok, etag); ok e None se o host nao respondeu.
+
+    Com o ETag de um teste OK anterior o GET e condicional: 304 confirma o
+    logo sem baixar a imagem.
+    """
+    headers = {'If-None-Match': etag} if etag else {}
+    try:
+        response = get_http_client().get(url, headers=headers, timeout=timeout, stream=True)
+    except (requests.RequestException, ValueError):
+        return None, etag
+    if response.status_code == 304:
+        response.close()
+        return True, etag
+    if response.status_code != 200:
+        read_probe_body(response, 0)
+        return False, ''
+    content_type = response.headers.get('Content-Type', '').lower()
+    head = read_probe_body(response, 512)
+    ok = bool(head) and (content_type.startswith('image/') or head.lstrip().startswith(_IMAGE_MAGIC))
+    return ok, response.headers.get('ETag', '') if ok else ''
+
+
+class LogoStore:
+    """Resultado do teste de cada URL de logo em SQLite (uma linha por URL, nao por canal).
+
+    Logos OK sao retestados depois de LOGO_TTL_OK, com o ETag guardado;
+    quebrados (ou cujo host nao respondeu) depois de LOGO_TTL_BROKEN. Host
+    fora do ar nao muda o resultado anterior de um logo ja conhecido.
+    """
+
+    def __init__(self, path=LOGO_STORE_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS logos ('
+            ' url TEXT PRIMARY KEY,'
+            ' ok INTEGER NOT NULL,'
+            ' etag TEXT,'
+            ' checked_at REAL NOT NULL,'
+            ' next_check REAL NOT NULL)'
+        )
+        self.rows = {
+            url: (bool(ok), etag or '', next_check)
+            for url, ok, etag, next_check in self.conn.execute('SELECT url, ok, etag, next_check FROM logos')
+        }
 
-def collect_all_channels():
-    """Coleta canais de todas as fontes."""
-    print("\nColetando canais...")
+    def ok(self, url):
+        """True/False pelo ultimo teste da URL, None se nunca foi testada."""
+        row = self.rows.get(url)
+        return row[0] if row else None
 
-    all_channels = []
+    def due(self, urls, now=None):
+        """URLs nunca testadas ou com o resultado vencido."""
+        now = now or time.time()
+        return [url for url in urls if url not in self.rows or self.rows[url][2] <= now]
 
-    # Download paralelo de todas as fontes
-    def fetch_source(source_key, source):
-        region = source.get('region', '')
-        if region not in TARGET_REGIONS:
+    def check(self, urls, workers=LOGO_WORKERS, timeout=LOGO_TIMEOUT):
+        """Testa as URLs em paralelo e grava os resultados; retorna [(url, ok)]."""
+        if not urls:
             return []
-        content, count = download_m3u(source['url'], source['name'])
-        if content:
-            return parse_m3u_to_channels(content, source['name'], region)
-        return []
-
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = {
-            executor.submit(fetch_source, key, src): key
-            for key, src in SOURCES.items()
-        }
-        for future in as_completed(futures):
-            channels = future.result()
-            all_channels.extend(channels)
-
-    # Adicionar canais extras (VH1, MTV)
-    if EXTRA_CHANNELS:
-        print(f"\n  Adicionando {len(EXTRA_CHANNELS)} canais extras (VH1/MTV)...")
-        for ch in EXTRA_CHANNELS:
-            logo = ch.get('logo', '')
-            extinf = f'#EXTINF:-1 tvg-name="{ch["name"]}" tvg-logo="{logo}",{ch["name"]}'
-            all_channels.append({
-                'name': ch['name'],
-                'url': ch['url'],
-                'extinf': extinf,
-                'source': ch.get('source', 'Extra'),
-                'region': ch.get('region', 'INT'),
-                'original_group': '',
-                'logo': logo
-            })
+        with ThreadPoolExecutor(max_workers=min(workers, len(urls))) as executor:
+            futures = {executor.submit(check_logo, url, self.etag(url), timeout): url for url in urls}
+            results = [(futures[future], *future.result()) for future in as_completed(futures)]
+        self.record(results)
+        return [(url, self.ok(url)) for url, _, _ in results]
+
+    def etag(self, url):
+        row = self.rows.get(url)
+        return row[1] if row and row[0] else ''
+
+    def record(self, results, now=None):
+        """Grava [(url, ok, etag)] de uma rodada de testes."""
+        now = now or time.time()
+        rows = []
+        for url, ok, etag in results:
+            interval = LOGO_TTL_OK if ok else LOGO_TTL_BROKEN
+            if ok is None:
+                ok = self.ok(url) or False
+            next_check = now + interval * random.uniform(1 - PROBE_TTL_JITTER, 1)
+            self.rows[url] = (ok, etag or '', next_check)
+            rows.append((url, int(ok), etag or '', now, next_check))
+        self.conn.executemany('INSERT OR REPLACE INTO logos VALUES (?, ?, ?, ?, ?)', rows)
+        self.conn.execute('DELETE FROM logos WHERE checked_at < ?', (now - LOGO_STORE_MAX_AGE,))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def validate_logos(channels, store, action=LOGO_ACTION, workers=LOGO_WORKERS, timeout=LOGO_TIMEOUT):
+    """Testa os logos (cada URL unica uma vez por TTL) e trata os quebrados.
+
+    Retorna (canais, contagens). Canais com logo quebrado viram copias com o
+    logo valido de outro canal de mesmo tvg-id ou nome normalizado
+    ('rewrite') ou sem tvg-logo ('drop'); os demais saem como vieram.
+    """
+    logos = {ch.logo.strip() for ch in channels}
+    logos = sorted(url for url in logos if url.startswith(('http://', 'https://')))
+    checked = store.check(store.due(logos), workers, timeout)
+    broken = {url for url in logos if store.ok(url) is False}
+    counts = {'logos': len(logos), 'logos_checked': len(checked), 'logos_broken': len(broken),
+              'logos_rewritten': 0, 'logos_dropped': 0}
+    if not broken:
+        return channels, counts
+
+    # Logo valido por tvg-id e por nome (o menor, para a saida nao depender da ordem)
+    replacements = {}
+    if action == 'rewrite':
+        for ch in channels:
+            logo = ch.logo.strip()
+            if logo and logo not in broken and logo.startswith(('http://', 'https://')):
+                for key in (('id', NearDuplicateIndex._tvg_id(ch)), ('name', near_name_key(ch.name))):
+                    if key[1] and (key not in replacements or logo < replacements[key]):
+                        replacements[key] = logo
+
+    result = []
+    for ch in channels:
+        if ch.logo.strip() in broken:
+            logo = (replacements.get(('id', NearDuplicateIndex._tvg_id(ch)))
+                    or replacements.get(('name', near_name_key(ch.name))))
+            ch = ch.with_attr('tvg-logo', logo)
+            counts['logos_rewritten' if logo else 'logos_dropped'] += 1
+        result.append(ch)
+    return result, counts
 
-    print(f"\nTotal coletados: {len(all_channels)}")
-    all_channels = deduplicate_channels(all_channels)
 
-    with_logo = sum(1 for ch in all_channels if ch.get('logo', '').strip())
-    without_logo = len(all_channels) - with_logo
-    print(f"  Canais com logo: {with_logo}")
-    print(f"  Canais sem logo: {without_logo}")
+def report_logos(counts):
+    print(f"\nLogos: {counts['logos']} URLs unicas, {counts['logos_checked']} testadas, "
+          f"{counts['logos_broken']} quebradas ({counts['logos_rewritten']} canais com logo substituido, "
+          f"{counts['logos_dropped']} sem logo)")
 
+
+def fetch_source(source_key, source, stream, source_cache=None, refresh=None):
+    """Baixa uma fonte (se vencida) e envia cada canal parseado para o stream.
+
+    `refresh` substitui o da fonte (o modo serve usa o proprio intervalo).
+    """
+    region = source.get('region', '')
+    if region not in TARGET_REGIONS:
+        return
+    name = source['name']
+    stats = RUN_METRICS.source(source_key, name)
+    start = time.perf_counter()
+    try:
+        _fetch_source(source_key, source, stream, source_cache, stats,
+                      source.get('refresh', SOURCE_REFRESH) if refresh is None else refresh)
+    finally:
+        stats['seconds'] = time.perf_counter() - start
+        # tempo que sobra depois da rede e da fila e o do parse
+        stats['parse_s'] = max(0.0, stats['seconds'] - stats['download_s'] - stats['queue_s'])
+
+
+def _timed(iterable, stats, key):
+    """Repassa os itens somando em stats[key] o tempo gasto esperando por eles."""
+    it = iter(iterable)
+    clock = time.perf_counter
+    while True:
+        start = clock()
+        item = next(it, _timed)
+        stats[key] += clock() - start
+        if item is _timed:
+            return
+        yield item
+
+
+def _put_all(stream, channels, stats, keep=None):
+    """Envia os canais ao stream contando-os em `stats` (e guardando em `keep`)."""
+    clock = time.perf_counter
+    for ch in channels:
+        if keep is not None:
+            keep.append(ch)
+        start = clock()
+        stats['unique'] += stream.put(ch)
+        stats['queue_s'] += clock() - start
+        stats['channels'] += 1
+
+
+def _record_schedule(stats, entry, refresh):
+    fetches, changes, interval = SourceCache.change_stats(entry)
+    stats.update(fetched_at=entry.get('fetched_at'), refresh_s=refresh, fetches=fetches, changes=changes,
+                 change_interval_s=interval)
+
+
+def _fetch_source(source_key, source, stream, source_cache, stats, refresh):
+    name, region = source['name'], source['region']
+    entry = source_cache.load(source_key) if source_cache else None
+    if source_cache and not source_cache.due(entry, refresh):
+        # Ainda dentro do refresh: canais da copia local, sem rede
+        stats['status'] = 'scheduled'
+        channels = source_cache.channels(source_key, entry, name, region)
+        _record_schedule(stats, entry, refresh)
+        _put_all(stream, channels, stats)
+        return
+
+    validators = source_cache.validators(entry) if source_cache else None
+    start = time.perf_counter()
+    lines, validators = download_m3u(source['url'], name, validators, stats)
+    stats['download_s'] += time.perf_counter() - start
+
+    if lines is NOT_MODIFIED:
+        stats['status'] = 'not_modified'
+        channels = source_cache.channels(source_key, entry, name, region)
+        saved = source_cache.save(source_key, validators, channels, name, region, previous=entry)
+        _record_schedule(stats, saved, refresh)
+        _put_all(stream, channels, stats)
+        return
+
+    if lines is not None:
+        channels = []
+        digest = hashlib.blake2b(digest_size=16)
+        try:
+            if source_cache:
+                lines = source_cache.write_body(source_key, lines, digest)
+            lines = _timed(lines, stats, 'download_s')
+            pool = get_parse_pool()
+            if pool:
+                parsed = parse_m3u_parallel(lines, name, region, pool, window=2 * PARSE_PROCESSES)
+            else:
+                parsed = parse_m3u_to_channels(lines, name, region)
+            _put_all(stream, parsed, stats, channels if source_cache else None)
+        except Exception as e:
+            print(f"    ERRO lendo {name}: {e}")
+        else:
+            stats['status'] = 'ok'
+            if source_cache:
+                saved = source_cache.save(source_key, validators, channels, name, region, previous=entry,
+                                          content_hash=digest.hexdigest())
+                _record_schedule(stats, saved, refresh)
+            return
+
+    # Falha: usa a ultima copia boa se ainda estiver dentro do limite da fonte
+    # (canais ja enviados antes de uma falha no meio do stream sao deduplicados)
+    stats['status'] = 'error'
+    if entry and time.time() - entry.get('fetched_at', 0) <= source.get('max_stale', SOURCE_MAX_STALE):
+        stats['status'] = 'stale'
+        channels = source_cache.channels(source_key, entry, name, region)
+        print(f"    Usando copia local de {name} ({len(channels)} canais)")
+        _put_all(stream, channels, stats)
+
+
+def extra_channels():
+    """Canais de EXTRA_CHANNELS no mesmo formato dos canais parseados."""
+    for ch in EXTRA_CHANNELS:
+        attrs = {'tvg-name': ch['name'], 'tvg-logo': ch.get('logo', '')}
+        yield Channel(ch['name'], ch['url'], '-1', Channel.pack_attrs(attrs),
+                      ch.get('source', 'Extra'), ch.get('region', 'INT'))
+
+
+def start_collection(source_cache=None, maxsize=PIPELINE_QUEUE_SIZE, near=None):
+    """Inicia a coleta em segundo plano e retorna o ChannelStream com os canais unicos."""
+    print("\nColetando canais...")
+    stream = ChannelStream(maxsize, near)
+
+    def produce():
+        start = time.perf_counter()
+        try:
+            # Download paralelo de todas as fontes
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                futures = [
+                    executor.submit(fetch_source, key, src, stream, source_cache)
+                    for key, src in SOURCES.items()
+                ]
+                for future in as_completed(futures):
+                    if future.exception():
+                        print(f"    ERRO: {future.exception()}")
+
+            # Adicionar canais extras (VH1, MTV)
+            if EXTRA_CHANNELS:
+                print(f"\n  Adicionando {len(EXTRA_CHANNELS)} canais extras (VH1/MTV)...")
+                for ch in extra_channels():
+                    stream.put(ch, near=False)  # escolhidos a mao: nunca viram alternativa
+        finally:
+            shutdown_parse_pool()
+            RUN_METRICS.add_stage('collect', time.perf_counter() - start)
+            RUN_METRICS.add_stage('dedup', stream.dedup_seconds)
+            for stats in list(RUN_METRICS.sources.values()):
+                RUN_METRICS.add_stage('download', stats['download_s'])
+                RUN_METRICS.add_stage('parse', stats['parse_s'])
+            stream.close()
+
+    threading.Thread(target=produce, name='coleta', daemon=True).start()
+    return stream
+
+
+def _format_interval(seconds):
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f'{seconds / size:.3g}{unit}'
+    return f'{seconds:.0f}s'
+
+
+def report_sources(min_fetches=5, limit=10):
+    """Fontes baixadas e reaproveitadas, e sugestoes de refresh a partir do historico de mudancas."""
+    sources = list(RUN_METRICS.sources.values())
+    reused = sum(1 for stats in sources if stats['status'] == 'scheduled')
+    print(f"\nFontes: {len(sources) - reused} consultadas, {reused} em dia (copia local, sem download)")
+    hints = []
+    for stats in sources:
+        refresh, interval = stats.get('refresh_s'), stats.get('change_interval_s')
+        if not refresh or stats.get('fetches', 0) < min_fetches:
+            continue
+        if stats['changes'] == 0 or (interval is not None and interval > 4 * refresh):
+            seen = f"a cada ~{_format_interval(interval)}" if interval else "nenhuma vez"
+            hints.append(f"{stats['name']}: mudou {seen} em {stats['fetches']} downloads, "
+                         f"refresh {_format_interval(refresh)} (pode aumentar)")
+        elif stats['changes'] == stats['fetches'] and refresh > 3600:
+            hints.append(f"{stats['name']}: mudou em todos os {stats['fetches']} downloads, "
+                         f"refresh {_format_interval(refresh)} (pode diminuir)")
+    for hint in hints[:limit]:
+        print(f"  {hint}")
+    if len(hints) > limit:
+        print(f"  ... e mais {len(hints) - limit} fontes (frequencias em {METRICS_FILE})")
+
+
+def collect_all_channels(source_cache=None):
+    """Coleta canais de todas as fontes (lista completa, sem sobrepor com os testes)."""
+    stream = start_collection(source_cache)
+    all_channels = list(stream)
+    stream.summary()
+    report_sources()
     return all_channels
 
 
+def m3u_header(count, updated=None):
+    """Linhas de cabecalho da playlist (sem a linha em branco final)."""
+    updated = updated or datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
+    first = f'#EXTM3U url-tvg="{EPG_URL}"' if EPG_URL else '#EXTM3U'
+    return [first, f'# Atualizado: {updated}', f'# Canais: {count}']
+
+
+_NO_SCORE = 1 << 30   # canais sem medicao vao para o fim do grupo
+
+
+def score_bucket(ch):
+    """Faixa de inicio estimado do canal (PROBE_SCORE_STEP segundos); 0 para todos sem PROBE_SCORE_ORDER."""
+    if not PROBE_SCORE_ORDER:
+        return 0
+    return _NO_SCORE if ch.score is None else int(ch.score / PROBE_SCORE_STEP)
+
+
+def playlist_sort_key(ch):
+    """Ordem canonica: grupo, faixa de score, relevancia (BR Noticias), nome normalizado e URL."""
+    return (_GROUP_POSITION.get(ch.group, len(GROUP_ORDER)), score_bucket(ch), ch.rank,
+            _name_key(clean_channel_name(ch.name)), ch.url)
+
+
+def drop_slow_channels(channels, limit=None):
+    """Tira os canais com inicio estimado acima de `limit` segundos (PROBE_MAX_STARTUP; 0 nao tira nada)."""
+    limit = PROBE_MAX_STARTUP if limit is None else limit
+    if not limit:
+        return channels
+    return [ch for ch in channels if ch.score is None or ch.score <= limit]
+
+
+def order_channels(channels):
+    """Define o grupo final de cada canal e retorna os canais na ordem da playlist.
+
+    A ordem nao depende da ordem de chegada (fontes e testes terminam em
+    ordem diferente a cada execucao), entao o mesmo conjunto de canais gera
+    sempre o mesmo arquivo. O score so entra com PROBE_SCORE_ORDER, em faixas
+    de PROBE_SCORE_STEP.
+    """
+    # Pré-calcular grupo final e chave de ordenação de cada canal
+    for ch in channels:
+        ch.group = get_final_group(ch.original_group, ch.region, ch.name)
+        ch.rank = get_news_relevance(ch.name) if ch.group == 'BR Noticias' else NO_RANK
+
+    return sorted(channels, key=playlist_sort_key)
+
+
+def iter_entries(ordered):
+    """Texto de cada entrada, como pares (canal, texto); do segundo em diante com o '\n' que as separa."""
+    for i, ch in enumerate(ordered):
+        yield ch, f'{ch.extinf(ch.group)}\n{ch.url}' if i == 0 else f'\n{ch.extinf(ch.group)}\n{ch.url}'
+
+
+def iter_m3u(ordered, updated=None):
+    """Gera a playlist aos pedacos: o cabecalho e depois o texto de cada entrada.
+
+    Produz pares (canal, texto), com canal None no cabecalho. Os textos ja
+    trazem o '\n' que os separa, entao juntar todos da o arquivo inteiro.
+    """
+    yield None, '\n'.join(m3u_header(len(ordered), updated) + ['', ''])
+    yield from iter_entries(ordered)
+
+
+def _entry_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+class PreviousPlaylist:
+    """Playlist gravada na execucao anterior, resumida para comparar com a nova.
+
+    Guarda so um hash curto e o nome de cada entrada (por URL normalizada),
+    o hash de todas as entradas juntas e a data do cabecalho.
+    """
+
+    def __init__(self, updated, entries, digest):
+        self.updated = updated
+        self.entries = entries      # url normalizada -> (hash da entrada, nome)
+        self.digest = digest
+
+    @classmethod
+    def load(cls, path):
+        """Le `path` linha a linha; None se o arquivo nao existe ou nao parece uma playlist gerada."""
+        try:
+            f = open(path, encoding='utf-8', newline='\n')
+        except OSError:
+            return None
+        with f:
+            head = [f.readline() for _ in range(4)]
+            if not head[0].startswith('#EXTM3U') or not head[1].startswith('# Atualizado:'):
+                return None
+            entries = {}
+            digest = hashlib.blake2b()
+            extinf = None
+            for line in f:
+                digest.update(line.encode('utf-8'))
+                line = line.rstrip('\n')
+                if line.startswith('#EXTINF'):
+                    extinf = line
+                elif line and extinf is not None:
+                    entries[normalize_url(line)] = (_entry_hash(f'{extinf}\n{line}'), parse_extinf(extinf)[2])
+                    extinf = None
+        return cls(head[1].split(':', 1)[1].strip(), entries, digest.digest())
+
+
+# Mudancas de uma playlist para a seguinte (listas de canais; `removed` so com os nomes)
+PlaylistDiff = collections.namedtuple('PlaylistDiff', 'added removed changed identical')
+
+
+def diff_playlist(previous, ordered):
+    """Compara as entradas novas com as da playlist anterior (mesma URL normalizada = mesma entrada)."""
+    added, changed, seen = [], [], set()
+    digest = hashlib.blake2b()
+    for ch, text in iter_entries(ordered):
+        digest.update(text.encode('utf-8'))
+        key = normalize_url(ch.url)
+        seen.add(key)
+        old = previous.entries.get(key)
+        if old is None:
+            added.append(ch)
+        elif old[0] != _entry_hash(text.lstrip('\n')):
+            changed.append(ch)
+    removed = [(name, url) for url, (_, name) in previous.entries.items() if url not in seen]
+    return PlaylistDiff(added, removed, changed, digest.digest() == previous.digest)
+
+
+def write_diff_report(diff, path=PLAYLIST_DIFF_FILE):
+    """Grava as mudancas em JSON (nome, grupo e URL de cada entrada)."""
+    report = {
+        'added': [{'name': ch.name, 'group': ch.group, 'url': ch.url} for ch in diff.added],
+        'removed': [{'name': name, 'url': url} for name, url in diff.removed],
+        'changed': [{'name': ch.name, 'group': ch.group, 'url': ch.url} for ch in diff.changed],
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    _write_atomic(path, json.dumps(report, ensure_ascii=False, indent=1))
+
+
 def generate_m3u_content(channels):
     """Gera conteudo M3U."""
-    lines = ['#EXTM3U']
-    lines.append(f'# Atualizado: {datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")}')
-    lines.append(f'# Canais: {len(channels)}')
-    lines.append('')
-
-    # Pré-calcular grupo final de cada canal
-    enriched = []
+    return ''.join(text for _, text in iter_m3u(order_channels(channels)))
+
+
+class PlaylistWriter:
+    """Grava a playlist em streaming: arquivo temporario + rename atomico.
+
+    Cada pedaco vai ao mesmo tempo para o arquivo, para as copias
+    comprimidas (PLAYLIST_COMPRESS) e para o hash, entao a memoria nao
+    depende do tamanho da playlist. Nada substitui os arquivos antigos
+    antes de close(); um erro no meio apaga os temporarios e mantem a
+    playlist anterior inteira.
+    """
+
+    def __init__(self, path, compress=PLAYLIST_COMPRESS):
+        self.path = path
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.buffer = []
+        self.buffered = 0
+        self.files = {}         # caminho final -> arquivo temporario aberto
+        self.sinks = []         # funcoes que recebem cada bloco de bytes
+        self.finishers = []     # fecham os compressores antes dos arquivos
+        try:
+            self._open('', lambda f: f)
+            for fmt in compress:
+                self._open_compressed(fmt)
+        except BaseException:
+            self.discard()
+            raise
+
+    def _open(self, suffix, wrap):
+        tmp = f'{self.path}{suffix}.tmp'
+        f = self.files[self.path + suffix] = open(tmp, 'wb')
+        return wrap(f)
+
+    def _open_compressed(self, fmt):
+        if fmt == 'gz':
+            # Sem nome nem data no cabecalho: mesmo conteudo, mesmo .gz
+            gz = self._open('.gz', lambda f: gzip.GzipFile('', 'wb', PLAYLIST_GZIP_LEVEL, f, mtime=0))
+            self.sinks.append(gz.write)
+            self.finishers.append(gz.close)
+        elif fmt == 'zst' and zstandard is not None:
+            zst = self._open('.zst', lambda f: zstandard.ZstdCompressor(level=PLAYLIST_ZSTD_LEVEL).stream_writer(
+                f, closefd=False))
+            self.sinks.append(zst.write)
+            self.finishers.append(zst.close)
+        elif fmt == 'br' and brotli is not None:
+            f = self._open('.br', lambda f: f)
+            compressor = brotli.Compressor(quality=PLAYLIST_BROTLI_QUALITY)
+            self.sinks.append(lambda data: f.write(compressor.process(data)))
+            self.finishers.append(lambda: f.write(compressor.finish()))
+
+    def write(self, text):
+        """Acrescenta `text`; retorna a posicao (em bytes) em que ele comeca no arquivo."""
+        data = text.encode('utf-8')
+        start = self.size
+        self.size += len(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= PLAYLIST_WRITE_BUFFER:
+            self.flush()
+        return start
+
+    def flush(self):
+        if not self.buffer:
+            return
+        block = b''.join(self.buffer)
+        self.buffer, self.buffered = [], 0
+        self.sha256.update(block)
+        self.files[self.path].write(block)
+        for sink in self.sinks:
+            sink(block)
+
+    def close(self):
+        """Fecha tudo e troca os arquivos; a playlist em si e o ultimo rename."""
+        try:
+            self.flush()
+            for finish in self.finishers:
+                finish()
+            for f in self.files.values():
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+        except BaseException:
+            self.discard()
+            raise
+        with open(f'{self.path}.sha256.tmp', 'w', encoding='utf-8') as f:
+            f.write(f'{self.sha256.hexdigest()}  {os.path.basename(self.path)}\n')
+        for path in sorted(self.files, key=lambda p: p == self.path):
+            os.replace(f'{path}.tmp', path)
+        os.replace(f'{self.path}.sha256.tmp', f'{self.path}.sha256')
+        return self.sha256.hexdigest()
+
+    def discard(self):
+        for path, f in self.files.items():
+            f.close()
+            with contextlib.suppress(OSError):
+                os.remove(f'{path}.tmp')
+
+    @property
+    def outputs(self):
+        """Arquivos gravados (playlist e copias comprimidas)."""
+        return list(self.files)
+
+
+# Resultado de write_playlist: caminho, bytes, sha256, copias comprimidas, indice
+# e PlaylistDiff (None sem playlist anterior)
+PlaylistFile = collections.namedtuple('PlaylistFile', 'path size sha256 outputs index diff')
+
+
+def write_playlist(channels, path=None, compress=PLAYLIST_COMPRESS):
+    """Ordena, gera e grava a playlist (com copias comprimidas e hash) e monta o PlaylistIndex.
+
+    Se as entradas sao as mesmas da playlist anterior, a data do cabecalho
+    e mantida e o arquivo sai identico byte a byte.
+    """
+    path = path or OUTPUT_FILE
+    ordered = order_channels(channels)
+    previous = PreviousPlaylist.load(path)
+    diff = diff_playlist(previous, ordered) if previous else None
+    updated = previous.updated if diff and diff.identical else None
+
+    writer = PlaylistWriter(path, compress)
+    starts, ends = array('Q'), array('Q')
+    header = None
+    try:
+        for ch, text in iter_m3u(ordered, updated):
+            start = writer.write(text)
+            if ch is None:
+                header = text.split('\n')[1]
+            else:
+                starts.append(start + (1 if starts else 0))  # pula o '\n' que separa as entradas
+                ends.append(writer.size)
+    except BaseException:
+        writer.discard()
+        raise
+    digest = writer.close()
+    index = PlaylistIndex.from_channels(header, writer.size, starts, ends, ordered)
+    return PlaylistFile(path, writer.size, digest, writer.outputs, index, diff)
+
+
+def write_playlist_index(index):
+    """Grava o PlaylistIndex em PLAYLIST_INDEX_FILE (lido pelo modo query)."""
+    os.makedirs(os.path.dirname(PLAYLIST_INDEX_FILE) or '.', exist_ok=True)
+    with open(f'{PLAYLIST_INDEX_FILE}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index.to_json(), f, ensure_ascii=False)
+    os.replace(f'{PLAYLIST_INDEX_FILE}.tmp', PLAYLIST_INDEX_FILE)
+
+
+class PlaylistIndex:
+    """Faixas de bytes de cada entrada de uma playlist gerada, por grupo, regiao, fonte e nome.
+
+    Um recorte (p.ex. group=BR e region=BR) e so uma lista de faixas do
+    corpo ja gerado: entradas vizinhas viram uma faixa so e nada e
+    serializado de novo. As mesmas faixas valem para o arquivo em disco.
+    """
+
+    FIELDS = ('group', 'region', 'source')
+
+    def __init__(self, header, size, starts, ends, columns, names):
+        self.header = header                  # linha "# Atualizado: ..." da playlist
+        self.size = size                      # tamanho da playlist em bytes
+        self.starts = starts
+        self.ends = ends
+        self.columns = columns                # campo -> [valor de cada entrada]
+        self.postings = {field: collections.defaultdict(lambda: array('I')) for field in self.FIELDS}
+        for field, values in columns.items():
+            for i, value in enumerate(values):
+                self.postings[field][value].append(i)
+        self.names = names
+        self.by_name = array('I', sorted(range(len(names)), key=lambda i: _name_key(names[i])))
+        self._cache = collections.OrderedDict()
+
+    @classmethod
+    def from_channels(cls, header, size, starts, ends, ordered):
+        """Indice a partir das posicoes registradas por write_playlist."""
+        columns = {
+            'group': [ch.group for ch in ordered],
+            'region': [ch.region for ch in ordered],
+            'source': [ch.source for ch in ordered],
+        }
+        return cls(header, size, starts, ends, columns, [ch.name for ch in ordered])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def select(self, group=None, region=None, source=None, prefix=None):
+        """Indices (em ordem) das entradas que atendem a todos os filtros dados."""
+        candidates = [self.postings[field].get(value, ()) for field, value in
+                      zip(self.FIELDS, (group, region, source)) if value is not None]
+        if prefix is not None:
+            key = functools.partial(_name_at, self.names)
+            lo = bisect.bisect_left(self.by_name, _name_key(prefix), key=key)
+            hi = bisect.bisect_left(self.by_name, _name_key(prefix) + '\uffff', key=key)
+            candidates.append(sorted(self.by_name[lo:hi]))
+        if not candidates:
+            ids = range(len(self))
+        else:
+            candidates.sort(key=len)
+            others = [set(c) for c in candidates[1:]]
+            ids = [i for i in candidates[0] if all(i in other for other in others)]
+        return ids
+
+    def query(self, group=None, region=None, source=None, prefix=None):
+        """(quantidade, faixas) do recorte, guardados para as proximas consultas iguais."""
+        key = (group, region, source, prefix)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+        ids = self.select(group, region, source, prefix)
+        cached = self._cache[key] = (len(ids), self.ranges(ids))
+        if len(self._cache) > 256:
+            self._cache.popitem(last=False)
+        return cached
+
+    def ranges(self, ids):
+        """Faixas [inicio, fim) da playlist, juntando entradas consecutivas (com o '\\n' de cada uma)."""
+        ranges = []
+        for i in ids:
+            end = min(self.ends[i] + 1, self.size)  # a ultima entrada do arquivo nao tem '\n'
+            if ranges and ranges[-1][1] == self.starts[i]:
+                ranges[-1][1] = end
+            else:
+                ranges.append([self.starts[i], end])
+        return ranges
+
+    def head(self, count):
+        return ('\n'.join(['#EXTM3U', self.header, f'# Canais: {count}', '']) + '\n').encode('utf-8')
+
+    def to_json(self):
+        return {'header': self.header, 'size': self.size, 'starts': list(self.starts), 'ends': list(self.ends),
+                'columns': self.columns, 'names': self.names}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['header'], data['size'], array('Q', data['starts']), array('Q', data['ends']),
+                   data['columns'], data['names'])
+
+
+def _name_key(name):
+    return name.casefold()
+
+
+def _name_at(names, i):
+    return _name_key(names[i])
+
+
+@functools.lru_cache(maxsize=65536)
+def _epg_key(tvg_id):
+    """Chave de comparacao de ids do guia: sem o sufixo @feed e sem diferenciar maiusculas."""
+    return tvg_id.split('@')[0].strip().casefold()
+
+
+def epg_channel_ids(channels):
+    """Chave do tvg-id -> tvg-ids da playlist com essa chave (o guia usa a grafia da playlist)."""
+    ids = collections.defaultdict(set)
     for ch in channels:
-        original_group = ch.get('original_group', '')
-        region = ch.get('region', '')
-        channel_name = ch.get('name', '')
-        final_group = get_final_group(original_group, region, channel_name)
-        enriched.append((ch, final_group))
+        tvg_id = ch.attr('tvg-id').strip()
+        if tvg_id:
+            ids[_epg_key(tvg_id)].add(tvg_id)
+    return {key: sorted(values) for key, values in ids.items()}
+
+
+def xmltv_time(value):
+    """Horario XMLTV ("20240101123000 +0000") em segundos desde 1970; None se invalido."""
+    digits = value[:14]
+    if len(digits) < 12 or not digits.isdigit():
+        return None
+    seconds = calendar.timegm((int(digits[:4]), int(digits[4:6]), int(digits[6:8]),
+                               int(digits[8:10]), int(digits[10:12]), int(digits[12:14] or 0)))
+    zone = value[14:].strip()
+    if len(zone) == 5 and zone[0] in '+-' and zone[1:].isdigit():
+        offset = int(zone[1:3]) * 3600 + int(zone[3:]) * 60
+        seconds += -offset if zone[0] == '+' else offset
+    return seconds
+
+
+def open_xmltv(response):
+    """Corpo de uma resposta em stream como arquivo binario (guias .gz sao descomprimidos)."""
+    response.raw.decode_content = True
+    response.raw.auto_close = False  # o gzip le de novo depois do fim do corpo
+    stream = io.BufferedReader(response.raw, PLAYLIST_WRITE_BUFFER)
+    return gzip.GzipFile(fileobj=stream) if stream.peek(2)[:2] == b'\x1f\x8b' else stream
+
+
+def merge_epg(channels, sources=None, path=None, now=None):
+    """Junta os guias XMLTV so com os canais da playlist e grava `path` (gzip); retorna as contagens.
+
+    Os guias sao lidos em stream com iterparse e cada <channel>/<programme>
+    sai da arvore assim que e processado: a memoria nao cresce com o tamanho
+    da entrada. Um canal fica com o primeiro guia (na ordem do registro) que
+    o traz. Os <channel> aceitos ficam em memoria (so os da playlist) e os
+    programas num arquivo temporario, para que no guia final todos os canais
+    venham antes dos programas. Cada guia e lido num temporario proprio e so
+    entra no resultado se foi lido ate o fim: um guia que falha no meio e
+    descartado inteiro e seus canais ficam livres para os guias seguintes.
+    Sem nenhum guia lido, o arquivo anterior e mantido.
+    """
+    sources = EPG_SOURCES if sources is None else sources
+    path = path or EPG_FILE
+    now = now or time.time()
+    window_start, window_end = now - EPG_PAST, now + EPG_FUTURE
+    wanted = epg_channel_ids(channels)
+    if not wanted:
+        return {}
+    owners = {}          # chave do tvg-id -> (guia, id no guia sem diferenciar maiusculas)
+    declared = set()
+    channel_xml = []
+    counts = collections.Counter()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory) as programmes:
+        for key, source in sources.items():
+            kept = dropped = 0
+            start = time.perf_counter()
+            claimed = {}          # chave do tvg-id -> id no guia, so deste guia
+            source_xml = []
+            spool = tempfile.TemporaryFile('w+', encoding='utf-8', dir=directory)
+            try:
+                with spool, get_http_client().get(source['url'], stream=True, timeout=EPG_TIMEOUT) as response:
+                    response.raise_for_status()
+                    context = ET.iterparse(open_xmltv(response), events=('start', 'end'))
+                    _, root = next(context)
+                    for event, elem in context:
+                        if event != 'end' or elem.tag not in ('channel', 'programme'):
+                            continue
+                        if elem.tag == 'channel':
+                            guide_id = elem.get('id', '').strip().casefold()
+                            k = _epg_key(guide_id)
+                            if k in wanted and k not in owners and claimed.setdefault(k, guide_id) == guide_id \
+                                    and k not in declared:
+                                declared.add(k)
+                                elem.tail = '\n'
+                                for tvg_id in wanted[k]:
+                                    elem.set('id', tvg_id)
+                                    source_xml.append(ET.tostring(elem, encoding='unicode'))
+                        else:
+                            guide_id = elem.get('channel', '').strip().casefold()
+                            k = _epg_key(guide_id)
+                            if k in wanted and k not in owners and claimed.setdefault(k, guide_id) == guide_id:
+                                begin = xmltv_time(elem.get('start', ''))
+                                end = xmltv_time(elem.get('stop', '')) or begin
+                                if begin is None or end < window_start or begin > window_end:
+                                    dropped += 1
+                                else:
+                                    kept += 1
+                                    elem.tail = '\n'
+                                    for tvg_id in wanted[k]:
+                                        elem.set('channel', tvg_id)
+                                        spool.write(ET.tostring(elem, encoding='unicode'))
+                        root.clear()
+                    received = response.raw.tell()
+                    spool.seek(0)
+                    for chunk in iter(lambda: spool.read(PLAYLIST_WRITE_BUFFER), ''):
+                        programmes.write(chunk)
+            except (requests.RequestException, ET.ParseError, OSError, EOFError, StopIteration) as e:
+                declared.difference_update(claimed)
+                print(f"  Guia {source.get('name', key)}: ERRO {e}")
+                counts['epg_errors'] += 1
+                continue
+            owners.update((k, (key, guide_id)) for k, guide_id in claimed.items())
+            channel_xml += source_xml
+            counts['epg_sources'] += 1
+            counts['epg_bytes_in'] += received
+            counts['epg_programmes'] += kept
+            counts['epg_outside'] += dropped
+            print(f"  Guia {source.get('name', key)}: {kept} programas ({dropped} fora da janela), "
+                  f"{received / 1e6:.1f} MB em {time.perf_counter() - start:.1f}s")
+
+        counts['epg_channels'] = len(declared)
+        if not counts['epg_sources']:
+            return dict(counts)
+
+        tmp = f'{path}.tmp'
+        try:
+            with io.TextIOWrapper(gzip.GzipFile(tmp, 'wb', EPG_GZIP_LEVEL, mtime=0), encoding='utf-8') as out:
+                out.write('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n'
+                          '<tv generator-info-name="iptv-playlist">\n')
+                out.writelines(channel_xml)
+                programmes.seek(0)
+                for chunk in iter(lambda: programmes.read(PLAYLIST_WRITE_BUFFER), ''):
+                    out.write(chunk)
+                out.write('</tv>\n')
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+    counts['epg_size'] = os.path.getsize(path)
+    return dict(counts)
+
+
+def report_epg(counts):
+    if not counts.get('epg_sources'):
+        print("\nGuia de programacao: nenhum guia lido (arquivo anterior mantido)")
+        return
+    ratio = counts['epg_size'] * 100 / counts['epg_bytes_in'] if counts['epg_bytes_in'] else 0
+    print(f"\nGuia de programacao salvo: {EPG_FILE} ({counts['epg_size'] / 1e6:.2f} MB, {ratio:.1f}% da entrada)")
+    print(f"  {counts['epg_channels']} canais, {counts['epg_programmes']} programas "
+          f"({counts['epg_outside']} fora da janela) de {counts['epg_sources']} guias")
+
+
+# ============================================================
+# METRICAS
+# ============================================================
 
-    # Ordenar BR Notícias por relevância
-    enriched.sort(key=lambda x: get_news_relevance(x[0].get('name', '')) if x[1] == 'BR Noticias' else 999)
+def _percentiles(values, points=(50, 95, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    return {f'p{p}': round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)], 4) for p in points}
 
-    for ch, final_group in enriched:
-        updated_extinf = update_extinf_group(ch['extinf'], final_group)
-        lines.append(updated_extinf)
-        lines.append(ch['url'])
 
-    return '\n'.join(lines)
+def _histogram_percentiles(histogram, points=(50, 95, 99)):
+    return {f'p{p}': round(histogram.percentile(p), 4) for p in points} if histogram.count else {}
+
+
+class RunMetrics:
+    """Metricas de uma execucao: tempo por estagio, por fonte e por host.
+
+    Coleta, parse e teste rodam em pipeline, entao os estagios se
+    sobrepoem: 'collect', 'probe' e 'write' (gerar e gravar) sao tempo de relogio;
+    'download', 'parse' e 'dedup' sao somados entre as threads das fontes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.stages = collections.defaultdict(float)
+        self.sources = {}
+        self.counts = {}
+
+    def source(self, key, name):
+        """Dicionario de metricas da fonte (preenchido por fetch_source)."""
+        with self.lock:
+            return self.sources.setdefault(key, {
+                'name': name, 'status': 'pending', 'bytes': 0, 'channels': 0, 'unique': 0,
+                'seconds': 0.0, 'download_s': 0.0, 'parse_s': 0.0, 'queue_s': 0.0,
+            })
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] += seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def snapshot(self, results=()):
+        """Metricas em dicionario serializavel; `results` sao os canais testados nesta execucao."""
+        sources = {}
+        for key, stats in self.sources.items():
+            stats = dict(stats)
+            stats['duplicate_ratio'] = round(1 - stats['unique'] / stats['channels'], 4) if stats['channels'] else 0.0
+            sources[key] = {k: round(v, 4) if isinstance(v, float) else v for k, v in stats.items()}
+
+        by_host = collections.defaultdict(list)
+        for ch in results:
+            by_host[urlsplit(ch.url).hostname or ''].append(ch)
+        connections = get_http_client().host_connection_stats()
+        hosts = {}
+        for host, channels in by_host.items():
+            requests_done, opened = connections.get(host, (0, 0))
+            entry = {
+                'probes': len(channels),
+                'statuses': dict(collections.Counter(ch.status for ch in channels)),
+                'probe_s': _percentiles([ch.latency for ch in channels if ch.latency is not None]),
+                'requests': requests_done,
+                'connections': opened,
+                'reuse': round(1 - opened / requests_done, 4) if requests_done else 0.0,
+            }
+            latency = HOST_LATENCY.hosts.get(host)
+            if latency:
+                entry['connect_s'] = _histogram_percentiles(latency[0])
+                entry['ttfb_s'] = _histogram_percentiles(latency[1])
+            hosts[host] = entry
+
+        return {
+            'started_at': datetime.utcfromtimestamp(self.started).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'duration_s': round(time.time() - self.started, 3),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'counts': dict(self.counts),
+            'sources': sources,
+            'probe': {
+                'tiers': {str(tier): {'requests': n, 'bytes': received, 'seconds': round(seconds, 3)}
+                          for tier, (n, received, seconds) in PROBE_STATS.tiers.items()},
+                'adaptive': dict(HOST_LATENCY.counts),
+                'startup_s': _percentiles([ch.score for ch in results if ch.score is not None]),
+            },
+            'hosts': hosts,
+        }
+
+    def write(self, path, results=(), prom_path=None):
+        """Grava o JSON da execucao, acrescenta ao historico e (opcional) o textfile do Prometheus."""
+        snapshot = self.snapshot(results)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        _write_atomic(path, json.dumps(snapshot, indent=1, ensure_ascii=False))
+
+        history_path = os.path.splitext(path)[0] + '-history.jsonl'
+        try:
+            with open(history_path, encoding='utf-8') as f:
+                history = f.readlines()[-(METRICS_HISTORY_MAX - 1):]
+        except OSError:
+            history = []
+        # Historico sem os hosts (o JSON completo so da ultima execucao)
+        summary = {key: value for key, value in snapshot.items() if key != 'hosts'}
+        history.append(json.dumps(summary, ensure_ascii=False) + '\n')
+        _write_atomic(history_path, ''.join(history))
+
+        if prom_path:
+            _write_atomic(prom_path, prometheus_text(snapshot))
+        print(f"\nMetricas salvas: {path}" + (f" e {prom_path}" if prom_path else ''))
+
+
+def _write_atomic(path, text):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _prom_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshot):
+    """Snapshot de RunMetrics no formato textfile do node_exporter."""
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f'# HELP iptv_{name} {help_text}')
+        lines.append(f'# TYPE iptv_{name} gauge')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{_prom_label(val)}"' for key, val in labels.items())
+            lines.append(f'iptv_{name}{{{label_text}}} {value}' if label_text else f'iptv_{name} {value}')
+
+    metric('run_timestamp_seconds', 'Inicio da execucao', [({}, int(RUN_METRICS.started))])
+    metric('run_duration_seconds', 'Duracao da execucao', [({}, snapshot['duration_s'])])
+    metric('stage_seconds', 'Tempo por estagio', [({'stage': k}, v) for k, v in snapshot['stages'].items()])
+    metric('channels', 'Canais por etapa', [({'kind': k}, v) for k, v in snapshot['counts'].items()])
+
+    sources = snapshot['sources']
+    for field, help_text in [('bytes', 'Bytes recebidos'), ('channels', 'Canais parseados'),
+                             ('unique', 'Canais ineditos'), ('duplicate_ratio', 'Fracao de duplicados'),
+                             ('download_s', 'Tempo de rede'), ('parse_s', 'Tempo de parse')]:
+        name = 'source_' + (field[:-2] + '_seconds' if field.endswith('_s') else field)
+        metric(name, help_text, [({'source': key}, stats[field]) for key, stats in sources.items()])
+
+    hosts = sorted(snapshot['hosts'].items(), key=lambda item: -item[1]['probes'])[:METRICS_PROM_HOSTS]
+    metric('host_probes', 'Testes por host e status',
+           [({'host': host, 'status': status}, n) for host, entry in hosts for status, n in entry['statuses'].items()])
+    metric('host_probe_seconds', 'Percentis do tempo de teste por host',
+           [({'host': host, 'quantile': f'0.{p[1:]}'}, v) for host, entry in hosts
+            for p, v in entry['probe_s'].items()])
+    metric('host_ttfb_seconds', 'Percentis do tempo ate o primeiro byte por host',
+           [({'host': host, 'quantile': f'0.{p[1:]}'}, v) for host, entry in hosts
+            for p, v in entry.get('ttfb_s', {}).items()])
+    metric('host_connection_reuse_ratio', 'Fracao de requisicoes em conexoes reaproveitadas',
+           [({'host': host}, entry['reuse']) for host, entry in hosts])
+    return '\n'.join(lines) + '\n'
+
+
+RUN_METRICS = RunMetrics()
+
+
+# ============================================================
+# SERVIDOR
+# ============================================================
+
+EXTRA_SOURCE = 'extra'
+
+# Playlist pronta para servir: corpo, corpo em gzip, ETag, data da mudanca e
+# PlaylistIndex para os recortes
+RenderedPlaylist = collections.namedtuple('RenderedPlaylist', 'body gzip etag modified index')
+
+# Parametros de consulta aceitos -> argumento de PlaylistIndex.select
+QUERY_FILTERS = {'group': 'group', 'region': 'region', 'source': 'source', 'name': 'prefix'}
+
+
+def render_playlist(channels, path=None):
+    """Grava a playlist (write_playlist) e o indice e carrega o arquivo e o .gz para servir."""
+    written = write_playlist(channels, path)
+    write_playlist_index(written.index)
+    with open(written.path, 'rb') as f:
+        body = f.read()
+    gz_path = f'{written.path}.gz'
+    if gz_path in written.outputs:
+        with open(gz_path, 'rb') as f:
+            compressed = f.read()
+    else:
+        compressed = gzip.compress(body, 6)
+    return RenderedPlaylist(body, compressed, written.sha256[:32], time.time(), written.index)
+
+
+class _ChannelSink:
+    """Recebe os canais de uma fonte no lugar do ChannelStream (fetch_source so usa put)."""
+
+    def __init__(self):
+        self.channels = {}
+
+    def put(self, channel):
+        url = normalize_url(channel.url)
+        new = url not in self.channels
+        if new:
+            self.channels[url] = channel
+        return new
+
+
+class PlaylistService:
+    """Modo servidor: canais em memoria, retestes continuos e fontes no proprio ritmo.
+
+    Uma thread coleta as fontes quando vencem (SOURCES[...]['refresh'] ou
+    `source_interval`), outra retesta os canais em lotes a `rate` testes
+    por segundo (os nunca testados primeiro) e a playlist so e regerada
+    quando o conjunto de canais OK muda.
+    """
+
+    def __init__(self, store, source_cache=None, rate=SERVE_PROBE_RATE, batch=SERVE_BATCH,
+                 source_interval=SERVE_SOURCE_INTERVAL, engine=PROBE_ENGINE, timeout=PROBE_TIMEOUT,
+                 logos=None, logo_action=LOGO_ACTION):
+        self.store = store
+        self.logos = logos
+        self.logo_action = logo_action
+        self.source_cache = source_cache
+        self.rate = rate
+        self.batch = batch
+        self.source_interval = source_interval
+        self.engine = engine
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.channels = {}                  # url normalizada -> Channel
+        self.by_source = {}                 # fonte -> urls normalizadas
+        self.pending = collections.deque()  # ordem dos retestes
+        self.next_fetch = {}
+        self.rendered = None
+        self.probed = 0
+        self.changed = threading.Event()
+        self.stopping = threading.Event()
+
+    def source_keys(self):
+        keys = [key for key, src in SOURCES.items() if src.get('region', '') in TARGET_REGIONS]
+        return keys + [EXTRA_SOURCE] if EXTRA_CHANNELS else keys
+
+    def interval_for(self, key):
+        return SOURCES.get(key, {}).get('refresh', self.source_interval)
+
+    def refresh_source(self, key):
+        sink = _ChannelSink()
+        if key == EXTRA_SOURCE:
+            for ch in extra_channels():
+                sink.put(ch)
+        else:
+            with RUN_METRICS.lock:
+                RUN_METRICS.sources.pop(key, None)
+            fetch_source(key, SOURCES[key], sink, self.source_cache, refresh=self.interval_for(key))
+            if RUN_METRICS.sources[key]['status'] == 'error':
+                return  # fonte fora do ar e sem copia: mantem os canais que ja temos
+        self.merge(key, sink.channels)
+
+    def merge(self, key, channels):
+        """Troca os canais da fonte `key`; canais novos entram no inicio da fila de testes."""
+        added = removed = 0
+        with self.lock:
+            old = self.by_source.get(key, set())
+            new = set(channels)
+            self.by_source[key] = new
+            order = source_order()
+            for url in new - old:
+                current = self.channels.get(url)
+                if current is not None:
+                    # URL ja vinda de outra fonte: fica a copia preferida, com o resultado do teste
+                    ch = channels[url]
+                    if channel_preference(ch, order) < channel_preference(current, order):
+                        ch.copy_result(current)
+                        self.channels[url] = ch
+                    continue
+                ch = self.channels[url] = channels[url]
+                if self.store.lookup(ch):
+                    self.pending.append(url)
+                else:
+                    self.pending.appendleft(url)
+                added += 1
+            for url in old - new:
+                if not any(url in urls for urls in self.by_source.values()):
+                    self.channels.pop(url, None)
+                    removed += 1
+        if added or removed:
+            print(f"  Fonte {key}: +{added} / -{removed} canais ({len(self.channels)} no total)")
+            self.changed.set()
+
+    def source_loop(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            while not self.stopping.is_set():
+                now = time.time()
+                due = [key for key in self.source_keys() if self.next_fetch.get(key, 0) <= now]
+                futures = {executor.submit(self.refresh_source, key): key for key in due}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    if future.exception():
+                        print(f"    ERRO na fonte {key}: {future.exception()}")
+                    # Fonte ainda em dia (copia local): vence a partir do ultimo download
+                    fetched_at = RUN_METRICS.sources.get(key, {}).get('fetched_at') or time.time()
+                    self.next_fetch[key] = fetched_at + self.interval_for(key)
+                wait = min(self.next_fetch.values(), default=now + 60) - time.time()
+                self.stopping.wait(max(1.0, wait))
+
+    def probe_loop(self):
+        while not self.stopping.is_set():
+            start = time.monotonic()
+            batch = []
+            with self.lock:
+                while self.pending and len(batch) < self.batch:
+                    ch = self.channels.get(self.pending.popleft())
+                    if ch is not None:
+                        batch.append(ch)
+            if batch:
+                before = [ch.status == 'OK' for ch in batch]
+                results, _ = probe_channels(batch, engine=self.engine, timeout=self.timeout, verbose=False)
+                with self.lock:
+                    self.store.record(results)
+                    self.pending.extend(normalize_url(ch.url) for ch in batch
+                                        if normalize_url(ch.url) in self.channels)
+                    self.probed += len(batch)
+                if any(was != (ch.status == 'OK') for was, ch in zip(before, batch)):
+                    self.changed.set()
+            # Taxa fixa: cada lote "custa" len(batch) / rate segundos
+            self.stopping.wait(max(1, len(batch)) / self.rate - (time.monotonic() - start))
+
+    def render_loop(self):
+        while not self.stopping.is_set():
+            if not self.changed.wait(1):
+                continue
+            self.stopping.wait(SERVE_RENDER_DELAY)  # junta mudancas proximas
+            self.changed.clear()
+            with self.lock:
+                working = [ch for ch in self.channels.values() if ch.status == 'OK']
+                extras = self.by_source.get(EXTRA_SOURCE, set())
+            if NEAR_DUP_ENABLED:
+                working = collapse_near_duplicates(working, keep=extras)
+            working = drop_slow_channels(working)
+            if self.logos:
+                working, _ = validate_logos(working, self.logos, self.logo_action)
+            self.rendered = render_playlist(working)
+            print(f"  Playlist regerada: {len(working)} canais OK de {len(self.channels)}")
+
+    def start(self):
+        for target in (self.source_loop, self.probe_loop, self.render_loop):
+            threading.Thread(target=target, name=target.__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def status(self):
+        with self.lock:
+            working = sum(1 for ch in self.channels.values() if ch.status == 'OK')
+            return {
+                'channels': len(self.channels),
+                'working': working,
+                'untested': sum(1 for ch in self.channels.values() if ch.status is None),
+                'probed': self.probed,
+                'sources': {key: len(urls) for key, urls in self.by_source.items()},
+                'rendered_at': self.rendered.modified if self.rendered else None,
+            }
+
+
+class PlaylistHandler(http.server.BaseHTTPRequestHandler):
+    """GET/HEAD da playlist atual com ETag, Last-Modified e gzip."""
+
+    server_version = 'iptv-playlist'
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        path = urlsplit(self.path).path
+        service = self.server.service
+        if path == '/status':
+            self.send_bytes(200, json.dumps(service.status()).encode(), 'application/json', send_body)
+        elif path in ('/', '/playlist.m3u'):
+            rendered = service.rendered
+            filters = {QUERY_FILTERS[key]: values[-1] for key, values in
+                       parse_qs(urlsplit(self.path).query).items() if key in QUERY_FILTERS}
+            if rendered is None:
+                self.send_bytes(503, b'playlist ainda nao gerada\n', 'text/plain', send_body,
+                                [('Retry-After', '30')])
+            elif filters:
+                self.send_filtered(rendered, filters, send_body)
+            else:
+                self.send_playlist(rendered, send_body)
+        else:
+            self.send_bytes(404, b'nao encontrado\n', 'text/plain', send_body)
+
+    def send_playlist(self, rendered, send_body):
+        use_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = f'"{rendered.etag}-gz"' if use_gzip else f'"{rendered.etag}"'
+        modified = email.utils.formatdate(rendered.modified, usegmt=True)
+        headers = [('ETag', etag), ('Last-Modified', modified), ('Cache-Control', 'no-cache'),
+                   ('Vary', 'Accept-Encoding')]
+
+        if self.not_modified(rendered, etag):
+            self.send_not_modified(headers)
+            return
+        if use_gzip:
+            headers.append(('Content-Encoding', 'gzip'))
+        body = rendered.gzip if use_gzip else rendered.body
+        self.send_bytes(200, body, 'audio/x-mpegurl; charset=utf-8', send_body, headers)
+
+    def send_filtered(self, rendered, filters, send_body):
+        """Recorte da playlist: cabecalho novo + faixas do corpo ja gerado (sem gzip)."""
+        query = '&'.join(f'{key}={filters[key]}' for key in sorted(filters))
+        etag = f'"{rendered.etag}-{hashlib.blake2b(query.encode(), digest_size=6).hexdigest()}"'
+        headers = [('ETag', etag), ('Last-Modified', email.utils.formatdate(rendered.modified, usegmt=True)),
+                   ('Cache-Control', 'no-cache')]
+        if self.not_modified(rendered, etag):
+            self.send_not_modified(headers)
+            return
+
+        index = rendered.index
+        count, ranges = index.query(**filters)
+        view = memoryview(rendered.body)
+        chunks = [index.head(count)] + [view[start:end] for start, end in ranges]
+        self.send_response(200)
+        self.send_header('Content-Type', 'audio/x-mpegurl; charset=utf-8')
+        self.send_header('Content-Length', str(sum(len(chunk) for chunk in chunks)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        if send_body:
+            for chunk in chunks:
+                self.wfile.write(chunk)
+
+    def send_not_modified(self, headers):
+        self.send_response(304)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+
+    def not_modified(self, rendered, etag):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            return if_none_match.strip() == '*' or etag in if_none_match
+        since = self.headers.get('If-Modified-Since')
+        if since:
+            try:
+                return int(rendered.modified) <= email.utils.parsedate_to_datetime(since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def send_bytes(self, status, body, content_type, send_body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers:
+            self.send_header(key, value)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # um log por requisicao poluiria a saida do servico
+
+
+def _copy_range(src, dst, offset, count):
+    """Copia `count` bytes de `src` (a partir de `offset`) para `dst`, com sendfile quando existe."""
+    if hasattr(os, 'sendfile'):
+        try:
+            while count > 0:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+                if not sent:
+                    return
+                offset += sent
+                count -= sent
+            return
+        except OSError:
+            pass  # destino sem suporte (p.ex. alguns terminais): copia normal
+    src.seek(offset)
+    dst.write(src.read(count))
+
+
+def query_playlist(args):
+    """Escreve o recorte da playlist pedido em --group/--region/--source/--name."""
+    try:
+        with open(PLAYLIST_INDEX_FILE, encoding='utf-8') as f:
+            index = PlaylistIndex.from_json(json.load(f))
+    except (OSError, ValueError, KeyError):
+        print(f"Indice {PLAYLIST_INDEX_FILE} ausente ou invalido: gere a playlist antes", file=sys.stderr)
+        return 1
+    if not os.path.exists(OUTPUT_FILE) or os.path.getsize(OUTPUT_FILE) != index.size:
+        print(f"{OUTPUT_FILE} nao corresponde ao indice: gere a playlist de novo", file=sys.stderr)
+        return 1
+
+    count, ranges = index.query(group=args.group, region=args.region, source=args.source, prefix=args.name)
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        out.write(index.head(count))
+        out.flush()
+        with open(OUTPUT_FILE, 'rb') as src:
+            for start, end in ranges:
+                _copy_range(src, out, start, end - start)
+    finally:
+        if args.output:
+            out.close()
+    print(f"{count} canais", file=sys.stderr)
+    return 0
+
+
+def serve(args):
+    """Roda o modo servidor ate Ctrl+C."""
+    store = ProbeStore(args.probe_store)
+    service = PlaylistService(
+        store, SourceCache(conditional=not args.refresh_sources, schedule=not (args.refresh_sources or args.fetch_all)),
+        rate=args.probe_rate,
+        batch=args.batch_size, source_interval=args.source_interval, engine=args.probe_engine,
+        timeout=args.probe_timeout, logos=LogoStore() if args.check_logos else None,
+        logo_action=args.broken_logos).start()
+    server = http.server.ThreadingHTTPServer((args.host, args.port), PlaylistHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"Servindo http://{args.host}:{server.server_address[1]}/playlist.m3u "
+          f"({args.probe_rate} testes/s, lotes de {args.batch_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        with service.lock:
+            store.close()
+        if service.logos:
+            service.logos.close()
 
 
 # ============================================================
 # MAIN
 # ============================================================
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Gerador de playlist IPTV')
+    parser.add_argument('command', nargs='?', choices=['run', 'serve', 'query'], default='run',
+                        help='run: gera a playlist uma vez; serve: servico continuo com endpoint HTTP; '
+                             'query: recorte da ultima playlist gerada')
+    parser.add_argument('--probe-engine', choices=['async', 'threads'], default=PROBE_ENGINE,
+                        help='motor de teste dos canais (padrao: %(default)s)')
+    parser.add_argument('--probe-mode', choices=['tiered', 'simple'], default='tiered' if PROBE_TIERED else 'simple',
+                        help='tiered: segue master playlists ate um segmento; simple: so o inicio do stream')
+    parser.add_argument('--probe-timeout', type=float, default=PROBE_TIMEOUT,
+                        help='timeout de hosts ainda sem latencia conhecida, em segundos (padrao: %(default)s)')
+    parser.add_argument('--probe-timeout-max', type=float, default=PROBE_TIMEOUT_MAX,
+                        help='teto do timeout adaptativo e prazo da segunda tentativa em hosts lentos (s)')
+    parser.add_argument('--concurrency', type=int, default=PROBE_CONCURRENCY,
+                        help='testes simultaneos no motor async (padrao: %(default)s)')
+    parser.add_argument('--per-host', type=int, default=PROBE_PER_HOST,
+                        help='testes simultaneos por host no motor async (padrao: %(default)s)')
+    parser.add_argument('--pool-size', type=int, default=HTTP_POOL_SIZE,
+                        help='conexoes keep-alive mantidas por host (padrao: %(default)s)')
+    parser.add_argument('--probe-store', default=PROBE_STORE_FILE,
+                        help='arquivo SQLite com resultados de testes anteriores (padrao: %(default)s)')
+    parser.add_argument('--reprobe-all', action='store_true',
+                        help='ignora resultados em cache e testa todos os canais')
+    parser.add_argument('--parse-processes', type=int, default=PARSE_PROCESSES,
+                        help='processos para o parse das fontes; 0 parseia nas threads de download '
+                             '(padrao: %(default)s)')
+    parser.add_argument('--metrics', default=METRICS_FILE,
+                        help='JSON com as metricas da execucao (padrao: %(default)s)')
+    parser.add_argument('--metrics-prom', metavar='ARQUIVO',
+                        help='tambem grava as metricas no formato textfile do Prometheus')
+    parser.add_argument('--refresh-sources', action='store_true',
+                        help='baixa todas as fontes por completo (sem GET condicional nem agenda)')
+    parser.add_argument('--fetch-all', action='store_true',
+                        help='baixa todas as fontes, mesmo as que ainda estao dentro do refresh')
+    parser.add_argument('--sources', metavar='ARQUIVO',
+                        help=f'registro de fontes (padrao: {os.path.basename(SOURCES_FILE)} ao lado do script)')
+    parser.add_argument('--no-near-dedup', action='store_true',
+                        help='nao agrupa quase duplicados (mesmo canal com URLs diferentes)')
+    parser.add_argument('--no-epg', action='store_true',
+                        help='nao gera o guia de programacao (guias "epg" do registro)')
+    parser.add_argument('--epg-url', default=EPG_URL,
+                        help=f'URL publica de {EPG_FILE}, anunciada como url-tvg no cabecalho da playlist')
+    parser.add_argument('--max-latency', type=float, default=PROBE_MAX_STARTUP, metavar='SEGUNDOS',
+                        help='tira da playlist canais com inicio estimado acima do limite (0: nao tira)')
+    parser.add_argument('--score-order', action='store_true', default=PROBE_SCORE_ORDER,
+                        help='ordena cada grupo pelo inicio estimado em faixas de PROBE_SCORE_STEP '
+                             '(a ordem muda quando o score de um canal cruza uma faixa)')
+    parser.add_argument('--check-logos', action='store_true',
+                        help='testa os logos (cada URL uma vez por TTL) e trata os quebrados')
+    parser.add_argument('--broken-logos', choices=['rewrite', 'drop'], default=LOGO_ACTION,
+                        help='rewrite: usa o logo de outro canal com mesmo tvg-id ou nome; '
+                             'drop: remove o tvg-logo (padrao: %(default)s)')
+    serve_args = parser.add_argument_group('modo serve')
+    serve_args.add_argument('--host', default=SERVE_HOST)
+    serve_args.add_argument('--port', type=int, default=SERVE_PORT)
+    serve_args.add_argument('--probe-rate', type=float, default=SERVE_PROBE_RATE,
+                            help='testes por segundo (padrao: %(default)s)')
+    serve_args.add_argument('--batch-size', type=int, default=SERVE_BATCH,
+                            help='canais por lote de retestes (padrao: %(default)s)')
+    serve_args.add_argument('--source-interval', type=float, default=SERVE_SOURCE_INTERVAL,
+                            help='segundos entre coletas de uma fonte sem "refresh" proprio (padrao: %(default)s)')
+    query_args = parser.add_argument_group('modo query (e ?group=&region=&source=&name= no serve)')
+    query_args.add_argument('--group', help='grupo final (BR Noticias, BR, US, CA, Others)')
+    query_args.add_argument('--region', help='regiao da fonte (BR, US, CA, ...)')
+    query_args.add_argument('--source', help='nome da fonte')
+    query_args.add_argument('--name', help='prefixo do nome do canal (sem diferenciar maiusculas)')
+    query_args.add_argument('-o', '--output', help='arquivo de saida (padrao: saida padrao)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    global _HTTP_CLIENT, PROBE_TIERED, PROBE_TIMEOUT_MAX, PARSE_PROCESSES, SOURCES, EXTRA_CHANNELS, EPG_SOURCES, \
+        EPG_URL, PROBE_MAX_STARTUP, PROBE_SCORE_ORDER
+    EPG_URL = args.epg_url
+    PROBE_MAX_STARTUP = args.max_latency
+    PROBE_SCORE_ORDER = args.score_order
+    if args.sources:
+        SOURCES, EXTRA_CHANNELS, EPG_SOURCES = load_source_registry(args.sources)
+    PARSE_PROCESSES = args.parse_processes
+    PROBE_TIERED = args.probe_mode == 'tiered'
+    PROBE_TIMEOUT_MAX = max(args.probe_timeout_max, args.probe_timeout)
+    if args.command == 'query':
+        return query_playlist(args)
+    _HTTP_CLIENT = HttpClient(pool_size=args.pool_size)
+    if args.command == 'serve':
+        return serve(args)
+
     print("=" * 60)
     print("IPTV PLAYLIST GENERATOR")
     print("=" * 60)
     print(f"Data: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}")
 
-    # 1. Coletar canais
-    all_channels = collect_all_channels()
-
-    if not all_channels:
+    # 1. Coletar e testar canais em pipeline: cada canal unico vai para o
+    # teste assim que sua fonte o entrega (somente os que venceram no cache)
+    store = ProbeStore(args.probe_store)
+    near = NearDuplicateIndex() if NEAR_DUP_ENABLED and not args.no_near_dedup else None
+    source_cache = SourceCache(conditional=not args.refresh_sources,
+                               schedule=not (args.refresh_sources or args.fetch_all))
+    stream = start_collection(source_cache, near=near)
+    cached = []
+
+    def to_probe():
+        for ch in stream:
+            hit = None if args.reprobe_all else store.lookup(ch)
+            if hit:
+                cached.append(hit)
+            else:
+                yield ch
+
+    with RUN_METRICS.stage('probe'):
+        results, working = probe_channels(to_probe(), engine=args.probe_engine,
+                                          concurrency=args.concurrency, per_host=args.per_host,
+                                          timeout=args.probe_timeout)
+        # Resultados passam para a copia preferida de cada URL, e os grupos
+        # de quase duplicados sao refeitos com elas
+        results, cached = stream.preferred(results), stream.preferred(cached)
+        fallback_probed = recovered = 0
+        if near:
+            stream.regroup()
+            # Grupos sem nenhuma URL OK: testa a seguinte de cada um; "recuperado"
+            # e o canal que so ficou OK numa alternativa (as anteriores falharam)
+            fallbacks = near.next_candidates()
+            tried = set()
+            while fallbacks:
+                hits, misses = ([], fallbacks) if args.reprobe_all else store.split(fallbacks)
+                cached += hits
+                more, ok = probe_channels(misses, engine=args.probe_engine, concurrency=args.concurrency,
+                                          per_host=args.per_host, timeout=args.probe_timeout, verbose=False)
+                results += more
+                working += ok
+                fallback_probed += sum(1 for ch in fallbacks if ch in near.alternates)
+                recovered += sum(1 for ch in fallbacks if ch.status == 'OK' and ch in near.alternates)
+                tried.update(map(id, fallbacks))  # um canal que ficou sem status nao volta a rodada
+                fallbacks = [ch for ch in near.next_candidates() if id(ch) not in tried]
+    stream.summary()
+    report_sources()
+    if fallback_probed:
+        print(f"  URLs alternativas: {fallback_probed} testadas, {recovered} canais recuperados")
+    print(f"\nCache de testes: {len(cached)} reaproveitados, {len(results)} testados")
+    store.record(results)
+
+    probed = list(results)
+    results += cached
+    working += sum(1 for r in cached if r.status == 'OK')
+
+    RUN_METRICS.counts.update(collected=stream.total, unique=stream.unique, probed=len(probed),
+                              cached=len(cached), working=working, near_duplicates=stream.near_duplicates,
+                              fallback_probed=fallback_probed, recovered=recovered)
+    if not results:
         print("Nenhum canal encontrado!")
+        store.close()
+        RUN_METRICS.write(args.metrics, probed, args.metrics_prom)
         return
 
-    # 2. Testar canais
-    results, working = test_channels_parallel(all_channels)
-
-    # Filtrar funcionando
-    working_channels = [r for r in results if r['status'] == 'OK']
-
-    print(f"\nResultado: {working}/{len(all_channels)} funcionando ({working*100//len(all_channels)}%)")
-
-    # 3. Gerar playlist
-    playlist_content = generate_m3u_content(working_channels)
-
-    # 4. Salvar
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        f.write(playlist_content)
-
-    print(f"\nPlaylist salva: {OUTPUT_FILE}")
+    # Filtrar funcionando; entre URLs OK do mesmo canal fica a de melhor qualidade
+    working_channels = [r for r in results if r.status == 'OK']
+    if near:
+        working_channels = pick_best_duplicates(working_channels, near, store)
+    store.close()
+
+    print(f"\nResultado: {working}/{len(results)} funcionando ({working*100//len(results)}%)")
+    scores = _percentiles([ch.score for ch in working_channels if ch.score is not None])
+    if scores:
+        print(f"Inicio estimado: p50 {scores['p50']:.2f}s, p95 {scores['p95']:.2f}s, p99 {scores['p99']:.2f}s")
+    if PROBE_MAX_STARTUP:
+        fast = drop_slow_channels(working_channels)
+        RUN_METRICS.counts['slow_dropped'] = len(working_channels) - len(fast)
+        print(f"  {len(working_channels) - len(fast)} canais com inicio acima de {PROBE_MAX_STARTUP:g}s removidos")
+        working_channels = fast
+
+    if args.check_logos:
+        with RUN_METRICS.stage('logos'):
+            logos = LogoStore()
+            working_channels, logo_counts = validate_logos(working_channels, logos, args.broken_logos)
+            logos.close()
+        RUN_METRICS.counts.update(logo_counts)
+        report_logos(logo_counts)
+
+    # 3. Gerar e salvar a playlist (streaming, com copias comprimidas e indice)
+    with RUN_METRICS.stage('write'):
+        written = write_playlist(working_channels)
+        write_playlist_index(written.index)
+
+    print(f"\nPlaylist salva: {OUTPUT_FILE} ({written.size / 1e6:.1f} MB, sha256 {written.sha256[:16]})")
+    for path in written.outputs[1:]:
+        print(f"  {path}: {os.path.getsize(path) / 1e6:.2f} MB")
+    diff = written.diff
+    if diff:
+        write_diff_report(diff)
+        RUN_METRICS.counts.update(added=len(diff.added), removed=len(diff.removed), changed=len(diff.changed))
+        if diff.identical:
+            print("Sem mudancas em relacao a playlist anterior (arquivo identico)")
+        else:
+            print(f"Mudancas: +{len(diff.added)} novos, -{len(diff.removed)} removidos, "
+                  f"~{len(diff.changed)} alterados ({PLAYLIST_DIFF_FILE})")
     print(f"Total de canais: {len(working_channels)}")
 
+    # 4. Guia de programacao so com os canais da playlist
+    if EPG_SOURCES and not args.no_epg:
+        print("\nMontando o guia de programacao...")
+        with RUN_METRICS.stage('epg'):
+            epg_counts = merge_epg(working_channels)
+        RUN_METRICS.counts.update(epg_counts)
+        report_epg(epg_counts)
+    get_http_client().report()
+    PROBE_STATS.report()
+    HOST_LATENCY.report()
+    RUN_METRICS.write(args.metrics, probed, args.metrics_prom)
+
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())